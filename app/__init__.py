@@ -1,22 +1,42 @@
 from flask import Flask
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from flasgger import Swagger
 
 from app.config import Config
+from app.middleware.api_keys import api_key_store
+from app.middleware.auth import rate_limit_key, api_key_limits
 from app.utils.logger import setup_logger
+from app.utils.stats import TimedJSONProvider
+from app.utils.timing import request_timer
+from app.utils.profiler import request_profiler
+from app.utils.cache import result_cache
+from app.utils.near_duplicate import near_duplicate_cache
+from app.utils.fetcher import image_fetcher
+from app.services.batcher import ocr_batcher
+from app.services.executor import inference_pool
+from app.services.admission import admission_controller
+from app.services.models import model_manager
+from app.services.custom_models import model_registry
+from app.services.runtime import ort_runtime
+from app.services.jobs import job_queue
 
+# 按 API Key（未携带时按 IP）计数；各 Key 的限额在所有接口上共享。
+# 计数保存在 RATELIMIT_STORAGE_URI 中，多个 worker 共享时需使用 redis:// 等外部存储
 limiter = Limiter(
-    key_func=get_remote_address,
+    key_func=rate_limit_key,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    application_limits=[api_key_limits]
 )
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    # 记录响应序列化耗时
+    app.json = TimedJSONProvider(app)
+    
     # 初始化扩展
+    api_key_store.init_app(app)
     limiter.init_app(app)
     
     # 配置 Swagger
@@ -63,8 +83,40 @@ def create_app(config_class=Config):
     # 设置日志
     setup_logger(app)
     
+    # 请求耗时分解（Server-Timing）和按需性能分析
+    request_timer.init_app(app)
+    request_profiler.init_app(app)
+    
+    # 初始化识别结果缓存（字节哈希和近似重复图片）
+    result_cache.init_app(app)
+    near_duplicate_cache.init_app(app)
+    
+    # 初始化图片下载器
+    image_fetcher.init_app(app)
+    
+    # 初始化跨请求批处理
+    ocr_batcher.init_app(app)
+    
+    # 初始化推理线程池
+    inference_pool.init_app(app)
+    
+    # 初始化准入控制（按推理线程数估算积压请求的完成时间）
+    admission_controller.init_app(app)
+    
+    # 初始化 onnxruntime 会话参数（需在加载任何模型之前）
+    ort_runtime.init_app(app)
+    
+    # 初始化自定义模型目录
+    model_registry.init_app(app)
+    
+    # 初始化离线任务队列（后台线程在各 worker 收到第一个请求时启动）
+    job_queue.init_app(app)
+    
     # 注册蓝图
     from app.routes import api_bp
     app.register_blueprint(api_bp)
     
+    # 预加载模型（需在注册蓝图、创建 CaptchaService 之后）
+    model_manager.init_app(app)
+    
     return app
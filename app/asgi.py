@@ -0,0 +1,209 @@
+"""ASGI 服务模式
+
+在事件循环中处理连接（keep-alive）、读取请求体和下载 URL 图片，再把请求交给
+Flask 应用在线程池中执行，因此 api_bp 中的所有路由、认证、限流和统计都保持不变。
+Flask 返回的响应按块发送，流式响应不会被缓冲。
+
+JSON 请求中的 URL 图片（image/slidingImage/backImage/images 字段）由 httpx 异步
+并发下载，结果通过 WSGI environ 传给 get_image_bytes，视图中不再同步下载。
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from app.middleware.api_keys import api_key_store
+from app.utils.fetcher import image_fetcher
+from app.utils.image_processor import PREFETCHED_ENVIRON_KEY, _is_url
+from app.utils.stats import stage_timer
+from app.utils.timing import PREFETCH_SECONDS_ENVIRON_KEY
+
+# 可能包含图片 URL 的请求字段
+IMAGE_FIELDS = ('image', 'slidingImage', 'backImage', 'images')
+# 与 get_image_bytes 的默认下载超时一致（秒）
+FETCH_TIMEOUT = 10
+
+
+class AsgiBridge:
+    """把 Flask 应用包装为 ASGI 应用"""
+
+    def __init__(self, app):
+        """
+        Args:
+            app: create_app() 返回的 Flask 应用
+        """
+        self.app = app
+        self.max_image_size = app.config.get('MAX_IMAGE_SIZE', 5 * 1024 * 1024)
+        # 执行 Flask 视图的线程数，即同时处理的请求数上限（推理另有推理线程池）
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, app.config.get('ASGI_THREADS', 32)),
+            thread_name_prefix='asgi'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+
+    async def _handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await image_fetcher.aclose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return  # 客户端已断开
+
+        environ = self._build_environ(scope, body)
+        prefetched = await self._prefetch(environ, body)
+        if prefetched:
+            environ[PREFETCHED_ENVIRON_KEY] = prefetched
+
+        loop = asyncio.get_running_loop()
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(self.executor, self._run_wsgi, environ, send_sync)
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    @staticmethod
+    def _build_environ(scope, body):
+        """按 PEP 3333 把 ASGI scope 转换为 WSGI environ"""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        client = scope.get('client')
+        if client:
+            environ['REMOTE_ADDR'] = client[0]
+            environ['REMOTE_PORT'] = str(client[1])
+        for name, value in scope['headers']:
+            name = name.decode('latin-1')
+            if name == 'content-type':
+                key = 'CONTENT_TYPE'
+            elif name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key in environ:
+                value = f"{environ[key]},{value}"
+            environ[key] = value
+        return environ
+
+    def _authorized(self, environ):
+        """未通过认证的请求不预先下载图片，由视图返回 401/403"""
+        if not api_key_store.enabled:
+            return True
+        api_key = environ.get('HTTP_X_API_KEY')
+        if not api_key:
+            api_key = (parse_qs(environ['QUERY_STRING']).get('api_key') or [None])[0]
+        return bool(api_key) and api_key_store.lookup(api_key) is not None
+
+    async def _prefetch(self, environ, body):
+        """
+        异步下载 JSON 请求中的 URL 图片
+
+        Returns:
+            dict: {url: 图片字节流或 ValueError}，没有需要下载的图片时返回 None
+        """
+        if environ['REQUEST_METHOD'] != 'POST' or b'://' not in body:
+            return None
+        if not environ.get('CONTENT_TYPE', '').startswith('application/json'):
+            return None
+        if not self._authorized(environ):
+            return None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        urls = []
+        for field in IMAGE_FIELDS:
+            value = data.get(field)
+            urls.extend(item for item in (value if isinstance(value, list) else [value]) if _is_url(item))
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return None
+
+        started = time.perf_counter()
+        with stage_timer('fetch'):
+            contents = await image_fetcher.fetch_many_async(urls, self.max_image_size, FETCH_TIMEOUT)
+        # 下载发生在进入 Flask 之前，耗时通过 environ 计入请求的耗时分解
+        environ[PREFETCH_SECONDS_ENVIRON_KEY] = time.perf_counter() - started
+
+        prefetched = {}
+        for url, content in zip(urls, contents):
+            if isinstance(content, Exception) and not isinstance(content, ValueError):
+                content = ValueError(f"图片下载失败: {str(content)}")
+            prefetched[url] = content
+        return prefetched
+
+    def _run_wsgi(self, environ, send):
+        """在线程池中执行 Flask 应用，并把响应逐块发送给客户端"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        def send_start():
+            response['started'] = True
+            send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not response.get('started'):
+                    send_start()
+                send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not response.get('started'):
+                send_start()
+            send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
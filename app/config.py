@@ -8,16 +8,112 @@ class Config:
     LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s - %(message)s'
     
     # API 认证（可选）
-    API_KEYS = os.environ.get('API_KEYS', '')  # 逗号分隔的 API Keys
+    API_KEYS = os.environ.get('API_KEYS', '')  # 逗号分隔的 API Keys（明文或 sha256:<摘要>）
+    # API Key 文件（每行一个 Key，可设置单独的限额），修改后自动重新加载
+    API_KEYS_FILE = os.environ.get('API_KEYS_FILE', '')
+    API_KEYS_RELOAD_INTERVAL = float(os.environ.get('API_KEYS_RELOAD_INTERVAL', 5))
+    # 每个 API Key 在所有接口上共享的默认限额（如 "1000 per hour;20000 per day"），留空不限制
+    API_KEY_DEFAULT_LIMITS = os.environ.get('API_KEY_DEFAULT_LIMITS', '')
+    # 各 API Key 的识别参数默认值（JSON），如 {"key1": {"charset": "digits", "length": 4}}
+    API_KEY_OCR_DEFAULTS = os.environ.get('API_KEY_OCR_DEFAULTS', '')  # JSON，键为 Key 的 id（SHA-256 摘要的前 12 位）
+    ADMIN_API_KEYS = os.environ.get('ADMIN_API_KEYS', '')  # 逗号分隔，可访问 /admin/*，留空时管理接口不可用
     
     # API配置
     MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 20))
+    # 流式批量识别（/batch/stream）同时处理的图片数，图片总数不限
+    STREAM_MAX_IN_FLIGHT = int(os.environ.get('STREAM_MAX_IN_FLIGHT', 8))
+    
+    # 离线任务队列（/jobs）：任务保存在 SQLite 数据库中，所有 worker 共享
+    JOB_QUEUE_ENABLED = os.environ.get('JOB_QUEUE_ENABLED', 'False').lower() == 'true'
+    JOB_DB_PATH = os.environ.get('JOB_DB_PATH', '/tmp/captcha-api-jobs.db')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))  # 每个 worker 进程处理任务的后台线程数
+    JOB_CLAIM_SIZE = int(os.environ.get('JOB_CLAIM_SIZE', 16))  # 每次认领的图片数（文字识别合并为一次推理）
+    JOB_MAX_ITEMS = int(os.environ.get('JOB_MAX_ITEMS', 100000))  # 单个任务的图片数上限
+    JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', 24))  # 已结束任务的保留时间
+    JOB_ITEM_TIMEOUT = float(os.environ.get('JOB_ITEM_TIMEOUT', 300))  # 认领后未完成（进程退出）的图片重新排队的时间（秒）
     DEFAULT_RATE_LIMIT = os.environ.get('DEFAULT_RATE_LIMIT', "30 per minute")
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'True').lower() == 'true'  # 压测时可关闭限流
+    # 限流计数存储：memory:// 为每个 worker 单独计数，redis://host:6379/1 为所有 worker 共享（需安装 redis）
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
+    # 响应中带 X-RateLimit-Limit/Remaining/Reset 头（每个请求多一次计数存储查询）
+    RATELIMIT_HEADERS_ENABLED = os.environ.get('RATELIMIT_HEADERS_ENABLED', 'False').lower() == 'true'
     
     # 图片处理配置
     MAX_IMAGE_SIZE = int(os.environ.get('MAX_IMAGE_SIZE', 5 * 1024 * 1024))  # 5MB
     ALLOWED_IMAGE_FORMATS = ['JPEG', 'PNG', 'BMP', 'GIF', 'WEBP']
     
+    # 模型加载配置：模型默认在首次使用时加载，这里列出的模型在启动时预加载
+    # （配合 gunicorn preload_app，预加载的模型由各 worker 共享）
+    # 可选: ocr, det, batch_ocr
+    MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'ocr,batch_ocr')
+    
+    # onnxruntime 会话参数（替换 ddddocr 使用默认参数创建的会话）
+    ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))  # 0 表示 CPU 核数 / (WORKERS * INFERENCE_POOL_SIZE)
+    ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 1))  # 只在 parallel 执行模式下使用
+    ORT_GRAPH_OPTIMIZATION = os.environ.get('ORT_GRAPH_OPTIMIZATION', 'all')  # disable / basic / extended / all
+    ORT_EXECUTION_MODE = os.environ.get('ORT_EXECUTION_MODE', 'sequential')  # sequential / parallel
+    ORT_ALLOW_SPINNING = os.environ.get('ORT_ALLOW_SPINNING', 'True').lower() == 'true'  # 空闲线程是否自旋等待
+    # 识别模型：float（默认，common_old.onnx 还原为浮点权重，可合并推理）/ quantized（原模型，逐张推理）/ beta（common.onnx）
+    ORT_OCR_MODEL = os.environ.get('ORT_OCR_MODEL', 'float')
+    # 使用 INT8 量化版本的模型（逗号分隔，可选 ocr,det），量化结果保存在 ORT_MODEL_CACHE_DIR
+    ORT_QUANTIZED_MODELS = os.environ.get('ORT_QUANTIZED_MODELS', '')
+    ORT_MODEL_CACHE_DIR = os.environ.get('ORT_MODEL_CACHE_DIR', '/tmp/captcha-api-models')
+    ORT_CALIBRATION_DIR = os.environ.get('ORT_CALIBRATION_DIR', '')  # 检测模型静态量化用的样本图片目录
+    
+    # 自定义识别模型：目录下的 <name>.onnx + <name>.json，请求中用 model 参数选择，留空不启用
+    CUSTOM_MODEL_DIR = os.environ.get('CUSTOM_MODEL_DIR', '')
+    CUSTOM_MODEL_MAX_MEMORY_MB = int(os.environ.get('CUSTOM_MODEL_MAX_MEMORY_MB', 512))  # 超出后卸载最久未使用的模型
+    CUSTOM_MODEL_RELOAD_INTERVAL = float(os.environ.get('CUSTOM_MODEL_RELOAD_INTERVAL', 5))  # 检查模型文件变化的间隔（秒）
+    
+    # 滑块匹配/对比的默认实现：opencv 或 ddddocr（请求中可用 engine 参数指定）
+    SLIDE_ENGINE = os.environ.get('SLIDE_ENGINE', 'opencv')
+    
+    # 识别结果缓存配置
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() == 'true'
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024))  # 32MB
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 600))  # 秒，0 表示不过期
+    RESULT_CACHE_URL = os.environ.get('RESULT_CACHE_URL', '')  # 共享后端，如 redis://localhost:6379/0，留空使用进程内缓存
+    
+    # 近似重复图片缓存：重新编码的同一张验证码按感知哈希命中（进程内，默认关闭）
+    NEAR_DUPLICATE_CACHE_ENABLED = os.environ.get('NEAR_DUPLICATE_CACHE_ENABLED', 'False').lower() == 'true'
+    NEAR_DUPLICATE_HASH = os.environ.get('NEAR_DUPLICATE_HASH', 'phash')  # phash / dhash
+    NEAR_DUPLICATE_HASH_SIZE = int(os.environ.get('NEAR_DUPLICATE_HASH_SIZE', 16))  # 哈希位数为其平方
+    NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', 16))  # 汉明距离阈值
+    NEAR_DUPLICATE_MAX_ENTRIES = int(os.environ.get('NEAR_DUPLICATE_MAX_ENTRIES', 4096))
+    NEAR_DUPLICATE_TTL = int(os.environ.get('NEAR_DUPLICATE_TTL', 600))  # 秒，0 表示不过期
+    
+    # 跨请求动态批处理（合并并发的 /classification 请求为一次推理）
+    MICRO_BATCH_ENABLED = os.environ.get('MICRO_BATCH_ENABLED', 'True').lower() == 'true'
+    MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 16))
+    MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', 5))  # 毫秒
+    MICRO_BATCH_QUEUE_SIZE = int(os.environ.get('MICRO_BATCH_QUEUE_SIZE', 64))  # 超出后返回 503
+    
+    # 推理线程池（避免 CPU 密集的推理阻塞 gevent 事件循环）
+    INFERENCE_POOL_ENABLED = os.environ.get('INFERENCE_POOL_ENABLED', 'True').lower() == 'true'
+    INFERENCE_POOL_SIZE = int(os.environ.get('INFERENCE_POOL_SIZE', 2))
+    INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 32))  # 超出后返回 503
+    
+    # 准入控制：预计完成时间超过延迟目标的请求先排队，仍超出时返回 503 和 Retry-After
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'True').lower() == 'true'
+    ADMISSION_LATENCY_SLO_MS = float(os.environ.get('ADMISSION_LATENCY_SLO_MS', 2000))  # 毫秒
+    ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', 64))  # 每个 worker 同时排队的请求数上限
+    
+    # 图片 URL 下载配置
+    FETCH_POOL_MAXSIZE = int(os.environ.get('FETCH_POOL_MAXSIZE', 10))  # 每个 host 的 keep-alive 连接数
+    FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', 8))  # 单个请求内并发下载数
+    FETCH_CACHE_MAX_BYTES = int(os.environ.get('FETCH_CACHE_MAX_BYTES', 16 * 1024 * 1024))  # 16MB
+    FETCH_CACHE_TTL = int(os.environ.get('FETCH_CACHE_TTL', 300))  # 响应未指定 max-age 时的缓存时间（秒）
+    FETCH_MAX_HOSTS = int(os.environ.get('FETCH_MAX_HOSTS', 64))  # 单独统计和保持连接的 host 数上限
+    
+    # ASGI 模式（asgi.py）：同时执行 Flask 视图的线程数
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    
+    # 请求耗时分解：request 为请求带 X-Timing: 1 时返回 Server-Timing 头和 timing 字段，
+    # always 为所有响应都带 Server-Timing 头，off 为不记录
+    REQUEST_TIMING = os.environ.get('REQUEST_TIMING', 'request')
+    # 性能分析（/admin/profile）的开关和结果目录，多个 worker 共享
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/captcha-api-profiles')
+    
     # 请求超时配置
     REQUEST_TIMEOUT = int(os.environ.get('REQUEST_TIMEOUT', 60))  # 秒
     
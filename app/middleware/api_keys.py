@@ -0,0 +1,201 @@
+"""API Key 存储
+
+API Key 来自 API_KEYS 配置（逗号分隔）和 API_KEYS_FILE 文件，启动时解析一次，
+以 SHA-256 摘要为键保存，每个请求只需计算一次摘要再查字典，比较的是摘要而不是
+Key 本身，响应时间不会泄露 Key 的内容。文件中也可以只保存摘要，不保存明文 Key。
+
+API_KEYS_FILE 每行一个 Key，# 开头为注释，Key 后面可以跟该 Key 的限额
+（flask-limiter 格式，多个用分号分隔），未设置时使用 API_KEY_DEFAULT_LIMITS：
+
+    key1
+    sha256:<Key 的 SHA-256 十六进制摘要> 100/minute;10000/day
+    key2 1000 per day
+
+文件修改后在 API_KEYS_RELOAD_INTERVAL 秒内自动重新加载；新文件无法解析或被删除时
+继续使用已加载的 Key（配置了文件时始终启用认证，避免误删文件后接口变为无需认证）。
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from limits import parse_many
+
+logger = logging.getLogger(__name__)
+
+DIGEST_PREFIX = 'sha256:'
+
+# id 为摘要的前 12 位，用于限流计数和管理接口，不泄露 Key
+ApiKey = namedtuple('ApiKey', ['id', 'limits'])
+
+
+def digest_key(key):
+    """API Key 的 SHA-256 十六进制摘要"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _parse_entry(token, limits=''):
+    """
+    解析一个 Key（明文或 sha256:<摘要>）
+
+    Returns:
+        tuple: (摘要, ApiKey)
+
+    Raises:
+        ValueError: 摘要格式或限额无效
+    """
+    if token.startswith(DIGEST_PREFIX):
+        digest = token[len(DIGEST_PREFIX):].lower()
+        if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+            raise ValueError(f"无效的 SHA-256 摘要: {token}")
+    else:
+        digest = digest_key(token)
+    limits = limits.strip()
+    if limits:
+        parse_many(limits)  # 提前检查格式，避免请求时才报错
+    return digest, ApiKey(digest[:12], limits)
+
+
+def parse_key_file(path):
+    """
+    解析 API Key 文件
+
+    Returns:
+        dict: {摘要: ApiKey}
+
+    Raises:
+        OSError: 文件无法读取
+        ValueError: 某一行格式无效
+    """
+    keys = {}
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 1)
+            try:
+                digest, key = _parse_entry(fields[0], fields[1] if len(fields) > 1 else '')
+            except ValueError as e:
+                raise ValueError(f"{path} 第 {number} 行: {e}") from e
+            keys[digest] = key
+    return keys
+
+
+class ApiKeyStore:
+    """API Key 存储（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.path = ''
+        self.reload_interval = 5.0
+        self.default_limits = ''
+        self._env_keys = {}
+        self._keys = {}
+        self._by_id = {}
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._reloads = 0
+        self._reload_failures = 0
+
+    def init_app(self, app):
+        """
+        根据 API_KEYS / API_KEYS_FILE 配置加载 Key
+
+        Raises:
+            OSError, ValueError: 配置无效（启动时直接报错）
+        """
+        self.path = app.config.get('API_KEYS_FILE', '')
+        self.reload_interval = float(app.config.get('API_KEYS_RELOAD_INTERVAL', 5))
+        self.default_limits = app.config.get('API_KEY_DEFAULT_LIMITS', '')
+        if self.default_limits:
+            parse_many(self.default_limits)
+        self._env_keys = dict(
+            _parse_entry(token.strip()) for token in app.config.get('API_KEYS', '').split(',') if token.strip()
+        )
+        self._signature = None
+        file_keys = self._load_file() if self.path else {}
+        self._replace(file_keys)
+
+    @property
+    def enabled(self):
+        """是否启用认证（配置了 API_KEYS 或 API_KEYS_FILE）"""
+        return bool(self._keys) or bool(self.path)
+
+    def lookup(self, key):
+        """
+        查找 API Key
+
+        Returns:
+            ApiKey: 有效时返回，否则返回 None
+        """
+        self._maybe_reload()
+        return self._keys.get(digest_key(key))
+
+    def get(self, key_id):
+        """按 id 查找 API Key，没有时返回 None"""
+        self._maybe_reload()
+        return self._by_id.get(key_id)
+
+    def limits_for(self, key):
+        """Key 的限额（未单独设置时为 API_KEY_DEFAULT_LIMITS）"""
+        return key.limits or self.default_limits
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_file(self):
+        signature = self._file_signature()
+        keys = parse_key_file(self.path)
+        self._signature = signature
+        return keys
+
+    def _replace(self, file_keys):
+        keys = dict(self._env_keys)
+        keys.update(file_keys)
+        # 整体替换，查找时不需要加锁
+        self._keys = keys
+        self._by_id = {key.id: key for key in keys.values()}
+        self._loaded_at = time.time()
+        self._next_check = time.monotonic() + self.reload_interval
+
+    def _maybe_reload(self):
+        """文件有变化时重新加载（其他线程正在加载时直接使用已加载的 Key）"""
+        if not self.path or time.monotonic() < self._next_check:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            try:
+                if self._file_signature() == self._signature:
+                    return
+                file_keys = self._load_file()
+            except (OSError, ValueError) as e:
+                self._reload_failures += 1
+                logger.error(f"API Key 文件加载失败，继续使用已加载的 {len(self._keys)} 个 Key: {e}")
+                return
+            self._replace(file_keys)
+            self._reloads += 1
+            logger.info(f"已重新加载 API Key 文件: {len(self._keys)} 个 Key")
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """获取 Key 存储状态"""
+        return {
+            'enabled': self.enabled,
+            'keys': len(self._keys),
+            'file': self.path or None,
+            'loaded_at': self._loaded_at,
+            'reloads': self._reloads,
+            'reload_failures': self._reload_failures,
+            'default_limits': self.default_limits or None
+        }
+
+
+api_key_store = ApiKeyStore()
@@ -1,29 +1,102 @@
 """API 认证中间件"""
-from functools import wraps
-from flask import request, jsonify, current_app
+import hmac
+import json
+import logging
+from functools import lru_cache, wraps
+from flask import request, jsonify, current_app, g
+from flask_limiter.util import get_remote_address
+from limits import parse_many
+
+from app.middleware.api_keys import api_key_store
+
+logger = logging.getLogger(__name__)
+
+def parse_api_keys(api_keys_str):
+    """解析逗号分隔的 API Key 配置"""
+    return [key.strip() for key in api_keys_str.split(',') if key.strip()]
+
+def get_api_key():
+    """当前请求携带的 API Key（X-API-Key 请求头或 api_key 查询参数）"""
+    return request.headers.get('X-API-Key') or request.args.get('api_key')
+
+@lru_cache(maxsize=4)
+def _parse_key_defaults(value):
+    try:
+        defaults = json.loads(value) if value else {}
+    except ValueError as e:
+        logger.error(f"API_KEY_OCR_DEFAULTS 不是有效的 JSON: {e}")
+        return {}
+    return defaults if isinstance(defaults, dict) else {}
+
+def get_key_ocr_defaults():
+    """
+    当前 API Key 的识别参数默认值（API_KEY_OCR_DEFAULTS 配置，按 Key 的 id 查找，
+    配置中不出现明文 Key），未携带有效 Key 或没有配置时返回空 dict
+    """
+    key = current_api_key()
+    if key is None:
+        return {}
+    defaults = _parse_key_defaults(current_app.config.get('API_KEY_OCR_DEFAULTS', ''))
+    return defaults.get(key.id) or {}
+
+def current_api_key():
+    """
+    当前请求携带的有效 API Key（每个请求只查找一次）
+
+    Returns:
+        ApiKey: 未携带或无效时返回 None
+    """
+    if '_api_key' not in g:
+        api_key = get_api_key()
+        g._api_key = api_key_store.lookup(api_key) if api_key else None
+    return g._api_key
+
+def key_limit_key(key):
+    """API Key 在限流计数存储中的键"""
+    return f"key:{key.id}"
+
+def rate_limit_key():
+    """限流的计数维度：携带有效 API Key 时按 Key 计数（多个 IP 共用同一个 Key 的额度），否则按客户端 IP"""
+    key = current_api_key()
+    return key_limit_key(key) if key else get_remote_address()
+
+def api_key_limits():
+    """当前 API Key 在所有接口上共享的限额（API_KEYS_FILE 中设置或 API_KEY_DEFAULT_LIMITS），未携带 Key 时为空"""
+    key = current_api_key()
+    return api_key_store.limits_for(key) if key else ''
+
+def quota_charger():
+    """
+    按图片计入 API Key 限额的计数函数（流式批量识别、离线任务的请求本身只计一次）
+
+    Returns:
+        callable: charge(cost=1)，超出限额时返回 False；Key 没有限额或未启用限流时返回 None
+    """
+    from app import limiter  # app 在创建 limiter 前导入本模块
+
+    limits = api_key_limits()
+    if not limits or not limiter.enabled:
+        return None
+    # 与 flask-limiter 应用级限额的计数键一致：(Key, 'global')
+    items, key = parse_many(limits), key_limit_key(current_api_key())
+    return lambda cost=1: all([limiter.limiter.hit(item, key, 'global', cost=cost) for item in items])
 
 def require_api_key(f):
     """API Key 认证装饰器"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # 从 Flask config 获取 API Keys
-        api_keys_str = current_app.config.get('API_KEYS', '')
-        api_keys = [key.strip() for key in api_keys_str.split(',') if key.strip()]
-        
-        # 如果没有配置 API_KEYS，则不启用认证
-        if not api_keys:
+        # 如果没有配置 API_KEYS / API_KEYS_FILE，则不启用认证
+        if not api_key_store.enabled:
             return f(*args, **kwargs)
         
         # 从请求头获取 API Key
-        api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
-        
-        if not api_key:
+        if not get_api_key():
             return jsonify({
                 'error': 'Missing API Key',
                 'message': 'Please provide API Key in X-API-Key header or api_key parameter'
             }), 401
         
-        if api_key not in api_keys:
+        if current_api_key() is None:
             return jsonify({
                 'error': 'Invalid API Key',
                 'message': 'The provided API Key is not valid'
@@ -32,3 +105,25 @@ def require_api_key(f):
         return f(*args, **kwargs)
     
     return decorated_function
+
+def require_admin_key(f):
+    """管理接口认证装饰器：只接受 ADMIN_API_KEYS 中的 Key，未配置时管理接口不可用"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admin_keys = parse_api_keys(current_app.config.get('ADMIN_API_KEYS', ''))
+        if not admin_keys:
+            return jsonify({
+                'error': 'Admin API disabled',
+                'message': 'Set ADMIN_API_KEYS to enable admin endpoints'
+            }), 403
+        
+        api_key = get_api_key()
+        if not api_key or not any(hmac.compare_digest(api_key.encode(), key.encode()) for key in admin_keys):
+            return jsonify({
+                'error': 'Invalid Admin API Key',
+                'message': 'Please provide an admin API Key in X-API-Key header'
+            }), 403
+        
+        return f(*args, **kwargs)
+    
+    return decorated_function
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api_bp = Blueprint('api', __name__)
 
-from app.routes import captcha_routes, system_routes
+from app.routes import captcha_routes, system_routes, admin_routes, job_routes
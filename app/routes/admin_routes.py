@@ -0,0 +1,156 @@
+from flask import jsonify, request, Response
+from limits import parse_many
+from app import limiter
+from app.routes import api_bp
+from app.middleware.api_keys import api_key_store
+from app.middleware.auth import key_limit_key, require_admin_key
+from app.utils.profiler import request_profiler
+from app.utils.request_parser import get_request_data
+
+@api_bp.route('/admin/profile', methods=['GET'])
+@require_admin_key
+def profile_status():
+    """
+    性能分析状态和结果（所有 worker 汇总）
+    ---
+    tags:
+      - 管理
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [status, collapsed, pstats, prof]
+        default: status
+        description: status 为开关状态；collapsed 为 sampling 模式的火焰图数据；pstats 为 cprofile 模式按累计耗时排序的文本；prof 为 cprofile 模式合并后的 .prof 文件
+      - name: limit
+        in: query
+        type: integer
+        default: 50
+        description: pstats 输出的函数数
+    responses:
+      200:
+        description: 状态或分析结果
+      403:
+        description: 未配置 ADMIN_API_KEYS 或 Key 无效
+    """
+    output = request.args.get('format', 'status')
+    if output == 'status':
+        return jsonify(request_profiler.status())
+    request_profiler.status()  # 先写出当前 worker 尚未写入文件的结果
+    if output == 'collapsed':
+        return Response(request_profiler.collapsed_stacks(), content_type='text/plain; charset=utf-8')
+    if output == 'pstats':
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({'error': 'limit 必须是整数'}), 400
+        return Response(request_profiler.cprofile_text(limit), content_type='text/plain; charset=utf-8')
+    if output == 'prof':
+        return Response(
+            request_profiler.cprofile_dump(),
+            content_type='application/octet-stream',
+            headers={'Content-Disposition': 'attachment; filename=captcha-api.prof'}
+        )
+    return jsonify({'error': f'不支持的格式: {output}'}), 400
+
+@api_bp.route('/admin/profile', methods=['POST'])
+@require_admin_key
+def profile_enable():
+    """
+    打开性能分析（清除上次的结果，duration 秒后自动关闭）
+    ---
+    tags:
+      - 管理
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          properties:
+            mode:
+              type: string
+              enum: [cprofile, sampling]
+            sample_rate:
+              type: number
+              default: 0.1
+              description: 抽样比例 (0, 1]
+            duration:
+              type: number
+              default: 60
+              description: 持续时间（秒）
+    responses:
+      200:
+        description: 开关状态
+      400:
+        description: 参数错误
+    """
+    data = get_request_data() or {}
+    try:
+        control = request_profiler.enable(
+            data.get('mode', 'sampling'),
+            data.get('sample_rate', 0.1),
+            data.get('duration', 60)
+        )
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    return jsonify({'success': True, 'profile': control})
+
+@api_bp.route('/admin/profile', methods=['DELETE'])
+@require_admin_key
+def profile_disable():
+    """
+    关闭性能分析（保留已有结果）
+    ---
+    tags:
+      - 管理
+    security:
+      - ApiKeyAuth: []
+    responses:
+      200:
+        description: 已关闭
+    """
+    request_profiler.disable()
+    return jsonify({'success': True})
+
+@api_bp.route('/admin/keys/<key_id>', methods=['GET'])
+@require_admin_key
+def key_usage(key_id):
+    """
+    API Key 的限额和当前用量（来自限流计数存储，RATELIMIT_STORAGE_URI 为共享存储时为所有 worker 的合计）
+    ---
+    tags:
+      - 管理
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: key_id
+        in: path
+        type: string
+        required: true
+        description: Key 的 id（SHA-256 摘要的前 12 位）
+    responses:
+      200:
+        description: 限额和用量
+      404:
+        description: Key 不存在
+    """
+    key = api_key_store.get(key_id)
+    if key is None:
+        return jsonify({'error': f'API Key 不存在: {key_id}'}), 404
+    limits = api_key_store.limits_for(key)
+    usage = []
+    if limits and limiter.enabled:
+        for item in parse_many(limits):
+            # 与 flask-limiter 应用级限额的计数键一致：(Key, 'global')
+            reset_at, remaining = limiter.limiter.get_window_stats(item, key_limit_key(key), 'global')
+            usage.append({
+                'limit': str(item),
+                'used': item.amount - remaining,
+                'remaining': remaining,
+                'reset_at': reset_at
+            })
+    return jsonify({'id': key.id, 'limits': limits or None, 'usage': usage})
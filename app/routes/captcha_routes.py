@@ -1,21 +1,45 @@
-from flask import request, jsonify, current_app
+from flask import jsonify, current_app, request, Response, stream_with_context
 from app.routes import api_bp
 from app import limiter
 from app.utils.stats import track_stats
+from app.services.admission import admission_controller
+from app.services.batch_stream import BatchStream, read_lines
 from app.services.captcha_service import CaptchaService
-from app.middleware.auth import require_api_key
+from app.services.executor import InferenceBusyError
+from app.middleware.auth import require_api_key, get_key_ocr_defaults, quota_charger
+from app.utils.request_parser import get_request_data, get_query_data
 
 # 初始化服务
 captcha_service = CaptchaService()
 
+def get_ocr_options(data):
+    """识别选项 charset/length/model：请求参数优先，其次是当前 API Key 的默认值"""
+    defaults = get_key_ocr_defaults()
+    return {name: data.get(name, defaults.get(name)) for name in ('charset', 'length', 'model')}
+
+def _batch_size():
+    """批量识别的图片数（准入控制按图片数估计耗时）"""
+    data = get_request_data() or {}
+    return len(data.get('images') or [])
+
+@api_bp.errorhandler(InferenceBusyError)
+def handle_inference_busy(e):
+    """推理线程池已满时快速失败，提示客户端稍后重试"""
+    current_app.logger.warning(f"推理繁忙，拒绝请求: {e}")
+    return jsonify({'error': '服务繁忙，请稍后重试'}), 503, {'Retry-After': '1'}
+
 @api_bp.route('/capcode', methods=['POST'])
 @limiter.limit("30 per minute")
 @track_stats('capcode')
 @require_api_key
+@admission_controller.admit('capcode')
 def capcode():
     """
     滑块验证码识别
     ---
+    consumes:
+      - application/json
+      - multipart/form-data
     tags:
       - 验证码识别
     security:
@@ -40,16 +64,20 @@ def capcode():
               type: boolean
               default: false
               description: 是否预处理图片
+            engine:
+              type: string
+              enum: [opencv, ddddocr]
+              description: 滑块匹配实现，默认使用 SLIDE_ENGINE 配置
     responses:
       200:
-        description: 识别结果
+        description: 识别结果（position 为缺口中心的 x 坐标，confidence 为匹配得分）
       400:
         description: 请求参数错误
       500:
         description: 服务器错误
     """
     try:
-        data = request.get_json()
+        data = get_request_data()
         
         # 参数验证
         if not data:
@@ -61,7 +89,8 @@ def capcode():
             data['slidingImage'],
             data['backImage'],
             data.get('simpleTarget', True),
-            data.get('preprocess', False)
+            data.get('preprocess', False),
+            data.get('engine')
         )
         
         if result is None:
@@ -72,6 +101,8 @@ def capcode():
         return jsonify({'error': f'缺少必需参数: {str(e)}'}), 400
     except ValueError as e:
         return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    except InferenceBusyError:
+        raise
     except Exception as e:
         current_app.logger.error(f"滑块识别错误: {e}", exc_info=True)
         return jsonify({'error': '服务器内部错误'}), 500
@@ -80,17 +111,21 @@ def capcode():
 @limiter.limit("30 per minute")
 @track_stats('slideComparison')
 @require_api_key
+@admission_controller.admit('slideComparison')
 def slide_comparison():
     """滑块对比识别"""
     try:
-        data = request.get_json()
+        data = get_request_data()
         result = captcha_service.slide_comparison(
             data['slidingImage'],
-            data['backImage']
+            data['backImage'],
+            data.get('engine')
         )
         if result is None:
             return jsonify({'error': '处理过程中出现错误'}), 500
         return jsonify({'result': result})
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -98,10 +133,15 @@ def slide_comparison():
 @limiter.limit("50 per minute")
 @track_stats('classification')
 @require_api_key
+@admission_controller.admit('classification')
 def classification():
     """
     OCR文字识别
     ---
+    consumes:
+      - application/json
+      - multipart/form-data
+      - application/octet-stream
     tags:
       - 验证码识别
     security:
@@ -119,19 +159,29 @@ def classification():
               type: boolean
               default: false
               description: 是否预处理图片
+            charset:
+              type: string
+              description: 允许的字符，预设名（digits/lowercase/uppercase/letters/lower_digits/upper_digits/alphanumeric）或字符串
+            length:
+              type: integer
+              description: 文本长度
+            model:
+              type: string
+              description: 自定义模型名（CUSTOM_MODEL_DIR 中的 <name>.onnx），默认使用 ddddocr 模型
     responses:
       200:
-        description: 识别结果
+        description: 识别结果（confidence 为各字符置信度的平均值，char_confidences 为每个字符的置信度）
     """
     try:
-        data = request.get_json()
+        data = get_request_data()
         
         if not data or 'image' not in data:
             return jsonify({'error': '缺少必需参数: image'}), 400
         
         result = captcha_service.classify(
             data['image'],
-            data.get('preprocess', False)
+            data.get('preprocess', False),
+            **get_ocr_options(data)
         )
         
         if result is None:
@@ -140,6 +190,8 @@ def classification():
         return jsonify({'success': True, 'result': result})
     except ValueError as e:
         return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    except InferenceBusyError:
+        raise
     except Exception as e:
         current_app.logger.error(f"OCR识别错误: {e}", exc_info=True)
         return jsonify({'error': '服务器内部错误'}), 500
@@ -148,10 +200,14 @@ def classification():
 @limiter.limit("10 per minute")
 @track_stats('batch_classification')
 @require_api_key
+@admission_controller.admit('batch_classification', units=_batch_size)
 def batch_classification():
     """
     批量OCR文字识别
     ---
+    consumes:
+      - application/json
+      - multipart/form-data
     parameters:
       - name: body
         in: body
@@ -166,12 +222,21 @@ def batch_classification():
             preprocess:
               type: boolean
               default: false
+            charset:
+              type: string
+              description: 允许的字符，预设名或字符串（对所有图片生效）
+            length:
+              type: integer
+              description: 文本长度（对所有图片生效）
+            model:
+              type: string
+              description: 自定义模型名（对所有图片生效）
     responses:
       200:
         description: 批量识别结果
     """
     try:
-        data = request.get_json()
+        data = get_request_data()
         
         if not data or 'images' not in data:
             return jsonify({'error': '缺少必需参数: images'}), 400
@@ -191,7 +256,8 @@ def batch_classification():
         
         result = captcha_service.batch_classify(
             images,
-            data.get('preprocess', False)
+            data.get('preprocess', False),
+            **get_ocr_options(data)
         )
         
         if result is None:
@@ -200,22 +266,76 @@ def batch_classification():
         return jsonify({'success': True, 'results': result, 'total': len(images)})
     except ValueError as e:
         return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    except InferenceBusyError:
+        raise
     except Exception as e:
         current_app.logger.error(f"批量识别错误: {e}", exc_info=True)
         return jsonify({'error': '服务器内部错误'}), 500
 
+@api_bp.route('/batch/stream', methods=['POST'])
+@limiter.limit("10 per minute")
+@track_stats('batch_stream')
+@require_api_key
+def batch_stream():
+    """
+    流式批量识别（NDJSON）
+    ---
+    consumes:
+      - application/x-ndjson
+    produces:
+      - application/x-ndjson
+    tags:
+      - 验证码识别
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: 每行一个 JSON 对象 {"image", "type", "id", "preprocess", "charset", "length", "model"}，图片数不限
+        schema:
+          type: string
+      - name: type
+        in: query
+        type: string
+        enum: [classification, calculate, detection, select]
+        default: classification
+        description: 请求行中未设置 type 时的识别类型
+      - name: preprocess
+        in: query
+        type: boolean
+        description: 请求行中未设置时的默认值（charset/length/model 同理）
+    responses:
+      200:
+        description: 每张图片完成后输出一行 {"index", "id", "result"} 或 {"index", "id", "error"}，最后一行为 {"done", "total", "succeeded", "failed"}
+    """
+    defaults = {**get_key_ocr_defaults(), **get_query_data()}
+    max_line = current_app.config['MAX_IMAGE_SIZE'] * 4 // 3 + 4096  # base64 编码后的图片和其他字段
+    stream = BatchStream(
+        captcha_service,
+        read_lines(request.stream, max_line),
+        defaults,
+        current_app.config.get('STREAM_MAX_IN_FLIGHT', 8),
+        quota_charger()  # 每张图片计入 API Key 的限额
+    )
+    lines = (current_app.json.dumps(entry) + '\n' for entry in stream)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
 @api_bp.route('/detection', methods=['POST'])
 @limiter.limit("30 per minute")
 @track_stats('detection')
 @require_api_key
+@admission_controller.admit('detection')
 def detection():
     """目标检测"""
     try:
-        data = request.get_json()
+        data = get_request_data()
         result = captcha_service.detect(data['image'])
         if result is None:
             return jsonify({'error': '处理过程中出现错误'}), 500
         return jsonify({'result': result})
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -223,14 +343,17 @@ def detection():
 @limiter.limit("30 per minute")
 @track_stats('calculate')
 @require_api_key
+@admission_controller.admit('calculate')
 def calculate():
     """计算类验证码识别"""
     try:
-        data = request.get_json()
+        data = get_request_data()
         result = captcha_service.calculate(data['image'])
         if result is None:
             return jsonify({'error': '处理过程中出现错误'}), 500
         return jsonify({'result': result})
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -259,7 +382,7 @@ def crop():
         description: 分割后的图片
     """
     try:
-        data = request.get_json()
+        data = get_request_data()
         
         if not data or 'image' not in data or 'y_coordinate' not in data:
             return jsonify({'error': '缺少必需参数: image 和 y_coordinate'}), 400
@@ -284,13 +407,16 @@ def crop():
 @limiter.limit("30 per minute")
 @track_stats('select')
 @require_api_key
+@admission_controller.admit('select')
 def select():
     """点选验证码识别"""
     try:
-        data = request.get_json()
+        data = get_request_data()
         result = captcha_service.click_select(data['image'])
         if result is None:
             return jsonify({'error': '处理过程中出现错误'}), 500
         return jsonify({'result': result})
+    except InferenceBusyError:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 400
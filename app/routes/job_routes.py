@@ -0,0 +1,221 @@
+from flask import jsonify, current_app, request
+from app.routes import api_bp
+from app import limiter
+from app.utils.stats import track_stats
+from app.services.batch_stream import read_lines
+from app.services.jobs import job_queue
+from app.middleware.auth import require_api_key, get_key_ocr_defaults, current_api_key, quota_charger
+from app.utils.request_parser import get_request_data, get_query_data
+
+# 任务级参数（其余参数作为各图片识别参数的默认值）
+JOB_FIELDS = ('images', 'items', 'priority')
+MAX_PAGE_SIZE = 1000
+
+def _owner():
+    """任务所属的 API Key id（未启用认证时为 None）"""
+    key = current_api_key()
+    return key.id if key else None
+
+class _QuotaExceeded(Exception):
+    """任务中的图片数超出 API Key 的限额"""
+
+def _charged(lines, charge):
+    """NDJSON 任务的图片数事先未知，每读取一行计入一次限额"""
+    for line in lines:
+        if not charge():
+            raise _QuotaExceeded()
+        yield line
+
+def _disabled():
+    return jsonify({'error': '任务队列未启用（JOB_QUEUE_ENABLED=False）'}), 404
+
+@api_bp.route('/jobs', methods=['POST'])
+@limiter.limit("10 per minute")
+@track_stats('jobs_create')
+@require_api_key
+def create_job():
+    """
+    提交离线识别任务
+    ---
+    consumes:
+      - application/json
+      - application/x-ndjson
+    tags:
+      - 离线任务
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: JSON 为 {"images": [...]} 或 {"items": [{"image", "type", "id", ...}]}，其他字段为识别参数的默认值；NDJSON 每行一个 item，默认值和 priority 放在查询参数中
+        schema:
+          properties:
+            images:
+              type: array
+              items:
+                type: string
+              description: 图片数组（base64/URL）
+            items:
+              type: array
+              items:
+                type: object
+              description: 图片对象数组，格式同 /batch/stream 的请求行
+            type:
+              type: string
+              enum: [classification, calculate, detection, select]
+              default: classification
+            priority:
+              type: string
+              enum: [high, normal, low]
+              default: normal
+    responses:
+      202:
+        description: 任务已创建，返回任务状态
+      400:
+        description: 请求参数错误
+      429:
+        description: 图片数超出 API Key 的限额（每张图片计一次，与 /batch/stream 相同）
+    """
+    if not job_queue.enabled:
+        return _disabled()
+    charge = quota_charger()
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            params = get_query_data()
+            max_line = current_app.config['MAX_IMAGE_SIZE'] * 4 // 3 + 4096
+            entries = read_lines(request.stream, max_line)
+            if charge is not None:
+                entries = _charged(entries, charge)
+        else:
+            params = get_request_data()
+            if not params or not (params.get('images') or params.get('items')):
+                return jsonify({'error': '缺少必需参数: images 或 items'}), 400
+            entries = params.get('items') or [{'image': image} for image in params['images']]
+            if not isinstance(entries, list):
+                return jsonify({'error': 'images/items 必须是数组'}), 400
+            if charge is not None and not charge(len(entries)):
+                raise _QuotaExceeded()
+        defaults = {**get_key_ocr_defaults(), **{k: v for k, v in params.items() if k not in JOB_FIELDS}}
+        job = job_queue.create(entries, _owner(), params.get('priority') or 'normal', defaults)
+    except _QuotaExceeded:
+        return jsonify({'error': '任务的图片数超出 API Key 的限额'}), 429
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+    except Exception as e:
+        current_app.logger.error(f"任务提交错误: {e}", exc_info=True)
+        return jsonify({'error': '服务器内部错误'}), 500
+    return jsonify({'success': True, 'job': job}), 202, {'Location': f"/jobs/{job['job_id']}"}
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+@limiter.limit("120 per minute")
+@track_stats('jobs_status')
+@require_api_key
+def job_status(job_id):
+    """
+    任务状态和进度
+    ---
+    tags:
+      - 离线任务
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: 任务状态（queued/running/completed/cancelled）和各状态的图片数
+      404:
+        description: 任务不存在
+    """
+    if not job_queue.enabled:
+        return _disabled()
+    job = job_queue.get(job_id, _owner())
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@api_bp.route('/jobs/<job_id>/results', methods=['GET'])
+@limiter.limit("120 per minute")
+@track_stats('jobs_results')
+@require_api_key
+def job_results(job_id):
+    """
+    分页读取任务结果（按图片序号，只包含已完成的图片）
+    ---
+    tags:
+      - 离线任务
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+      - name: offset
+        in: query
+        type: integer
+        default: 0
+        description: 起始图片序号，下一页使用返回的 next_offset
+      - name: limit
+        in: query
+        type: integer
+        default: 100
+        description: 每页结果数（最多 1000）
+      - name: status
+        in: query
+        type: string
+        enum: [succeeded, failed]
+        description: 只返回成功或失败的图片
+    responses:
+      200:
+        description: '{"results": [{"index", "id", "result"} 或 {"index", "id", "error"}], "next_offset"}'
+      404:
+        description: 任务不存在
+    """
+    if not job_queue.enabled:
+        return _disabled()
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', 100))), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'offset 和 limit 必须是整数'}), 400
+    status = request.args.get('status')
+    if status not in (None, 'succeeded', 'failed'):
+        return jsonify({'error': 'status 必须是 succeeded 或 failed'}), 400
+    page = job_queue.results(job_id, _owner(), offset, limit, status)
+    if page is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, **page})
+
+@api_bp.route('/jobs/<job_id>', methods=['DELETE'])
+@limiter.limit("120 per minute")
+@track_stats('jobs_cancel')
+@require_api_key
+def cancel_job(job_id):
+    """
+    取消任务（已完成的结果保留，未开始的图片不再处理）
+    ---
+    tags:
+      - 离线任务
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: 取消后的任务状态
+      404:
+        description: 任务不存在
+    """
+    if not job_queue.enabled:
+        return _disabled()
+    job = job_queue.cancel(job_id, _owner())
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
@@ -1,7 +1,19 @@
 from datetime import datetime
-from flask import jsonify
+from flask import jsonify, Response
+from app import limiter
 from app.routes import api_bp
-from app.utils.stats import get_stats_data
+from app.utils.stats import get_stats_data, generate_metrics
+from app.utils.cache import result_cache
+from app.utils.near_duplicate import near_duplicate_cache
+from app.utils.fetcher import image_fetcher
+from app.services.batcher import ocr_batcher
+from app.services.executor import inference_pool
+from app.services.models import model_manager
+from app.services.custom_models import model_registry
+from app.services.runtime import ort_runtime
+from app.middleware.api_keys import api_key_store
+from app.services.jobs import job_queue
+from app.services.admission import admission_controller
 import logging
 
 # 获取 logger，用于过滤健康检查日志
@@ -23,8 +35,11 @@ def api_info():
         'endpoints': {
             'health': '/health',
             'stats': '/stats',
+            'metrics': '/metrics',
             'classification': '/classification',
             'batch_classification': '/batch/classification',
+            'batch_stream': '/batch/stream',
+            'jobs': '/jobs',
             'capcode': '/capcode',
             'slideComparison': '/slideComparison',
             'detection': '/detection',
@@ -34,7 +49,9 @@ def api_info():
         }
     })
 
+# 健康检查和监控接口不计入限流（负载均衡探活、Prometheus 抓取很快会用完默认限额）
 @api_bp.route('/health', methods=['GET'])
+@limiter.exempt
 def health_check():
     """
     健康检查端点
@@ -48,10 +65,12 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'service': 'CAPTCHA Recognition API'
+        'service': 'CAPTCHA Recognition API',
+        **model_manager.get_info()
     })
 
 @api_bp.route('/stats', methods=['GET'])
+@limiter.exempt
 def get_stats():
     """
     获取API统计信息
@@ -60,4 +79,36 @@ def get_stats():
       200:
         description: API使用统计
     """
-    return jsonify(get_stats_data())
+    # 计数类数据来自监控指标（所有 worker 汇总），配置和容量为当前 worker 的数据
+    data = get_stats_data()
+    # 识别模型是否合并推理（动态量化模型逐张推理），模型未加载时为 None
+    ocr_batched = model_manager.get('batch_ocr').batched if model_manager.is_loaded('batch_ocr') else None
+    data['cache'].update(result_cache.get_stats())
+    data['near_duplicate'].update(near_duplicate_cache.get_stats())
+    data['micro_batch'].update(ocr_batcher.get_stats())
+    # 模型只能逐张推理时请求不经过批处理
+    data['micro_batch']['active'] = ocr_batcher.enabled and ocr_batched is not False
+    data['inference_pool'].update(inference_pool.get_stats())
+    data['fetcher'].update(image_fetcher.get_stats())
+    data['custom_models'].update(model_registry.get_stats())
+    data['onnxruntime'] = ort_runtime.get_stats()
+    data['onnxruntime']['ocr_batched'] = ocr_batched
+    data['api_keys'] = api_key_store.get_stats()
+    data['jobs'].update(job_queue.get_stats())
+    data['admission'].update(admission_controller.get_stats())
+    return jsonify(data)
+
+@api_bp.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    """
+    Prometheus 监控指标
+    ---
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: 文本格式的监控指标（所有 worker 汇总）
+    """
+    body, content_type = generate_metrics()
+    return Response(body, content_type=content_type)
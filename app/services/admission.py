@@ -0,0 +1,229 @@
+"""准入控制
+
+gevent worker 可以同时接受上千个连接，推理能力却只有几个推理线程。过载时请求在推理
+队列中越排越长，最终表现为 gunicorn 的超时，而不是快速失败。这里在调用 CaptchaService
+之前估算请求的完成时间，超出延迟目标（ADMISSION_LATENCY_SLO_MS）时先短暂排队，
+排队也无法在目标时间内完成时立即返回 503 和 Retry-After。
+
+- 每个接口的推理耗时（每张图片）用实际测得的推理线程占用时间做指数移动平均，
+  初始值见 DEFAULT_COSTS（/select、/detection 远高于 /classification）
+- 已准入、未完成的请求的估计耗时之和为积压量，新请求的预计完成时间 =
+  积压量 / 推理线程数 + 自身耗时；没有积压时总是准入（避免单个大请求永远无法执行）
+- 等待中的请求在有请求完成时重新判断，已等待的时间计入延迟，等待数超过
+  ADMISSION_QUEUE_SIZE 时直接拒绝
+
+HTTP 接口用 admit 装饰器按请求准入；/batch/stream 的每张图片和离线任务的每批图片用
+admitted 单独准入，推理耗时同样计入积压量。离线任务不排队等待：不能立即准入时放回任务队列，
+不占用在线请求的排队位置。
+
+统计按 worker 进程进行（推理线程池也是每个进程独立的）。
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify
+
+from app.utils.stats import ADMISSION_DECISIONS, ADMISSION_OUTSTANDING, ADMISSION_WAIT
+
+# 各接口每张图片的初始推理耗时估计（秒），运行后按实测值更新
+DEFAULT_COSTS = {
+    'classification': 0.02,
+    'batch_classification': 0.02,
+    'calculate': 0.02,
+    'capcode': 0.03,
+    'slideComparison': 0.03,
+    'detection': 0.15,
+    'select': 0.25,
+}
+DEFAULT_COST = 0.05
+EWMA_ALPHA = 0.2  # 新样本的权重
+
+_ticket = contextvars.ContextVar('captcha_admission_ticket', default=None)
+
+
+class _Ticket:
+    """一个已准入的请求"""
+
+    __slots__ = ('endpoint', 'units', 'estimate', 'cost')
+
+    def __init__(self, endpoint, units, estimate):
+        self.endpoint = endpoint
+        self.units = units
+        self.estimate = estimate
+        self.cost = 0.0  # 实测的推理线程占用时间
+
+
+def record_cost(elapsed):
+    """记录当前请求占用推理线程的时间（在推理线程中调用，通过复制的上下文找到所属请求）"""
+    ticket = _ticket.get()
+    if ticket is not None:
+        ticket.cost += elapsed
+
+
+def current_ticket():
+    """当前请求的准入记录（供跨线程合并推理的批处理记录耗时），没有时返回 None"""
+    return _ticket.get()
+
+
+def add_cost(ticket, elapsed):
+    """把耗时记录到指定请求（批处理线程中没有请求上下文）"""
+    if ticket is not None:
+        ticket.cost += elapsed
+
+
+class AdmissionController:
+    """准入控制（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.enabled = False
+        self.slo = 2.0
+        self.queue_size = 64
+        self.capacity = 1
+        self.waiting = 0
+        self._outstanding = 0.0
+        self._estimates = dict(DEFAULT_COSTS)
+        self._condition = threading.Condition()
+
+    def init_app(self, app):
+        """根据应用配置设置延迟目标和排队上限"""
+        self.enabled = app.config.get('ADMISSION_ENABLED', True)
+        self.slo = max(0.001, app.config.get('ADMISSION_LATENCY_SLO_MS', 2000) / 1000.0)
+        self.queue_size = max(0, app.config.get('ADMISSION_QUEUE_SIZE', 64))
+        # 同时执行推理的线程数；关闭推理线程池时推理在请求协程中执行，按 1 估算
+        if app.config.get('INFERENCE_POOL_ENABLED', True):
+            self.capacity = max(1, app.config.get('INFERENCE_POOL_SIZE', 2))
+        else:
+            self.capacity = 1
+
+    def estimate(self, endpoint, units=1):
+        """请求的估计推理耗时（秒）"""
+        return self._estimates.get(endpoint, DEFAULT_COST) * units
+
+    def _predicted(self, cost):
+        return self._outstanding / self.capacity + cost
+
+    def acquire(self, endpoint, units=1, wait=True):
+        """
+        申请准入，必要时等待
+
+        Args:
+            wait: 为 False 时不能立即准入就返回（后台工作，不计入拒绝数）
+
+        Returns:
+            tuple: (_Ticket, None) 已准入；(None, Retry-After 秒数) 被拒绝
+        """
+        arrived = time.perf_counter()
+        cost = self.estimate(endpoint, units)
+        with self._condition:
+            if self._outstanding <= 0 or self._predicted(cost) <= self.slo:
+                return self._admit(endpoint, units, cost, 'admitted'), None
+            if not wait:
+                return None, max(1, math.ceil(self._outstanding / self.capacity))
+            if self.waiting >= self.queue_size:
+                return None, self._shed(endpoint)
+            self.waiting += 1
+            try:
+                while True:
+                    # 剩余的延迟预算（已等待的时间计入延迟）
+                    budget = self.slo - (time.perf_counter() - arrived)
+                    if self._outstanding <= 0 or self._predicted(cost) <= budget:
+                        ADMISSION_WAIT.observe(time.perf_counter() - arrived)
+                        return self._admit(endpoint, units, cost, 'queued'), None
+                    # 即使积压立即清空也来不及：不再等待
+                    if budget <= cost:
+                        ADMISSION_WAIT.observe(time.perf_counter() - arrived)
+                        return None, self._shed(endpoint)
+                    self._condition.wait(budget - cost)
+            finally:
+                self.waiting -= 1
+
+    def _admit(self, endpoint, units, cost, result):
+        self._outstanding += cost
+        ADMISSION_OUTSTANDING.inc(cost)
+        ADMISSION_DECISIONS.labels(endpoint, result).inc()
+        return _Ticket(endpoint, units, cost)
+
+    def _shed(self, endpoint):
+        ADMISSION_DECISIONS.labels(endpoint, 'shed').inc()
+        # 按当前积压全部完成所需的时间提示客户端重试
+        return max(1, math.ceil(self._outstanding / self.capacity))
+
+    def release(self, ticket):
+        """请求完成：释放积压量，用实测耗时更新估计值，唤醒等待中的请求"""
+        with self._condition:
+            self._outstanding = max(0.0, self._outstanding - ticket.estimate)
+            if ticket.cost > 0:
+                sample = ticket.cost / ticket.units
+                previous = self._estimates.get(ticket.endpoint, DEFAULT_COST)
+                self._estimates[ticket.endpoint] = previous + EWMA_ALPHA * (sample - previous)
+            self._condition.notify_all()
+        ADMISSION_OUTSTANDING.dec(ticket.estimate)
+
+    @contextmanager
+    def admitted(self, endpoint, units=1, wait=True):
+        """
+        准入一项工作，with 块中的推理耗时计入该工作（未启用时总是准入）
+
+        Yields:
+            被拒绝时为 Retry-After 秒数，已准入时为 None（被拒绝时调用方不应执行推理）
+        """
+        if not self.enabled:
+            yield None
+            return
+        ticket, retry_after = self.acquire(endpoint, units, wait)
+        if ticket is None:
+            yield retry_after
+            return
+        token = _ticket.set(ticket)
+        try:
+            yield None
+        finally:
+            _ticket.reset(token)
+            self.release(ticket)
+
+    def admit(self, endpoint, units=None):
+        """
+        准入控制装饰器
+
+        Args:
+            endpoint: 接口名（用于耗时估计和统计）
+            units: 返回请求中图片数的无参函数（批量接口），默认为 1
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                count = 1
+                if units is not None:
+                    try:
+                        count = max(1, int(units()))
+                    except Exception:
+                        count = 1  # 参数错误由视图返回 400
+                with self.admitted(endpoint, count) as retry_after:
+                    if retry_after is not None:
+                        return jsonify({'error': '服务繁忙，请稍后重试'}), 503, {'Retry-After': str(retry_after)}
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        """获取当前 worker 的延迟目标、排队数和各接口的耗时估计（积压量见 stats.get_admission_stats）"""
+        with self._condition:
+            return {
+                'enabled': self.enabled,
+                'latency_slo_ms': round(self.slo * 1000, 3),
+                'capacity': self.capacity,
+                'queue_size': self.queue_size,
+                'waiting': self.waiting,
+                'estimated_costs_ms': {
+                    name: round(cost * 1000, 3) for name, cost in sorted(self._estimates.items())
+                }
+            }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,119 @@
+"""算术验证码
+
+识别结果只可能由数字和运算符组成，识别时只在 CHARSET 范围内解码（见
+BatchOcrEngine.recognize 的 allowed 参数），再把识别文本整理为表达式并求值。
+
+算术验证码以 "=?" 结尾，模型经常把 "=" 识别为 "-"：识别文本中没有 "=" 时，
+如果末尾的 "-" 之前已经有完整的运算（如 "9*2-7" 中的 "9*2"），把末尾的 "-" 及其后的
+一个字符当作 "=?" 去掉。
+
+表达式求值使用手写的递归下降解析器，只支持整数、+ - * /、括号和负号；
+同一表达式的结果会被缓存。
+"""
+import re
+from functools import lru_cache
+
+# 识别时允许的字符：除数字和运算符外保留 = 和 ?，让 "=?" 有可以对应的字符
+CHARSET = '0123456789+-*/()=?×÷xX？＋－'
+
+_NORMALIZE = str.maketrans({'×': '*', 'x': '*', 'X': '*', '÷': '/', '＋': '+', '－': '-'})
+_INVALID = re.compile(r'[^0-9+\-*/()]')
+_TOKEN = re.compile(r'\d+|[-+*/()]')
+_TRAILING_EQUALS = re.compile(r'(?<=[\d)])-.?$')
+_OPERATION = re.compile(r'[\d)][-+*/]')
+EXPRESSION_CACHE_SIZE = 1024
+
+
+def extract(text):
+    """从识别文本中取出表达式（去掉 = 之后的部分和其他字符，统一运算符写法）"""
+    text = text.translate(_NORMALIZE)
+    if '=' in text:
+        text = text.split('=', 1)[0]
+    else:
+        head = _TRAILING_EQUALS.sub('', text)
+        if _OPERATION.search(head):
+            text = head
+    return _INVALID.sub('', text)
+
+
+class _Parser:
+    """递归下降解析：expr := term (('+'|'-') term)*，term := factor (('*'|'/') factor)*"""
+
+    __slots__ = ('tokens', 'pos')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError('表达式不完整')
+        self.pos += 1
+        return token
+
+    def parse(self):
+        value = self._expr()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"无法解析: {self.tokens[self.pos]}")
+        return value
+
+    def _expr(self):
+        value = self._term()
+        while self._peek() in ('+', '-'):
+            value = value + self._term() if self._next() == '+' else value - self._term()
+        return value
+
+    def _term(self):
+        value = self._factor()
+        while self._peek() in ('*', '/'):
+            if self._next() == '*':
+                value *= self._factor()
+            else:
+                divisor = self._factor()
+                if divisor == 0:
+                    raise ValueError('除数为 0')
+                value /= divisor
+        return value
+
+    def _factor(self):
+        token = self._next()
+        if token == '-':
+            return -self._factor()
+        if token == '+':
+            return self._factor()
+        if token == '(':
+            value = self._expr()
+            if self._next() != ')':
+                raise ValueError('括号不匹配')
+            return value
+        if token.isdigit():
+            return int(token)
+        raise ValueError(f"无法解析: {token}")
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def evaluate(expression):
+    """
+    表达式求值
+
+    Args:
+        expression: 只包含数字、+ - * / 和括号的表达式
+
+    Returns:
+        int | float: 计算结果，结果为整数时返回 int
+
+    Raises:
+        ValueError: 表达式无法解析或除数为 0
+    """
+    result = _Parser(_TOKEN.findall(expression)).parse()
+    return int(result) if isinstance(result, float) and result.is_integer() else result
+
+
+def solve(text):
+    """识别文本 -> 计算结果，没有表达式时返回 None"""
+    expression = extract(text)
+    return evaluate(expression) if expression else None
@@ -0,0 +1,199 @@
+"""NDJSON 流式批量识别
+
+请求体每行一个 JSON 对象（一张图片），逐行读取，同时处理的图片数不超过 max_in_flight
+（读取下一行之前先等待已有的图片完成，内存占用与总行数无关）。每张图片在独立的线程中
+调用 CaptchaService 的单张识别方法（gevent worker 中为协程），因此同样经过结果缓存、
+跨请求批处理和推理线程池；每张图片按其类型单独经过准入控制（超出延迟目标时该行返回
+繁忙错误）。结果按完成顺序逐行返回，最后一行为汇总。
+
+请求行：{"image": "base64/URL", "type": "classification", "id": 任意值, ...识别参数}
+  type 可选 classification / calculate / detection / select，未设置的参数使用 defaults
+结果行：{"index": 行号, "id": ..., "result": ...} 或 {"index": ..., "id": ..., "error": "..."}
+汇总行：{"done": true, "total": 行数, "succeeded": ..., "failed": ...}
+"""
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from app.services.admission import admission_controller
+from app.services.executor import InferenceBusyError
+from app.utils import timing
+from app.utils.stats import STREAM_ITEMS
+
+STREAM_TYPES = ('classification', 'calculate', 'detection', 'select')
+# 识别参数（请求行中未设置时使用 defaults）
+OPTION_FIELDS = ('type', 'preprocess', 'charset', 'length', 'model')
+
+
+class LineTooLongError(ValueError):
+    """请求行超过长度上限"""
+
+
+def read_lines(stream, max_length):
+    """
+    逐行读取请求体，跳过空行
+
+    Yields:
+        bytes 或 LineTooLongError: 超长的行已被丢弃，返回异常对象由调用方输出错误
+    """
+    while True:
+        line = stream.readline(max_length + 1)
+        if not line:
+            return
+        if len(line) > max_length and not line.endswith(b'\n'):
+            # 丢弃该行剩余部分
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_length + 1)
+            yield LineTooLongError(f"单行不能超过 {max_length} 字节")
+            continue
+        line = line.strip()
+        if line:
+            yield line
+
+
+def parse_line(line, defaults):
+    """
+    解析一行请求
+
+    Returns:
+        tuple: (id, 识别类型, 图片, 识别参数)
+
+    Raises:
+        ValueError: 不是 JSON 对象、缺少 image 或类型无效
+    """
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"不是有效的 JSON: {e}")
+    return parse_item(item, defaults)
+
+
+def parse_item(item, defaults):
+    """解析一个已反序列化的请求对象，返回值和异常同 parse_line"""
+    if not isinstance(item, dict):
+        raise ValueError('每行必须是 JSON 对象')
+    if not item.get('image'):
+        raise ValueError('缺少必需参数: image')
+    options = {name: item.get(name, defaults.get(name)) for name in OPTION_FIELDS}
+    kind = options.pop('type') or 'classification'
+    if kind not in STREAM_TYPES:
+        raise ValueError(f"不支持的类型: {kind}，可选 {'/'.join(STREAM_TYPES)}")
+    return item.get('id'), kind, item['image'], options
+
+
+def recognize(service, kind, image, options):
+    """
+    按类型调用 CaptchaService 的单张识别方法
+
+    Returns:
+        识别结果，失败时为 None
+
+    Raises:
+        ValueError: 识别参数无效
+        InferenceBusyError: 推理线程池已满
+    """
+    if kind == 'classification':
+        return service.classify(image, options['preprocess'] or False, options['charset'],
+                                options['length'], options['model'])
+    if kind == 'calculate':
+        return service.calculate(image)
+    if kind == 'detection':
+        return service.detect(image)
+    return service.click_select(image)
+
+
+class BatchStream:
+    """一次流式批量识别（迭代得到要输出的结果字典）"""
+
+    def __init__(self, service, lines, defaults=None, max_in_flight=8, charge=None):
+        """
+        Args:
+            service: CaptchaService 实例
+            lines: read_lines 返回的行迭代器
+            defaults: 请求行中未设置的识别参数的默认值
+            max_in_flight: 同时处理的图片数
+            charge: 每读取一行调用一次，返回 False 时停止读取（超出 API Key 的额度）
+        """
+        self.service = service
+        self.lines = lines
+        self.defaults = defaults or {}
+        self.max_in_flight = max(1, max_in_flight)
+        self.charge = charge
+        self.total = 0
+        self.failed = 0
+        self.stopped = None  # 提前停止的原因
+
+    def _process(self, kind, image, options):
+        """识别一张图片，返回结果或错误字段"""
+        try:
+            with admission_controller.admitted(kind) as retry_after:
+                if retry_after is not None:
+                    raise InferenceBusyError('超出延迟目标')
+                result = recognize(self.service, kind, image, options)
+        except InferenceBusyError:
+            STREAM_ITEMS.labels(kind, 'busy').inc()
+            return {'error': '服务繁忙，请稍后重试', 'retry': True}
+        except ValueError as e:
+            STREAM_ITEMS.labels(kind, 'error').inc()
+            return {'error': f'参数错误: {str(e)}'}
+        except Exception as e:
+            current_app.logger.error(f"流式批量识别错误: {e}", exc_info=True)
+            STREAM_ITEMS.labels(kind, 'error').inc()
+            return {'error': '服务器内部错误'}
+        if result is None:
+            STREAM_ITEMS.labels(kind, 'error').inc()
+            return {'error': '识别失败'}
+        STREAM_ITEMS.labels(kind, 'ok').inc()
+        return {'result': result}
+
+    def _entry(self, index, item_id, output):
+        entry = {'index': index}
+        if item_id is not None:
+            entry['id'] = item_id
+        entry.update(output)
+        if 'error' in output:
+            self.failed += 1
+        return entry
+
+    def __iter__(self):
+        pending = {}  # future -> (index, id)
+        lines = iter(self.lines)
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='stream')
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_in_flight:
+                    line = next(lines, None)
+                    if line is None:
+                        exhausted = True
+                        break
+                    if self.charge is not None and not self.charge():
+                        self.stopped = '超出 API Key 的限额，其余行未处理'
+                        exhausted = True
+                        break
+                    index = self.total
+                    self.total += 1
+                    try:
+                        if isinstance(line, Exception):
+                            raise line
+                        item_id, kind, image, options = parse_line(line, self.defaults)
+                    except ValueError as e:
+                        yield self._entry(index, None, {'error': f'参数错误: {str(e)}'})
+                        continue
+                    # 在线程中继承请求的上下文（Flask 请求/应用上下文和耗时记录）
+                    future = executor.submit(timing.bind(self._process), kind, image, options)
+                    pending[future] = (index, item_id)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, item_id = pending.pop(future)
+                    yield self._entry(index, item_id, future.result())
+        finally:
+            # 客户端断开时等待正在处理的图片完成（最多 max_in_flight 张）
+            executor.shutdown(wait=True)
+        summary = {'done': True, 'total': self.total, 'succeeded': self.total - self.failed, 'failed': self.failed}
+        if self.stopped:
+            summary['error'] = self.stopped
+        yield summary
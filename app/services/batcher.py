@@ -0,0 +1,172 @@
+"""跨请求动态批处理
+
+把并发到达的单张 OCR 请求在很短的时间窗口内收集起来，合并为一次批量推理，
+再把结果分发回各自等待的请求。收集请求的后台线程在首次提交时启动（兼容 gunicorn
+preload 后 fork 出的 worker），在 gevent worker 中会被 monkey patch 为协程；
+凑好的批次直接提交到推理线程池执行，完成后在回调中唤醒等待的请求，不另外创建线程。
+
+排队请求数有上限，超出时立即抛出 InferenceBusyError（路由返回 503）；
+同时执行的批次数不超过 max_concurrency（通常等于推理线程数），
+其余请求在队列中继续合并为下一批。识别模型只能逐张推理时（BatchOcrEngine.batched
+为 False）合并没有收益，调用方应直接推理，不经过批处理（见 CaptchaService.classify）。
+"""
+import os
+import queue
+import threading
+import time
+
+from app.services import admission
+from app.services.executor import InferenceBusyError, inference_pool
+from app.utils import timing
+from app.utils.stats import MICRO_BATCH_QUEUE_DEPTH, MICRO_BATCH_REJECTED, MICRO_BATCH_SIZE, MICRO_BATCH_WAIT
+
+
+class _PendingItem:
+    """等待批处理的单个请求"""
+
+    __slots__ = ('payload', 'event', 'result', 'error', 'enqueued_at', 'timing', 'ticket')
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued_at = time.perf_counter()
+        self.timing = timing.current()  # 所属请求的耗时记录，批处理线程中没有请求上下文
+        self.ticket = admission.current_ticket()  # 所属请求的准入记录
+
+
+class MicroBatcher:
+    """动态批处理调度器（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self, handler=None):
+        """
+        Args:
+            handler: 批处理函数（在推理线程中执行），接收 payload 列表，返回等长的结果列表；
+                结果为异常对象时只在对应的请求中抛出
+        """
+        self.handler = handler
+        self.enabled = False
+        self.max_batch_size = 16
+        self.max_wait = 0.005
+        self.queue_size = 64
+        self.max_concurrency = 2
+        self._queue = queue.Queue(self.queue_size)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._worker = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """根据应用配置初始化批处理参数"""
+        self.enabled = app.config.get('MICRO_BATCH_ENABLED', True)
+        self.max_batch_size = max(1, app.config.get('MICRO_BATCH_MAX_SIZE', 16))
+        self.max_wait = max(0, app.config.get('MICRO_BATCH_MAX_WAIT_MS', 5)) / 1000.0
+        self.queue_size = max(1, app.config.get('MICRO_BATCH_QUEUE_SIZE', 64))
+        # 每个批次占用一个推理线程，更多的并发批次只会在推理线程池中排队
+        self.max_concurrency = max(1, app.config.get('INFERENCE_POOL_SIZE', 2))
+
+    def submit(self, payload):
+        """
+        提交单个请求并等待批处理结果
+
+        Args:
+            payload: 传给 handler 的单个输入
+
+        Returns:
+            handler 对应位置的结果
+
+        Raises:
+            InferenceBusyError: 排队请求数已达上限
+        """
+        self._ensure_worker()
+        item = _PendingItem(payload)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            MICRO_BATCH_REJECTED.inc()
+            raise InferenceBusyError(f"批处理队列已满: {self.queue_size}")
+        MICRO_BATCH_QUEUE_DEPTH.inc()
+        item.event.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _ensure_worker(self):
+        # fork 后子进程中没有父进程的线程，需要按进程重新启动
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._worker_pid != os.getpid():
+                self._queue = queue.Queue(self.queue_size)
+                self._slots = threading.BoundedSemaphore(self.max_concurrency)
+                self._worker = threading.Thread(target=self._run, name='ocr-micro-batcher', daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            # 所有批次都在执行时不再取出请求，后到的请求留在队列中凑成更大的批次
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started_at = time.perf_counter()
+        MICRO_BATCH_QUEUE_DEPTH.dec(len(batch))
+        MICRO_BATCH_SIZE.observe(len(batch))
+        for item in batch:
+            MICRO_BATCH_WAIT.observe(started_at - item.enqueued_at)
+
+        def done(results, error):
+            self._finish(batch, started_at, results, error)
+
+        try:
+            inference_pool.submit(self.handler, [item.payload for item in batch], callback=done)
+        except Exception as e:
+            done(None, e)
+
+    def _finish(self, batch, started_at, results, error):
+        try:
+            if error is None:
+                for item, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        item.error = result
+                    else:
+                        item.result = result
+            else:
+                for item in batch:
+                    item.error = error
+        finally:
+            self._slots.release()
+            finished_at = time.perf_counter()
+            # 批次的推理时间由批内请求平分
+            share = (finished_at - started_at) / len(batch)
+            for item in batch:
+                admission.add_cost(item.ticket, share)
+                if item.timing is not None:
+                    item.timing.add('micro_batch_wait', item.enqueued_at, started_at - item.enqueued_at)
+                    item.timing.add('micro_batch', started_at, finished_at - started_at)
+                item.event.set()
+
+    def get_stats(self):
+        """获取批处理配置（批大小分布和队列长度见 stats.get_micro_batch_stats）"""
+        return {
+            'enabled': self.enabled,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_size': self.queue_size,
+            'max_concurrency': self.max_concurrency
+        }
+
+ocr_batcher = MicroBatcher()
@@ -1,73 +1,283 @@
-import re
-import base64
 from io import BytesIO
-import cv2
 import numpy as np
 import ddddocr
 from PIL import Image
 from flask import current_app
 
-from app.utils.image_processor import get_image_bytes, preprocess_image, image_to_base64
+from app.utils.image_processor import get_image_bytes, get_images_bytes, image_to_base64, DecodedImage
+from app.utils.stats import stage_timer
+from app.utils import timing
+from app.utils.cache import result_cache
+from app.utils.near_duplicate import near_duplicate_cache
+from app.services.ocr_engine import BatchOcrEngine, CHARSET_PRESETS
+from app.services.batcher import ocr_batcher
+from app.services.executor import inference_pool, InferenceBusyError
+from app.services.jobs import job_queue
+from app.services.models import model_manager
+from app.services.custom_models import model_registry
+from app.services.runtime import ort_runtime
+from app.services.detection import detect_bboxes
+from app.services import arithmetic, slider
+
+# 滑块匹配/对比的实现：opencv 为 app.services.slider，ddddocr 为 ddddocr 自带实现
+SLIDE_ENGINES = ('opencv', 'ddddocr')
+# 识别选项的上限
+MAX_CHARSET_LENGTH = 256
+MAX_TEXT_LENGTH = 32
 
 class CaptchaService:
     """验证码识别服务"""
     
     def __init__(self):
-        self.ocr = ddddocr.DdddOcr(show_ad=False)
-        self.det = ddddocr.DdddOcr(det=True, show_ad=False)
+        # 模型在首次使用时加载，见 MODEL_WARMUP 配置
+        # ddddocr 创建的会话使用默认参数，按 ORT_* 配置重新创建
+        model_manager.register('ocr', lambda: ort_runtime.configure_ocr(
+            ddddocr.DdddOcr(show_ad=False, beta=ort_runtime.ocr_model == 'beta')
+        ))
+        model_manager.register('det', lambda: ort_runtime.configure_ocr(ddddocr.DdddOcr(det=True, show_ad=False)))
+        model_manager.register('batch_ocr', lambda: BatchOcrEngine(self.ocr))
+        # 批处理在推理线程中执行，解码后的预处理和模型输入准备也在推理线程中完成
+        ocr_batcher.handler = lambda items: self._classify_batch(self.batch_ocr, items)
+        # 离线任务由后台线程调用本服务识别
+        job_queue.service = self
+    
+    @property
+    def ocr(self):
+        """OCR 模型（同时提供滑块匹配）"""
+        return model_manager.get('ocr')
+    
+    @property
+    def det(self):
+        """目标检测模型"""
+        return model_manager.get('det')
+    
+    @property
+    def batch_ocr(self):
+        """批量OCR推理引擎"""
+        return model_manager.get('batch_ocr')
     
-    def slide_match(self, sliding_image, back_image, simple_target=True, preprocess=False):
+    @staticmethod
+    def _slide_engine(engine):
+        """滑块引擎，未指定时使用 SLIDE_ENGINE 配置"""
+        engine = engine or current_app.config.get('SLIDE_ENGINE', 'opencv')
+        if engine not in SLIDE_ENGINES:
+            raise ValueError(f"不支持的滑块引擎: {engine}")
+        return engine
+    
+    @staticmethod
+    def _max_image_size():
+        """单张图片大小上限（MAX_IMAGE_SIZE 配置）"""
+        return current_app.config.get('MAX_IMAGE_SIZE', 5 * 1024 * 1024)
+    
+    def slide_match(self, sliding_image, back_image, simple_target=True, preprocess=False, engine=None):
         """滑块验证码识别"""
+        engine = self._slide_engine(engine)
         try:
-            sliding_bytes = get_image_bytes(sliding_image)
-            back_bytes = get_image_bytes(back_image)
+            sliding_bytes, back_bytes = get_images_bytes([sliding_image, back_image], self._max_image_size())
+            cache_key = result_cache.make_key(
+                'slide_match', sliding_bytes, back_bytes,
+                simple_target=bool(simple_target), preprocess=bool(preprocess), engine=engine
+            )
             
-            if preprocess:
-                sliding_bytes = preprocess_image(sliding_bytes, enhance=True)
-                back_bytes = preprocess_image(back_bytes, enhance=True)
+            def compute():
+                res = inference_pool.run(
+                    self._slide_match, None if engine == 'opencv' else self.ocr,
+                    DecodedImage(sliding_bytes), DecodedImage(back_bytes), simple_target, preprocess
+                )
+                return {'position': res['target'][0], 'confidence': round(float(res['confidence']), 4)}
             
-            res = self.ocr.slide_match(sliding_bytes, back_bytes, simple_target=simple_target)
-            return {'position': res['target'][0], 'confidence': res.get('confidence', 0.95)}
+            return result_cache.get_or_compute(cache_key, compute)
+        except InferenceBusyError:
+            raise
         except Exception as e:
             current_app.logger.error(f"滑块识别错误: {e}")
             return None
     
-    def slide_comparison(self, sliding_image, back_image):
+    def slide_comparison(self, sliding_image, back_image, engine=None):
         """滑块对比"""
+        engine = self._slide_engine(engine)
         try:
-            sliding_bytes = get_image_bytes(sliding_image)
-            back_bytes = get_image_bytes(back_image)
-            res = self.ocr.slide_comparison(sliding_bytes, back_bytes)
-            return res['target'][0]
+            sliding_bytes, back_bytes = get_images_bytes([sliding_image, back_image], self._max_image_size())
+            cache_key = result_cache.make_key('slide_comparison', sliding_bytes, back_bytes, engine=engine)
+            return result_cache.get_or_compute(
+                cache_key,
+                lambda: inference_pool.run(
+                    self._slide_comparison, None if engine == 'opencv' else self.ocr,
+                    DecodedImage(sliding_bytes), DecodedImage(back_bytes)
+                )
+            )
+        except InferenceBusyError:
+            raise
         except Exception as e:
             current_app.logger.error(f"滑块对比错误: {e}")
             return None
     
-    def classify(self, image, preprocess=False):
-        """OCR文字识别"""
+    @staticmethod
+    def _near_duplicate_key(method, image, **params):
+        """近似重复图片缓存的 (命名空间, 感知哈希)，未启用时为 None（解码和哈希在推理线程池中计算）"""
+        if not near_duplicate_cache.enabled:
+            return None
+        return inference_pool.run(near_duplicate_cache.key, method, image, **params)
+    
+    @staticmethod
+    def _near_duplicate_keys(method, images, **params):
+        """
+        批量计算近似重复图片缓存键（一次提交到推理线程池），未启用时全部为 None
+        
+        Returns:
+            list: 每张图片的 (命名空间, 感知哈希)，无法解码的图片为异常对象
+        """
+        if not near_duplicate_cache.enabled or not images:
+            return [None] * len(images)
+        
+        def compute():
+            keys = []
+            for image in images:
+                try:
+                    keys.append(near_duplicate_cache.key(method, image, **params))
+                except Exception as e:
+                    keys.append(e)
+            return keys
+        
+        return inference_pool.run(compute)
+    
+    def _get_or_compute(self, cache_key, compute, method, image, **params):
+        """先查字节哈希缓存，再查近似重复图片缓存（重新编码的同一张验证码），都未命中时识别"""
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        near_key = self._near_duplicate_key(method, image, **params)
+        if near_key is not None:
+            cached = near_duplicate_cache.lookup(method, *near_key)
+            if cached is not None:
+                result_cache.set(cache_key, cached)
+                return cached
+        result = compute()
+        result_cache.set(cache_key, result)
+        if near_key is not None:
+            near_duplicate_cache.add(*near_key, result)
+        return result
+    
+    def _ocr_options(self, charset=None, length=None, model=None):
+        """
+        校验识别选项
+        
+        Args:
+            charset: 允许的字符（CHARSET_PRESETS 中的预设名或字符串），None 表示不限
+            length: 文本长度，None 表示不限
+            model: 自定义模型名（见 app.services.custom_models），None 表示默认模型
+        
+        Returns:
+            tuple: (识别引擎, 允许的字符, 文本长度)
+        
+        Raises:
+            ValueError: 选项无效或模型不存在
+        """
+        engine = self.batch_ocr if model in (None, '') else model_registry.get(model)
+        if charset in (None, ''):
+            charset = None
+        elif not isinstance(charset, str) or len(charset) > MAX_CHARSET_LENGTH:
+            raise ValueError(f"charset 必须是预设名或不超过 {MAX_CHARSET_LENGTH} 个字符的字符串")
+        else:
+            charset = CHARSET_PRESETS.get(charset, charset)
+            if len(engine.allowed_indices(charset)) == 1:
+                raise ValueError(f"charset 中没有模型支持的字符: {charset}")
+        if length in (None, ''):
+            length = None
+        else:
+            try:
+                length = int(length)
+            except (TypeError, ValueError):
+                raise ValueError(f"length 必须是整数: {length}")
+            if not 1 <= length <= MAX_TEXT_LENGTH:
+                raise ValueError(f"length 必须在 1~{MAX_TEXT_LENGTH} 之间")
+        return engine, charset, length
+    
+    def classify(self, image, preprocess=False, charset=None, length=None, model=None):
+        """OCR文字识别，charset/length/model 见 _ocr_options"""
+        engine, charset, length = self._ocr_options(charset, length, model)
         try:
-            image_bytes = get_image_bytes(image)
+            image = DecodedImage(get_image_bytes(image, self._max_image_size()))
+            params = {
+                'preprocess': bool(preprocess), 'charset': charset, 'length': length,
+                'model': getattr(engine, 'version', None)
+            }
+            cache_key = result_cache.make_key('classify', image.data, **params)
             
-            if preprocess:
-                image_bytes = preprocess_image(image_bytes, enhance=True, denoise=True)
+            def compute():
+                item = (image, preprocess, charset, length)
+                if ocr_batcher.enabled and engine is self.batch_ocr and engine.batched:
+                    # 与其他并发请求合并为一次推理（自定义模型和只能逐张推理的模型不参与合并）
+                    return ocr_batcher.submit(item)
+                result = inference_pool.run(self._classify_batch, engine, [item])[0]
+                if isinstance(result, Exception):
+                    raise result
+                return result
             
-            res = self.ocr.classification(image_bytes)
-            return {'text': res, 'confidence': 0.90}
+            return self._get_or_compute(cache_key, compute, 'classify', image, **params)
+        except InferenceBusyError:
+            raise
         except Exception as e:
             current_app.logger.error(f"OCR识别错误: {e}")
             return None
     
-    def batch_classify(self, images, preprocess=False):
-        """批量OCR识别"""
+    def batch_classify(self, images, preprocess=False, charset=None, length=None, model=None):
+        """批量OCR识别 - 未命中缓存的图片合并为一次模型推理"""
+        engine, charset, length = self._ocr_options(charset, length, model)
         try:
-            results = []
-            for idx, image in enumerate(images):
-                result = self.classify(image, preprocess)
-                if result:
-                    results.append({'index': idx, 'result': result})
-                else:
-                    results.append({'index': idx, 'error': '识别失败'})
+            results = [None] * len(images)
+            pending = []  # (index, cache_key, 图片, 近似重复缓存键)
+            params = {
+                'preprocess': bool(preprocess), 'charset': charset, 'length': length,
+                'model': getattr(engine, 'version', None)
+            }
+            fetched = get_images_bytes(images, self._max_image_size(), return_exceptions=True)
+            missed = []  # 未命中字节哈希缓存的 (index, cache_key, 图片)
+            for idx, image_bytes in enumerate(fetched):
+                try:
+                    if isinstance(image_bytes, Exception):
+                        raise image_bytes
+                    cache_key = result_cache.make_key('classify', image_bytes, **params)
+                    cached = result_cache.get(cache_key)
+                    if cached is not None:
+                        results[idx] = {'index': idx, 'result': cached}
+                        continue
+                    missed.append((idx, cache_key, DecodedImage(image_bytes)))
+                except Exception as e:
+                    current_app.logger.error(f"批量识别第 {idx} 张图片错误: {e}")
+                    results[idx] = {'index': idx, 'error': '识别失败'}
+            
+            near_keys = self._near_duplicate_keys('classify', [item[2] for item in missed], **params)
+            for (idx, cache_key, image), near_key in zip(missed, near_keys):
+                if isinstance(near_key, Exception):
+                    current_app.logger.error(f"批量识别第 {idx} 张图片错误: {near_key}")
+                    results[idx] = {'index': idx, 'error': '识别失败'}
+                    continue
+                if near_key is not None:
+                    cached = near_duplicate_cache.lookup('classify', *near_key)
+                    if cached is not None:
+                        result_cache.set(cache_key, cached)
+                        results[idx] = {'index': idx, 'result': cached}
+                        continue
+                pending.append((idx, cache_key, image, near_key))
+            
+            if pending:
+                outputs = inference_pool.run(
+                    self._classify_batch, engine,
+                    [(item[2], preprocess, charset, length) for item in pending]
+                )
+                for (idx, cache_key, _, near_key), result in zip(pending, outputs):
+                    if isinstance(result, Exception):
+                        current_app.logger.error(f"批量识别第 {idx} 张图片错误: {result}")
+                        results[idx] = {'index': idx, 'error': '识别失败'}
+                        continue
+                    result_cache.set(cache_key, result)
+                    if near_key is not None:
+                        near_duplicate_cache.add(*near_key, result)
+                    results[idx] = {'index': idx, 'result': result}
             return results
+        except InferenceBusyError:
+            raise
         except Exception as e:
             current_app.logger.error(f"批量识别错误: {e}")
             return None
@@ -75,73 +285,39 @@ class CaptchaService:
     def detect(self, image):
         """目标检测"""
         try:
-            image_bytes = get_image_bytes(image)
-            poses = self.det.detection(image_bytes)
-            return poses
+            image = DecodedImage(get_image_bytes(image, self._max_image_size()))
+            cache_key = result_cache.make_key('detect', image.data)
+            return self._get_or_compute(
+                cache_key, lambda: inference_pool.run(self._detect, self.det, image), 'detect', image
+            )
+        except InferenceBusyError:
+            raise
         except Exception as e:
             current_app.logger.error(f"检测错误: {e}")
             return None
     
     def calculate(self, image):
-        """计算类验证码 - 使用安全的表达式求值"""
+        """计算类验证码：只在数字和运算符中识别，再对表达式求值"""
         try:
-            image_bytes = get_image_bytes(image)
-            expression = self.ocr.classification(image_bytes)
+            image = DecodedImage(get_image_bytes(image, self._max_image_size()))
+            cache_key = result_cache.make_key('calculate', image.data)
             
-            # 清理表达式
-            expression = re.sub('=.*', '', expression)
-            expression = re.sub('[^0-9+\-*/().]', '', expression)
+            def compute():
+                text = inference_pool.run(self._classify_arithmetic, self.batch_ocr, image)
+                return arithmetic.solve(text)
             
-            if not expression:
-                return None
-            
-            # 安全计算：使用 ast.literal_eval 的替代方案
-            result = self._safe_eval(expression)
-            return result
+            return self._get_or_compute(cache_key, compute, 'calculate', image)
+        except InferenceBusyError:
+            raise
         except Exception as e:
             current_app.logger.error(f"计算验证码错误: {e}")
             return None
     
-    def _safe_eval(self, expression):
-        """安全的数学表达式求值"""
-        import ast
-        import operator
-        
-        # 支持的操作符
-        operators = {
-            ast.Add: operator.add,
-            ast.Sub: operator.sub,
-            ast.Mult: operator.mul,
-            ast.Div: operator.truediv,
-            ast.USub: operator.neg,
-        }
-        
-        def eval_node(node):
-            if isinstance(node, ast.Num):
-                return node.n
-            elif isinstance(node, ast.BinOp):
-                left = eval_node(node.left)
-                right = eval_node(node.right)
-                return operators[type(node.op)](left, right)
-            elif isinstance(node, ast.UnaryOp):
-                operand = eval_node(node.operand)
-                return operators[type(node.op)](operand)
-            else:
-                raise ValueError(f"不支持的表达式类型: {type(node)}")
-        
-        try:
-            tree = ast.parse(expression, mode='eval')
-            result = eval_node(tree.body)
-            return int(result) if isinstance(result, float) and result.is_integer() else result
-        except Exception as e:
-            current_app.logger.error(f"表达式求值错误: {e}")
-            return None
-    
     def crop_image(self, image_data, y_coordinate):
         """图片分割 - 支持多种输入格式"""
         try:
             # 使用统一的图片获取方法
-            image_bytes = get_image_bytes(image_data)
+            image_bytes = get_image_bytes(image_data, self._max_image_size())
             image = Image.open(BytesIO(image_bytes))
             
             # 验证坐标有效性
@@ -162,15 +338,119 @@ class CaptchaService:
     def click_select(self, image):
         """点选验证码 - 返回文字和中心点坐标"""
         try:
-            image_bytes = get_image_bytes(image)
-            image_array = np.frombuffer(image_bytes, dtype=np.uint8)
-            im = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-            bboxes = self.det.detection(image_bytes)
-            
-            if not bboxes or len(bboxes) == 0:
-                return []
-            
-            results = []
+            image = DecodedImage(get_image_bytes(image, self._max_image_size()))
+            cache_key = result_cache.make_key('click_select', image.data)
+            return self._get_or_compute(
+                cache_key,
+                lambda: inference_pool.run(self._click_select, self.det, self.batch_ocr, image),
+                'click_select', image
+            )
+        except InferenceBusyError:
+            raise
+        except Exception as e:
+            current_app.logger.error(f"点选识别错误: {e}")
+            return None
+    
+    # 以下方法在推理线程池中执行，模型由调用方传入（避免在线程池中触发模型加载）
+    
+    @staticmethod
+    def _ocr_input(image, preprocess, channels=1):
+        """识别前按需预处理，返回灰度数组（channels 为 3 时返回 RGB 数组）"""
+        if preprocess:
+            image = image.preprocess(enhance=True, denoise=True)
+        return image.rgb if channels == 3 else image.gray
+    
+    @staticmethod
+    def _classify_arithmetic(batch_ocr, image):
+        """算术验证码识别（只解码 arithmetic.CHARSET 中的字符）"""
+        array = batch_ocr.prepare(CaptchaService._ocr_input(image, False))
+        with stage_timer('inference'):
+            return batch_ocr.recognize([array], allowed=batch_ocr.allowed_indices(arithmetic.CHARSET))[0]
+    
+    @staticmethod
+    def _classify_batch(engine, items):
+        """
+        批量OCR识别
+        
+        Args:
+            engine: BatchOcrEngine 或自定义模型（CustomModel）
+            items: (图片, 是否预处理, 允许的字符, 文本长度) 列表
+        
+        Returns:
+            list: 与 items 顺序一致的 {'text', 'confidence', 'char_confidences'}，
+                  处理失败的图片在对应位置返回异常对象
+        """
+        results = [None] * len(items)
+        arrays, positions = [], []
+        for idx, (image, preprocess, _, _) in enumerate(items):
+            try:
+                arrays.append(engine.prepare(CaptchaService._ocr_input(image, preprocess, engine.channels)))
+                positions.append(idx)
+            except Exception as e:
+                results[idx] = e
+        with stage_timer('inference'):
+            for idx, logits in zip(positions, engine.infer(arrays)):
+                _, _, charset, length = items[idx]
+                allowed = engine.allowed_indices(charset) if charset else None
+                text, confidences = engine.read(logits, allowed, length)
+                results[idx] = {
+                    'text': text,
+                    # 整体置信度为各字符置信度的平均值
+                    'confidence': round(sum(confidences) / len(confidences), 4) if confidences else 0.0,
+                    'char_confidences': [round(c, 4) for c in confidences]
+                }
+        return results
+    
+    @staticmethod
+    def _slide_match(ocr, sliding, back, simple_target, preprocess):
+        """滑块匹配（ocr 为 None 时使用 OpenCV 实现）"""
+        if preprocess:
+            sliding = sliding.preprocess(enhance=True)
+            back = back.preprocess(enhance=True)
+        if ocr is None:
+            sliding_gray, back_gray, alpha = sliding.gray, back.gray, sliding.alpha
+            with stage_timer('inference'):
+                return slider.slide_match(sliding_gray, back_gray, alpha, simple_target=bool(simple_target))
+        sliding_rgb, back_rgb = sliding.rgb, back.rgb
+        with stage_timer('inference'):
+            return ocr.slide_match(sliding_rgb, back_rgb, simple_target=simple_target)
+    
+    @staticmethod
+    def _slide_comparison(ocr, sliding, back):
+        """滑块对比（ocr 为 None 时使用 OpenCV 实现）"""
+        if ocr is None:
+            sliding_bgr, back_bgr = sliding.bgr, back.bgr
+            with stage_timer('inference'):
+                return slider.slide_comparison(sliding_bgr, back_bgr)['target'][0]
+        sliding_rgb, back_rgb = sliding.rgb, back.rgb
+        with stage_timer('inference'):
+            return ocr.slide_comparison(sliding_rgb, back_rgb)['target'][0]
+    
+    @staticmethod
+    def _detect(det, image):
+        """目标检测"""
+        bgr = image.bgr
+        with stage_timer('inference'):
+            return detect_bboxes(det, bgr)
+    
+    @staticmethod
+    def _click_select(det, batch_ocr, image):
+        """
+        点选验证码识别：检测框的裁剪区域交给批量识别引擎，结果与逐个识别一致
+
+        只有缩放后宽度相同的裁剪区域合并为一次推理（补齐或缩放到相同宽度会改变识别结果），
+        检测框大小不一时基本上仍是逐个推理；模型只能逐张推理时（batched 为 False）全部逐个推理
+        """
+        im = image.bgr
+        with stage_timer('inference', span='detect'):
+            bboxes = detect_bboxes(det, im)
+        
+        if not bboxes or len(bboxes) == 0:
+            return []
+        
+        gray = image.gray
+        boxes, crops = [], []
+        with timing.span('crop'):
             for bbox in bboxes:
                 x1, y1, x2, y2 = map(int, bbox)
                 
@@ -178,23 +458,22 @@ class CaptchaService:
                 if x2 <= x1 or y2 <= y1:
                     continue
                 
-                cropped_image = im[y1:y2, x1:x2]
-                _, buffer = cv2.imencode('.png', cropped_image)
-                cropped_bytes = buffer.tobytes()
-                
-                text = self.ocr.classification(cropped_bytes)
-                
-                # 计算中心点坐标（更适合点击操作）
-                center_x = (x1 + x2) // 2
-                center_y = (y1 + y2) // 2
-                
-                results.append({
-                    'text': text,
-                    'bbox': [x1, y1, x2, y2],
-                    'center': [center_x, center_y]
-                })
+                boxes.append((x1, y1, x2, y2))
+                crops.append(batch_ocr.prepare(gray[y1:y2, x1:x2]))
+        
+        with stage_timer('inference', span='recognize'):
+            texts = batch_ocr.recognize(crops)
+        
+        results = []
+        for (x1, y1, x2, y2), text in zip(boxes, texts):
+            # 计算中心点坐标（更适合点击操作）
+            center_x = (x1 + x2) // 2
+            center_y = (y1 + y2) // 2
             
-            return results
-        except Exception as e:
-            current_app.logger.error(f"点选识别错误: {e}")
-            return None
+            results.append({
+                'text': text,
+                'bbox': [x1, y1, x2, y2],
+                'center': [center_x, center_y]
+            })
+        
+        return results
@@ -0,0 +1,281 @@
+"""自定义识别模型
+
+CUSTOM_MODEL_DIR 目录下每个模型由两个文件组成：
+- <name>.onnx：ONNX 模型
+- <name>.json：字符集和预处理参数，格式与 dddd_trainer 导出的 charsets.json 相同
+  （{"charset": [...], "word": false, "image": [-1, 64], "channel": 1}）
+
+请求中用 model=<name> 选择模型：
+- 模型在第一次使用时加载，同一模型只加载一次（按模型名加锁）
+- 已加载模型的内存按模型文件大小估算，总和超出 CUSTOM_MODEL_MAX_MEMORY_MB 时
+  卸载最久未使用的模型
+- 每隔 CUSTOM_MODEL_RELOAD_INTERVAL 秒检查一次文件的修改时间和大小，变化后由发现变化的
+  请求重新加载，加载完成前其他请求继续使用旧模型；新文件加载失败时保留旧模型。
+  每个 worker 各自检查，不需要重启 gunicorn。更新模型时应先写入临时文件再重命名，
+  避免读到写了一半的文件
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from app.services.ocr_engine import CtcDecoder
+from app.services.runtime import ort_runtime
+from app.utils.stats import CUSTOM_MODEL_INFERENCE, CUSTOM_MODEL_LOADS, CUSTOM_MODEL_LOAD_LATENCY, CUSTOM_MODEL_UNLOADS
+
+logger = logging.getLogger(__name__)
+
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+
+def _to_mb(value):
+    return round(value / 1024 / 1024, 2)
+
+
+class CustomModel(CtcDecoder):
+    """自定义 ONNX 识别模型（预处理和输出格式与 ddddocr 的 import_onnx_path 一致）"""
+
+    def __init__(self, model_path, charset_path):
+        with open(charset_path, encoding='utf-8') as f:
+            info = json.load(f)
+        missing = [key for key in ('charset', 'word', 'image', 'channel') if key not in info]
+        if missing:
+            raise ValueError(f"字符集文件缺少字段: {', '.join(missing)}")
+        self._init_charset(list(info['charset']))
+        self.word = bool(info['word'])
+        self.width, self.height = (int(value) for value in info['image'])
+        self.channels = int(info['channel'])
+        self.session = ort_runtime.create_session(model_path)
+        self.input_name = self.session.get_inputs()[0].name
+        # 由 ModelRegistry 设置：name 用于指标标签，version 用于结果缓存的键
+        self.name = None
+        self.version = None
+
+    def prepare(self, image):
+        """
+        将图片转换为模型输入
+
+        Args:
+            image: 形状为 (H, W) 的灰度数组（channels 为 1）或 (H, W, 3) 的 RGB 数组
+
+        Returns:
+            np.ndarray: 形状为 (C, H', W') 的 float32 数组
+        """
+        height, width = image.shape[:2]
+        if self.width != -1:
+            size = (self.width, self.height)
+        elif self.word:
+            size = (self.height, self.height)
+        else:
+            size = (max(1, int(width * (self.height / height))), self.height)
+        resized = Image.fromarray(np.ascontiguousarray(image)).resize(size, Image.LANCZOS)
+        array = np.asarray(resized, dtype=np.float32) / 255.0
+        return array[None, :, :] if array.ndim == 2 else array.transpose(2, 0, 1)
+
+    def infer(self, arrays):
+        """逐张推理（自定义模型的 batch 维度不一定是动态的），返回 (T, C) logits 列表"""
+        histogram = CUSTOM_MODEL_INFERENCE.labels(self.name)
+        outputs = []
+        for array in arrays:
+            started = time.perf_counter()
+            output = self.session.run(None, {self.input_name: array[None]})[0]
+            histogram.observe(time.perf_counter() - started)
+            if output.ndim == 3:
+                # (T, 1, C) 或 (1, T, C)
+                output = output[:, 0, :] if output.shape[1] == 1 else output[0]
+            outputs.append(output.reshape(-1, output.shape[-1]))
+        return outputs
+
+
+class _Entry:
+    """已加载的模型"""
+
+    __slots__ = ('model', 'signature', 'size', 'load_seconds', 'loaded_at', 'checked_at')
+
+    def __init__(self, model, signature, size, load_seconds):
+        self.model = model
+        self.signature = signature
+        self.size = size
+        self.load_seconds = load_seconds
+        self.loaded_at = self.checked_at = time.time()
+
+
+class ModelRegistry:
+    """自定义模型注册表（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.directory = ''
+        self.max_memory = 512 * 1024 * 1024
+        self.reload_interval = 5.0
+        self._entries = OrderedDict()  # 按最近使用排序
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """根据应用配置设置模型目录、内存上限和检查间隔"""
+        self.directory = app.config.get('CUSTOM_MODEL_DIR', '')
+        self.max_memory = max(0, app.config.get('CUSTOM_MODEL_MAX_MEMORY_MB', 512)) * 1024 * 1024
+        self.reload_interval = max(0.0, app.config.get('CUSTOM_MODEL_RELOAD_INTERVAL', 5))
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def names(self):
+        """目录中可用的模型名（同时存在 .onnx 和 .json 文件）"""
+        if not self.enabled:
+            return []
+        try:
+            files = set(os.listdir(self.directory))
+        except OSError:
+            return []
+        return sorted(
+            name[:-5] for name in files
+            if name.endswith('.onnx') and f"{name[:-5]}.json" in files and _NAME.match(name[:-5])
+        )
+
+    def _paths(self, name):
+        return os.path.join(self.directory, f"{name}.onnx"), os.path.join(self.directory, f"{name}.json")
+
+    def _signature(self, name):
+        """模型文件和字符集文件的 (修改时间, 大小)，文件不存在时返回 None"""
+        try:
+            stats = [os.stat(path) for path in self._paths(name)]
+        except OSError:
+            return None
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+    def get(self, name):
+        """
+        获取模型，未加载时加载，文件变化后重新加载
+
+        Returns:
+            CustomModel: 已加载的模型，version 属性在每次重新加载后变化
+
+        Raises:
+            ValueError: 未配置模型目录或模型不存在
+        """
+        if not self.enabled:
+            raise ValueError('未配置自定义模型目录 (CUSTOM_MODEL_DIR)')
+        if not isinstance(name, str) or not _NAME.match(name):
+            raise ValueError(f"无效的模型名: {name}")
+
+        entry = self._entries.get(name)
+        if entry is not None and time.time() - entry.checked_at < self.reload_interval:
+            self._touch(name)
+            return entry.model
+
+        signature = self._signature(name)
+        if signature is None:
+            if entry is not None:
+                self._unload(name)
+            raise ValueError(f"模型不存在: {name}")
+        if entry is not None and entry.signature == signature:
+            entry.checked_at = time.time()
+            self._touch(name)
+            return entry.model
+
+        lock = self._name_lock(name)
+        if entry is not None:
+            # 文件已变化：只由一个请求重新加载，其他请求继续使用旧模型
+            if not lock.acquire(blocking=False):
+                return entry.model
+            try:
+                return self._load(name, signature, previous=entry).model
+            finally:
+                lock.release()
+        with lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                return entry.model
+            return self._load(name, signature).model
+
+    def _name_lock(self, name):
+        with self._lock:
+            lock = self._locks.get(name)
+            if lock is None:
+                lock = self._locks[name] = threading.Lock()
+            return lock
+
+    def _touch(self, name):
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+
+    def _load(self, name, signature, previous=None):
+        model_path, charset_path = self._paths(name)
+        started = time.perf_counter()
+        try:
+            model = CustomModel(model_path, charset_path)
+        except Exception as e:
+            CUSTOM_MODEL_LOADS.labels(name, 'failed').inc()
+            if previous is None:
+                raise
+            # 新文件可能还没有写完，保留旧模型，下次检查时再试
+            logger.warning(f"模型 {name} 重新加载失败，继续使用旧模型: {e}")
+            previous.checked_at = time.time()
+            return previous
+        elapsed = time.perf_counter() - started
+        model.name = name
+        model.version = f"{name}@{max(mtime for mtime, _ in signature)}"
+        CUSTOM_MODEL_LOADS.labels(name, 'reloaded' if previous else 'loaded').inc()
+        CUSTOM_MODEL_LOAD_LATENCY.labels(name).observe(elapsed)
+
+        entry = _Entry(model, signature, sum(size for _, size in signature), round(elapsed, 3))
+        with self._lock:
+            self._entries[name] = entry
+            self._entries.move_to_end(name)
+            evicted = self._evict(keep=name)
+        for evicted_name in evicted:
+            CUSTOM_MODEL_UNLOADS.labels(evicted_name).inc()
+            logger.info(f"超出自定义模型内存上限，卸载模型: {evicted_name}")
+        return entry
+
+    def _evict(self, keep):
+        """卸载最久未使用的模型直到内存估算不超过上限（不卸载 keep），需持有 self._lock"""
+        evicted = []
+        total = sum(entry.size for entry in self._entries.values())
+        for name in list(self._entries):
+            if total <= self.max_memory:
+                break
+            if name == keep:
+                continue
+            total -= self._entries.pop(name).size
+            evicted.append(name)
+        return evicted
+
+    def _unload(self, name):
+        with self._lock:
+            removed = self._entries.pop(name, None) is not None
+        if removed:
+            CUSTOM_MODEL_UNLOADS.labels(name).inc()
+
+    def get_stats(self):
+        """获取配置和当前 worker 已加载的模型（推理和加载统计见 stats.get_custom_model_stats）"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return {
+            'enabled': self.enabled,
+            'available': self.names(),
+            'max_memory_mb': _to_mb(self.max_memory),
+            'memory_mb': _to_mb(sum(entry.size for _, entry in entries)),
+            'reload_interval': self.reload_interval,
+            'loaded': {
+                name: {
+                    'version': entry.model.version,
+                    'memory_mb': _to_mb(entry.size),
+                    'load_seconds': entry.load_seconds,
+                    'loaded_at': round(entry.loaded_at, 3)
+                }
+                for name, entry in entries
+            }
+        }
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,52 @@
+"""目标检测
+
+在已解码的像素数组上调用 ddddocr 的检测模型。ddddocr 的 DetectionEngine 只接受
+字节流（非 bytes 输入会先编码为 PNG 再解码），这里复用其预处理和后处理，
+直接使用数组作为输入。
+"""
+import numpy as np
+
+INPUT_SIZE = (416, 416)
+
+
+def preprocess_input(engine, image):
+    """BGR 像素数组 -> 检测模型输入（形状为 (1, 3, 416, 416)）"""
+    im, _ = engine.preproc(image, INPUT_SIZE)
+    return im[None, :, :, :]
+
+
+def detect_bboxes(det, image):
+    """
+    目标检测（结果与 DdddOcr.detection 一致）
+
+    Args:
+        det: 检测模式的 ddddocr.DdddOcr 实例
+        image: BGR 像素数组
+
+    Returns:
+        list: 边界框列表，每个边界框格式为 [x1, y1, x2, y2]
+    """
+    engine = det.detection_engine
+    im, ratio = engine.preproc(image, INPUT_SIZE)
+    output = engine.session.run(None, {engine.session.get_inputs()[0].name: im[None, :, :, :]})
+    predictions = engine.demo_postprocess(output[0], INPUT_SIZE)[0]
+
+    boxes = predictions[:, :4]
+    scores = predictions[:, 4:5] * predictions[:, 5:]
+    boxes_xyxy = np.empty_like(boxes)
+    boxes_xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2.
+    boxes_xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2.
+    boxes_xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2.
+    boxes_xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2.
+    boxes_xyxy /= ratio
+
+    dets = engine.multiclass_nms(boxes_xyxy, scores, nms_thr=0.45, score_thr=0.1)
+    if dets is None:
+        return []
+
+    # 裁剪到图片范围内
+    height, width = image.shape[:2]
+    final_boxes = dets[:, :4]
+    final_boxes[:, [0, 2]] = np.clip(final_boxes[:, [0, 2]], 0, width)
+    final_boxes[:, [1, 3]] = np.clip(final_boxes[:, [1, 3]], 0, height)
+    return final_boxes.astype(int).tolist()
@@ -0,0 +1,178 @@
+"""推理线程池
+
+ddddocr 的推理是 CPU 密集型调用，直接在 gevent worker 中执行会阻塞整个事件循环。
+这里把模型调用放到真正的系统线程中执行（onnxruntime 推理期间会释放 GIL），
+请求协程只需协作式地等待结果；排队任务超过上限时立即拒绝，由路由返回 503。
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.admission import record_cost
+from app.utils import timing
+from app.utils.profiler import request_profiler
+from app.utils.stats import INFERENCE_IN_FLIGHT, INFERENCE_TASKS
+
+
+class InferenceBusyError(Exception):
+    """推理线程池已满"""
+
+    code = 503
+
+
+def gevent_patched():
+    """当前进程是否已被 gevent monkey patch（gunicorn gevent worker）"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+class InferencePool:
+    """推理线程池（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.enabled = False
+        self.size = 2
+        self.queue_size = 32
+        self._pool = None
+        self._pool_pid = None
+        self._use_gevent = False
+        self._lock = threading.Lock()
+        # 当前 worker 中正在执行和排队的任务数，用于拒绝超出上限的任务
+        self.in_flight = 0
+
+    def init_app(self, app):
+        """根据应用配置初始化线程池参数"""
+        self.enabled = app.config.get('INFERENCE_POOL_ENABLED', True)
+        self.size = max(1, app.config.get('INFERENCE_POOL_SIZE', 2))
+        self.queue_size = max(0, app.config.get('INFERENCE_QUEUE_SIZE', 32))
+
+    def run(self, func, *args, **kwargs):
+        """
+        在推理线程池中执行 func 并等待结果
+
+        Raises:
+            InferenceBusyError: 正在执行和排队的任务数已达上限
+        """
+        if not self.enabled:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_cost(time.perf_counter() - started)
+
+        self._reserve()
+        try:
+            pool = self._get_pool()
+            task = self._task(func, args, kwargs)
+            if self._use_gevent:
+                return pool.spawn(task).get()
+            return pool.submit(task).result()
+        finally:
+            self._release()
+
+    def submit(self, func, *args, callback):
+        """
+        在推理线程池中执行 func，不等待结果，完成后调用 callback(result, error)
+        （gevent worker 中 callback 在事件循环中执行，可以直接唤醒等待的协程）
+
+        Raises:
+            InferenceBusyError: 正在执行和排队的任务数已达上限
+        """
+        if not self.enabled:
+            try:
+                result = self.run(func, *args)
+            except Exception as e:
+                callback(None, e)
+            else:
+                callback(result, None)
+            return
+
+        self._reserve()
+
+        def done(result, error):
+            self._release()
+            callback(result, error)
+
+        def future_done(future):
+            error = future.exception()
+            done(None if error else future.result(), error)
+
+        try:
+            pool = self._get_pool()
+            task = self._task(func, args, {})
+            if self._use_gevent:
+                pool.spawn(task).rawlink(lambda r: done(r.value, r.exception))
+            else:
+                pool.submit(task).add_done_callback(future_done)
+        except Exception:
+            self._release()
+            raise
+
+    def _reserve(self):
+        with self._lock:
+            busy = self.in_flight >= self.size + self.queue_size
+            if not busy:
+                self.in_flight += 1
+        if busy:
+            INFERENCE_TASKS.labels('rejected').inc()
+            raise InferenceBusyError(f"推理任务已满: {self.in_flight}")
+        INFERENCE_IN_FLIGHT.inc()
+
+    def _release(self):
+        INFERENCE_IN_FLIGHT.dec()
+        INFERENCE_TASKS.labels('completed').inc()
+        with self._lock:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _task(func, args, kwargs):
+        submitted = time.perf_counter()
+
+        def call():
+            # 在推理线程中继承调用方的上下文，记录排队时间和占用推理线程的时间（准入控制的耗时估计）
+            started = time.perf_counter()
+            timing.record('inference_queue', submitted, started - submitted)
+            try:
+                return request_profiler.track_task(func, *args, **kwargs)
+            finally:
+                record_cost(time.perf_counter() - started)
+
+        return timing.bind(call)
+
+    @property
+    def idle_threads(self):
+        """当前 worker 中空闲的推理线程数（后台任务只在有空闲线程时提交，不与在线请求争抢）"""
+        if not self.enabled:
+            return 1
+        return max(0, self.size - self.in_flight)
+
+    def _get_pool(self):
+        # 线程池不能跨 fork 使用，每个 worker 进程各自创建
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._use_gevent = gevent_patched()
+                if self._use_gevent:
+                    # gevent 的 ThreadPool 使用系统线程，等待结果时不阻塞事件循环
+                    from gevent.threadpool import ThreadPool
+                    self._pool = ThreadPool(self.size)
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='inference')
+                self._pool_pid = os.getpid()
+        return self._pool
+
+    def get_stats(self):
+        """获取线程池配置（任务统计见 stats.get_inference_pool_stats）"""
+        return {
+            'enabled': self.enabled,
+            'size': self.size,
+            'queue_size': self.queue_size
+        }
+
+
+inference_pool = InferencePool()
@@ -0,0 +1,567 @@
+"""离线识别任务队列
+
+大批量、不要求实时返回的识别（如夜间回填）提交为任务：请求中的图片写入本地 SQLite
+数据库（JOB_DB_PATH）后立即返回任务 id，由各 worker 进程的后台线程从数据库中认领图片、
+调用 CaptchaService 识别并写回结果，客户端轮询任务状态并分页读取结果。
+同一个数据库由所有 gunicorn worker 共享（WAL 模式），进程重启后未完成的任务继续处理，
+认领后超过 JOB_ITEM_TIMEOUT 秒未完成的图片（进程退出）重新排队。
+
+优先级：
+- 在线请求优先：后台线程只在推理线程池有空闲线程、且没有在线请求等待准入时认领图片，每次最多占用 JOB_WORKERS 个
+  推理线程，在线请求最多等待正在执行的一批任务图片
+- 任务之间按 priority（high/normal/low）、再按提交时间先后处理
+- 同一批认领的文字识别图片（相同参数）合并为一次批量推理
+- 每张图片（文字识别为每组）经过准入控制，推理耗时计入积压量；不能立即准入时不等待，
+  未处理的图片放回队列
+
+已结束的任务保留 JOB_RETENTION_HOURS 小时后删除。默认关闭（JOB_QUEUE_ENABLED）。
+
+SQLite 调用是阻塞的（等待其他进程的写锁最长 30 秒、磁盘 IO），gevent worker 中在 hub 的
+系统线程池中执行（见 _blocking），不阻塞事件循环；请求体仍在请求协程中读取。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from app.services.admission import admission_controller
+from app.services.batch_stream import parse_item, parse_line, recognize
+from app.services.executor import InferenceBusyError, gevent_patched, inference_pool
+from app.utils.stats import JOB_ITEMS, JOB_OLDEST_AGE, JOB_QUEUE_LAG, JOB_QUEUED_ITEMS
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+ACTIVE_STATUSES = ('queued', 'running')
+INSERT_CHUNK_SIZE = 500  # 提交任务时每次写入的图片数
+MAINTENANCE_INTERVAL = 60  # 回收超时图片、删除过期任务的间隔（秒）
+GAUGE_INTERVAL = 5  # 更新排队数量指标的间隔（秒）
+BUSY_BACKOFF = 0.05  # 推理线程池没有空闲线程时的等待时间（秒）
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    succeeded INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    item_id TEXT,
+    kind TEXT,
+    image TEXT,
+    options TEXT,
+    status TEXT NOT NULL,
+    claimed_at REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items (job_id, status, idx);
+"""
+
+
+def _blocking(method):
+    """
+    方法体只包含阻塞的 SQLite 调用：gevent worker 中在 hub 的系统线程池中执行，
+    当前协程等待结果（被装饰的方法之间不能互相调用，线程池中的线程没有 hub）
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if gevent_patched():
+            import gevent
+
+            return gevent.get_hub().threadpool.apply(method, args, kwargs)
+        return method(*args, **kwargs)
+    return wrapper
+
+
+class JobQueue:
+    """SQLite 任务队列（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self, service=None):
+        """
+        Args:
+            service: 执行识别的 CaptchaService 实例（由 CaptchaService 创建时设置）
+        """
+        self.service = service
+        self.enabled = False
+        self.path = '/tmp/captcha-api-jobs.db'
+        self.workers = 1
+        self.claim_size = 16
+        self.max_items = 100000
+        self.retention = 24 * 3600
+        self.item_timeout = 300
+        self.poll_interval = 1.0
+        self._app = None
+        self._threads = []
+        self._threads_pid = None
+        self._lock = threading.Lock()
+        self._next_maintenance = 0.0
+        self._next_gauge = 0.0
+
+    def init_app(self, app):
+        """根据应用配置创建数据库，在每个 worker 进程收到第一个请求时启动后台线程"""
+        self.enabled = app.config.get('JOB_QUEUE_ENABLED', False)
+        if not self.enabled:
+            return
+        self.path = app.config.get('JOB_DB_PATH', self.path)
+        self.workers = max(1, app.config.get('JOB_WORKERS', 1))
+        self.claim_size = max(1, app.config.get('JOB_CLAIM_SIZE', 16))
+        self.max_items = max(1, app.config.get('JOB_MAX_ITEMS', 100000))
+        self.retention = max(0, app.config.get('JOB_RETENTION_HOURS', 24)) * 3600
+        self.item_timeout = max(1, app.config.get('JOB_ITEM_TIMEOUT', 300))
+        self._app = app
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        # gunicorn preload 时 create_app 在 master 进程中执行，后台线程只在 worker 中启动
+        app.before_request(self._ensure_workers)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务（BEGIN IMMEDIATE，多个进程同时认领时不会读到相同的图片）"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    # 任务提交和查询（在请求中调用）
+
+    def create(self, entries, owner=None, priority='normal', defaults=None):
+        """
+        创建任务
+
+        Args:
+            entries: 请求对象（dict）或 NDJSON 行（bytes，或 batch_stream.read_lines 返回的异常）的迭代器
+            owner: 提交任务的 API Key id，只有同一个 Key 可以查询
+            priority: high / normal / low
+            defaults: 请求对象中未设置的识别参数的默认值
+
+        Returns:
+            dict: 任务状态
+
+        Raises:
+            ValueError: priority 无效、没有图片或图片数超过 JOB_MAX_ITEMS
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority 必须是 {'/'.join(PRIORITIES)} 之一")
+        defaults = defaults or {}
+        job_id = uuid.uuid4().hex
+        self._insert_job(job_id, owner, PRIORITIES[priority])
+        try:
+            total, failed = self._insert_items(job_id, entries, defaults)
+            if total == 0:
+                raise ValueError('任务中没有图片')
+        except BaseException:
+            self._delete_job(job_id)
+            raise
+        self._submit_job(job_id, total, failed)
+        return self.get(job_id, owner)
+
+    @_blocking
+    def _insert_job(self, job_id, owner, priority):
+        # 写入图片期间状态为 creating，后台线程不会认领
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, owner, priority, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, owner, priority, 'creating', time.time())
+            )
+
+    @_blocking
+    def _delete_job(self, job_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM job_items WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    @_blocking
+    def _submit_job(self, job_id, total, failed):
+        status = 'completed' if failed == total else 'queued'
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, total = ?, failed = ?, finished_at = ? WHERE id = ?',
+                (status, total, failed, time.time() if status == 'completed' else None, job_id)
+            )
+
+    def _insert_items(self, job_id, entries, defaults):
+        """分批写入图片，格式错误的图片直接记为失败，返回 (图片数, 失败数)"""
+        total = failed = 0
+        rows = []
+        for entry in entries:
+            if total >= self.max_items:
+                raise ValueError(f"单个任务最多 {self.max_items} 张图片")
+            try:
+                if isinstance(entry, Exception):
+                    raise entry
+                if isinstance(entry, (bytes, str)):
+                    item_id, kind, image, options = parse_line(entry, defaults)
+                else:
+                    item_id, kind, image, options = parse_item(entry, defaults)
+                if not isinstance(image, str):
+                    raise ValueError('image 必须是 base64 或 URL 字符串')
+                rows.append((job_id, total, json.dumps(item_id), kind, image, json.dumps(options), 'queued', None))
+            except ValueError as e:
+                rows.append((job_id, total, None, None, None, None, 'failed', f'参数错误: {str(e)}'))
+                failed += 1
+            total += 1
+            if len(rows) >= INSERT_CHUNK_SIZE:
+                self._write_items(rows)
+                rows = []
+        if rows:
+            self._write_items(rows)
+        return total, failed
+
+    @_blocking
+    def _write_items(self, rows):
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT INTO job_items (job_id, idx, item_id, kind, image, options, status, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+
+    @staticmethod
+    def _job_dict(row):
+        pending = row['total'] - row['succeeded'] - row['failed'] - row['cancelled']
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'priority': PRIORITY_NAMES.get(row['priority'], 'normal'),
+            'total': row['total'],
+            'succeeded': row['succeeded'],
+            'failed': row['failed'],
+            'cancelled': row['cancelled'],
+            'pending': pending,
+            'progress': round((row['total'] - pending) / row['total'], 4) if row['total'] else 0,
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+
+    def _get_row(self, conn, job_id, owner):
+        row = conn.execute("SELECT * FROM jobs WHERE id = ? AND status != 'creating'", (job_id,)).fetchone()
+        if row is None or row['owner'] != owner:
+            return None
+        return row
+
+    @_blocking
+    def get(self, job_id, owner=None):
+        """任务状态，不存在或不属于 owner 时返回 None"""
+        with self._connect() as conn:
+            row = self._get_row(conn, job_id, owner)
+        return self._job_dict(row) if row is not None else None
+
+    @_blocking
+    def results(self, job_id, owner=None, offset=0, limit=100, status=None):
+        """
+        分页读取已完成的图片结果（按图片序号）
+
+        Args:
+            offset: 起始图片序号（上一页返回的 next_offset）
+            status: succeeded / failed，None 表示两者
+
+        Returns:
+            dict: {'results': [...], 'next_offset': 下一页的 offset，没有更多结果时为 None}，
+                  任务不存在时返回 None
+        """
+        statuses = (status,) if status else ('succeeded', 'failed')
+        with self._connect() as conn:
+            if self._get_row(conn, job_id, owner) is None:
+                return None
+            rows = conn.execute(
+                f"SELECT idx, item_id, status, result, error FROM job_items "
+                f"WHERE job_id = ? AND idx >= ? AND status IN ({', '.join('?' * len(statuses))}) "
+                f"ORDER BY idx LIMIT ?",
+                (job_id, offset, *statuses, limit + 1)
+            ).fetchall()
+        results = []
+        for row in rows[:limit]:
+            entry = {'index': row['idx']}
+            item_id = json.loads(row['item_id']) if row['item_id'] else None
+            if item_id is not None:
+                entry['id'] = item_id
+            if row['status'] == 'succeeded':
+                entry['result'] = json.loads(row['result'])
+            else:
+                entry['error'] = row['error']
+            results.append(entry)
+        return {'results': results, 'next_offset': rows[limit]['idx'] if len(rows) > limit else None}
+
+    @_blocking
+    def cancel(self, job_id, owner=None):
+        """取消任务：未开始的图片不再处理（正在处理的图片完成后仍会记录结果），不存在时返回 None"""
+        with self._transaction() as conn:
+            if self._get_row(conn, job_id, owner) is None:
+                return None
+            cancelled = conn.execute(
+                "UPDATE job_items SET status = 'cancelled', image = NULL WHERE job_id = ? AND status = 'queued'",
+                (job_id,)
+            ).rowcount
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancelled = cancelled + ?, finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (cancelled, time.time(), job_id)
+            )
+            row = self._get_row(conn, job_id, owner)
+        return self._job_dict(row)
+
+    # 后台处理
+
+    def _ensure_workers(self):
+        # fork 后子进程中没有父进程的线程，需要按进程重新启动
+        if self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads_pid != os.getpid():
+                self._threads = [
+                    threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                    for i in range(self.workers)
+                ]
+                self._threads_pid = os.getpid()
+                for thread in self._threads:
+                    thread.start()
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                try:
+                    self._maintain()
+                    # 在线请求优先：推理线程都在使用或有在线请求等待准入时不认领新的图片
+                    if inference_pool.idle_threads <= 0 or admission_controller.waiting > 0:
+                        time.sleep(BUSY_BACKOFF)
+                        continue
+                    claimed = self._claim()
+                    if not claimed:
+                        time.sleep(self.poll_interval)
+                        continue
+                    self._process(*claimed)
+                except Exception as e:
+                    logger.error(f"任务处理错误: {e}", exc_info=True)
+                    time.sleep(self.poll_interval)
+
+    def _maintain(self):
+        """定期回收超时的图片、删除过期的任务并更新排队指标"""
+        now = time.time()
+        if now >= self._next_maintenance:
+            self._next_maintenance = now + MAINTENANCE_INTERVAL
+            self._recover(now)
+        if now >= self._next_gauge:
+            self._next_gauge = now + GAUGE_INTERVAL
+            backlog = self._backlog()
+            JOB_QUEUED_ITEMS.set(backlog['pending_items'])
+            JOB_OLDEST_AGE.set(backlog['oldest_pending_seconds'])
+
+    @_blocking
+    def _recover(self, now):
+        """超时的图片重新排队，删除过期的任务"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE job_items SET status = 'queued', claimed_at = NULL "
+                "WHERE status = 'running' AND claimed_at < ?",
+                (now - self.item_timeout,)
+            )
+            expired = [row[0] for row in conn.execute(
+                'SELECT id FROM jobs WHERE finished_at < ?', (now - self.retention,)
+            )]
+            for job_id in expired:
+                conn.execute('DELETE FROM job_items WHERE job_id = ?', (job_id,))
+                conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    @_blocking
+    def _claim(self):
+        """
+        认领优先级最高的任务中的一批图片
+
+        Returns:
+            tuple: (任务 id, 图片行列表)，没有待处理的图片时返回 None
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            job = conn.execute(
+                "SELECT id, created_at FROM jobs WHERE status IN ('queued', 'running') AND EXISTS ("
+                "SELECT 1 FROM job_items WHERE job_id = jobs.id AND status = 'queued') "
+                "ORDER BY priority, created_at LIMIT 1"
+            ).fetchone()
+            if job is None:
+                return None
+            rows = conn.execute(
+                "SELECT idx, kind, image, options FROM job_items WHERE job_id = ? AND status = 'queued' "
+                "ORDER BY idx LIMIT ?",
+                (job['id'], self.claim_size)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE job_items SET status = 'running', claimed_at = ? WHERE job_id = ? AND idx = ?",
+                [(now, job['id'], row['idx']) for row in rows]
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) "
+                "WHERE id = ? AND status = 'queued'",
+                (now, job['id'])
+            )
+        for _ in rows:
+            JOB_QUEUE_LAG.observe(now - job['created_at'])
+        return job['id'], rows
+
+    def _process(self, job_id, rows):
+        """识别一批图片并写回结果；推理线程池已满时放回队列"""
+        outputs = {}  # idx -> (结果, 错误)
+        try:
+            # 相同参数的文字识别合并为一次批量推理，其他类型逐张识别
+            groups = {}
+            for row in rows:
+                if row['kind'] == 'classification':
+                    groups.setdefault(row['options'], []).append(row)
+                else:
+                    with self._admitted(row['kind']):
+                        outputs[row['idx']] = self._recognize(row['kind'], row['image'], json.loads(row['options']))
+            for options, group in groups.items():
+                with self._admitted('batch_classification', len(group)):
+                    outputs.update(self._classify(group, json.loads(options)))
+        except InferenceBusyError:
+            self._requeue(job_id, [row['idx'] for row in rows if row['idx'] not in outputs])
+            time.sleep(BUSY_BACKOFF)
+        if outputs:
+            self._finish(job_id, rows, outputs)
+
+    @staticmethod
+    @contextmanager
+    def _admitted(endpoint, units=1):
+        """
+        准入一张或一组图片（不等待）
+
+        Raises:
+            InferenceBusyError: 不能立即准入（由 _process 放回队列）
+        """
+        with admission_controller.admitted(endpoint, units, wait=False) as retry_after:
+            if retry_after is not None:
+                raise InferenceBusyError('在线请求优先')
+            yield
+
+    @_blocking
+    def _requeue(self, job_id, indices):
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE job_items SET status = 'queued', claimed_at = NULL "
+                "WHERE job_id = ? AND idx = ? AND status = 'running'",
+                [(job_id, idx) for idx in indices]
+            )
+
+    def _recognize(self, kind, image, options):
+        try:
+            result = recognize(self.service, kind, image, options)
+        except ValueError as e:
+            return None, f'参数错误: {str(e)}'
+        return (result, None) if result is not None else (None, '识别失败')
+
+    def _classify(self, rows, options):
+        """一组相同参数的文字识别图片，返回 {idx: (结果, 错误)}"""
+        try:
+            results = self.service.batch_classify(
+                [row['image'] for row in rows], options['preprocess'] or False,
+                options['charset'], options['length'], options['model']
+            )
+        except ValueError as e:
+            return {row['idx']: (None, f'参数错误: {str(e)}') for row in rows}
+        if results is None:
+            return {row['idx']: (None, '识别失败') for row in rows}
+        return {
+            row['idx']: (entry.get('result'), entry.get('error'))
+            for row, entry in zip(rows, results)
+        }
+
+    @_blocking
+    def _finish(self, job_id, rows, outputs):
+        kinds = {row['idx']: row['kind'] for row in rows}
+        succeeded, failed = [], []
+        for idx, (result, error) in outputs.items():
+            if error is None:
+                succeeded.append(('succeeded', json.dumps(result, ensure_ascii=False), None, job_id, idx))
+            else:
+                failed.append(('failed', None, error, job_id, idx))
+            JOB_ITEMS.labels(kinds[idx], 'ok' if error is None else 'error').inc()
+        with self._transaction() as conn:
+            # 只计入仍由本次认领的图片：超时后被重新认领、已由其他 worker 完成的图片不重复计数
+            counts = [
+                conn.executemany(
+                    "UPDATE job_items SET status = ?, result = ?, error = ?, image = NULL, claimed_at = NULL "
+                    "WHERE job_id = ? AND idx = ? AND status = 'running'",
+                    updates
+                ).rowcount if updates else 0
+                for updates in (succeeded, failed)
+            ]
+            conn.execute(
+                'UPDATE jobs SET succeeded = succeeded + ?, failed = failed + ? WHERE id = ?',
+                (*counts, job_id)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', finished_at = ? "
+                "WHERE id = ? AND status = 'running' AND succeeded + failed >= total",
+                (time.time(), job_id)
+            )
+
+    # 统计
+
+    @_blocking
+    def _backlog(self):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COALESCE(SUM(total - succeeded - failed - cancelled), 0) AS pending, "
+                "MIN(created_at) AS oldest FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()
+        return {
+            'pending_items': row['pending'],
+            'oldest_pending_seconds': round(time.time() - row['oldest'], 3) if row['oldest'] else 0
+        }
+
+    def get_stats(self):
+        """获取队列配置和当前积压（来自数据库，所有 worker 共享）"""
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'workers': self.workers,
+            'claim_size': self.claim_size,
+            'jobs_by_status': self._status_counts(),
+            **self._backlog()
+        }
+
+    @_blocking
+    def _status_counts(self):
+        with self._connect() as conn:
+            return {row['status']: row['count'] for row in conn.execute(
+                "SELECT status, COUNT(*) AS count FROM jobs WHERE status != 'creating' GROUP BY status"
+            )}
+
+
+job_queue = JobQueue()
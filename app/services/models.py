@@ -0,0 +1,136 @@
+"""模型管理
+
+模型在第一次使用时才加载，只服务 /classification 的 worker 不会加载检测模型。
+MODEL_WARMUP 中列出的模型在 create_app 时预先加载：配合 gunicorn 的
+preload_app=True，预加载发生在 master 进程，fork 出的 worker 以写时复制的方式
+共享同一份只读的模型权重，而不是各自再加载一份。
+"""
+import os
+import threading
+import time
+
+
+def _read_proc_memory():
+    """读取当前进程内存（Linux），返回 rss/shared/private 字节数"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+        return {
+            'rss': fields.get('Rss', 0),
+            'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+            'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+        }
+    except OSError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        return {'rss': rss_pages * os.sysconf('SC_PAGE_SIZE')}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def _to_mb(value):
+    return round(value / 1024 / 1024, 2)
+
+
+class ModelManager:
+    """按需加载模型（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._info = {}
+        self._lock = threading.RLock()
+        self._nested = []
+        self.created_at = time.time()
+        self.ready_at = None
+
+    def register(self, name, loader):
+        """
+        注册模型加载函数
+
+        Args:
+            name: 模型名称
+            loader: 无参函数，返回加载好的模型对象
+        """
+        self._loaders[name] = loader
+
+    def init_app(self, app):
+        """加载 MODEL_WARMUP 中配置的模型"""
+        warmup = app.config.get('MODEL_WARMUP', [])
+        if isinstance(warmup, str):
+            warmup = [name.strip() for name in warmup.split(',') if name.strip()]
+        for name in warmup:
+            if name not in self._loaders:
+                app.logger.warning(f"未知的预加载模型: {name}")
+                continue
+            self.get(name)
+        self.ready_at = time.time()
+
+    def get(self, name):
+        """获取模型，未加载时加载"""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._load(name)
+        return model
+
+    def _load(self, name):
+        # 加载过程中可能递归加载依赖的模型，其耗时和内存从本模型中扣除
+        self._nested.append([0.0, 0])
+        before = _read_proc_memory().get('rss', 0)
+        started = time.perf_counter()
+        try:
+            model = self._loaders[name]()
+        finally:
+            nested_seconds, nested_bytes = self._nested.pop()
+        elapsed = time.perf_counter() - started
+        grown = max(0, _read_proc_memory().get('rss', 0) - before)
+        if self._nested:
+            self._nested[-1][0] += elapsed
+            self._nested[-1][1] += grown
+
+        self._info[name] = {
+            'load_seconds': round(elapsed - nested_seconds, 3),
+            'memory_mb': _to_mb(max(0, grown - nested_bytes)),
+            'loaded_pid': os.getpid()
+        }
+        self._models[name] = model
+        return model
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get_info(self):
+        """获取模型加载信息"""
+        pid = os.getpid()
+        models = {}
+        for name in self._loaders:
+            info = self._info.get(name)
+            if info is None:
+                models[name] = {'loaded': False}
+            else:
+                models[name] = {
+                    'loaded': True,
+                    'load_seconds': info['load_seconds'],
+                    'memory_mb': info['memory_mb'],
+                    # 在 master 中预加载，worker 通过写时复制共享
+                    'shared_from_parent': info['loaded_pid'] != pid
+                }
+        memory = {key: _to_mb(value) for key, value in _read_proc_memory().items()}
+        return {
+            'startup_seconds': round(self.ready_at - self.created_at, 3) if self.ready_at else None,
+            'models': models,
+            'memory_mb': memory
+        }
+
+
+model_manager = ModelManager()
@@ -0,0 +1,287 @@
+"""批量OCR推理引擎
+
+ddddocr 自带的识别模型把输入的 batch 维度固定为 1，只能逐张推理。
+这里把同一个 ONNX 模型的 batch 维度改为动态，把多张图片缩放后按宽度分组，
+同宽的图片合并为一个张量只调用一次 onnxruntime，再对输出做向量化的 CTC 解码。
+
+为了让每张图片的结果与单独识别完全一致、不受同批其他图片影响：
+- 只合并宽度相同的图片，不做补齐（识别模型含 LSTM，补齐部分会影响有效部分的输出）
+- ddddocr 的 common_old.onnx 是动态 INT8 量化模型，量化参数按整个输入张量计算，
+  同批的其他图片会改变量化结果。默认（ORT_OCR_MODEL=float）使用还原为浮点权重的版本，
+  可以合并推理；仍使用动态量化模型时（ORT_OCR_MODEL=quantized 或 ORT_QUANTIZED_MODELS
+  包含 ocr）逐张推理，batched 为 False
+
+识别结果只可能来自一个小字符集时（如算术验证码、纯数字验证码），解码时只保留这些类别
+的输出（在这些类别上重新做 softmax），既排除了形近的其他字符，也省去了在全部类别上的
+argmax。已知字符数时，用动态规划在 CTC 路径中找出恰好输出该长度文本的最优路径。
+"""
+import string
+from collections import defaultdict
+
+import numpy as np
+import onnx
+from PIL import Image
+
+from app.services.runtime import is_dynamically_quantized, ort_runtime
+
+
+# 字符集预设，也可以直接传入允许的字符
+CHARSET_PRESETS = {
+    'digits': string.digits,
+    'lowercase': string.ascii_lowercase,
+    'uppercase': string.ascii_uppercase,
+    'letters': string.ascii_letters,
+    'lower_digits': string.ascii_lowercase + string.digits,
+    'upper_digits': string.ascii_uppercase + string.digits,
+    'alphanumeric': string.ascii_letters + string.digits,
+}
+ALLOWED_CACHE_SIZE = 256  # 缓存的字符集数量
+LENGTH_TOP_K = 5  # 未限定字符集时，定长解码只在每帧概率最高的几个类别中搜索
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _collapsed_length(path):
+    """合并重复、去除 blank 后的字符数"""
+    keep = path != 0
+    keep[1:] &= path[1:] != path[:-1]
+    return int(keep.sum())
+
+
+def _fixed_length_path(log_probs, length):
+    """
+    定长 CTC 解码：找出合并重复、去除 blank 后恰好为 length 个字符的最优路径
+
+    Args:
+        log_probs: 形状为 (T, S) 的对数概率，第 0 列为 blank
+        length: 字符数
+
+    Returns:
+        np.ndarray | None: 每一帧选择的列，帧数不足以输出 length 个字符时为 None
+    """
+    frames, size = log_probs.shape
+    cols = np.arange(size)
+    # score[k, s]：已输出 k 个字符、当前帧为 s 的最优得分；back[t, k, s]：上一帧的列
+    score = np.full((length + 1, size), -np.inf)
+    score[0, 0] = log_probs[0, 0]
+    score[1, 1:] = log_probs[0, 1:]
+    back = np.zeros((frames, length + 1, size), dtype=np.int32)
+    rows = np.arange(length + 1)
+    for t in range(1, frames):
+        best_idx = score.argmax(axis=1)
+        best = score[rows, best_idx]
+        others = score.copy()
+        others[rows, best_idx] = -np.inf
+        second_idx = others.argmax(axis=1)
+        second = others[rows, second_idx]
+
+        new = np.full_like(score, -np.inf)
+        # blank：字符数不变
+        new[:, 0] = best + log_probs[t, 0]
+        back[t, :, 0] = best_idx
+        # 非 blank：重复上一帧的字符（字符数不变），或从其他列进入（字符数加一）
+        same = best_idx[:-1, None] == cols[None, :]
+        enter = np.where(same, second[:-1, None], best[:-1, None])
+        enter_idx = np.where(same, second_idx[:-1, None], best_idx[:-1, None])
+        stay = score[1:] >= enter
+        new[1:, 1:] = np.where(stay, score[1:], enter)[:, 1:] + log_probs[t, 1:]
+        back[t, 1:, 1:] = np.where(stay, cols[None, :], enter_idx)[:, 1:]
+        score = new
+
+    col = int(score[length].argmax())
+    if not np.isfinite(score[length, col]):
+        return None
+    path = np.empty(frames, dtype=np.int64)
+    k = length
+    for t in range(frames - 1, 0, -1):
+        path[t] = col
+        prev = int(back[t, k, col])
+        if col != 0 and prev != col:
+            k -= 1
+        col = prev
+    path[0] = col
+    return path
+
+
+class CtcDecoder:
+    """CTC 解码：字符集限制、定长解码和字符置信度（子类调用 _init_charset 设置字符集）"""
+
+    def _init_charset(self, charset):
+        self.charset = charset
+        self._index = {char: i for i, char in enumerate(charset) if char}
+        self._allowed = {}
+
+    def decode(self, indices):
+        """
+        向量化 CTC 解码：去除 blank 和连续重复
+
+        Args:
+            indices: 形状为 (B, T) 的类别索引
+
+        Returns:
+            list[str]: 识别文本
+        """
+        keep = indices != 0
+        keep[:, 1:] &= indices[:, 1:] != indices[:, :-1]
+
+        charset = self.charset
+        return [''.join(charset[i] for i in row[mask]) for row, mask in zip(indices, keep)]
+
+    def allowed_indices(self, chars):
+        """
+        字符集中 chars 对应的类别索引（包含 blank），不在字符集中的字符忽略
+
+        Returns:
+            np.ndarray: 升序的类别索引，第一个为 blank
+        """
+        indices = self._allowed.get(chars)
+        if indices is None:
+            index = self._index
+            indices = np.array(sorted({0} | {index[c] for c in chars if c in index}), dtype=np.int64)
+            if len(self._allowed) >= ALLOWED_CACHE_SIZE:
+                self._allowed.clear()
+            self._allowed[chars] = indices
+        return indices
+
+    def read(self, logits, allowed=None, length=None):
+        """
+        解码单张图片的输出
+
+        Args:
+            logits: 形状为 (T, C) 的 logits
+            allowed: allowed_indices() 返回的类别索引，只在这些类别中解码
+            length: 文本长度，None 表示不限
+
+        Returns:
+            tuple: (文本, 每个字符的置信度列表)；置信度为该字符所在帧中的最大概率
+        """
+        columns = allowed if allowed is not None else np.arange(logits.shape[1])
+        scores = logits if allowed is None else logits[:, allowed]
+        path = scores.argmax(axis=1)
+        if length and _collapsed_length(path) != length:
+            # 贪心解码的长度不符时才做定长解码
+            if allowed is None:
+                candidates = np.union1d([0], np.argpartition(scores, -LENGTH_TOP_K, axis=1)[:, -LENGTH_TOP_K:])
+                fixed = _fixed_length_path(np.log(_softmax(scores)[:, candidates] + 1e-12), length)
+                fixed = None if fixed is None else candidates[fixed]
+            else:
+                fixed = _fixed_length_path(np.log(_softmax(scores) + 1e-12), length)
+            if fixed is not None:
+                path = fixed
+
+        # 只对输出字符的帧计算 softmax
+        frames = np.flatnonzero(path)
+        probs = _softmax(scores[frames])[np.arange(len(frames)), path[frames]]
+        chars, confidences = [], []
+        for t, prob in zip(frames, probs):
+            col = path[t]
+            if t == 0 or path[t - 1] != col:
+                chars.append(self.charset[columns[col]])
+                confidences.append(float(prob))
+            else:
+                # 连续重复的帧属于同一个字符
+                confidences[-1] = max(confidences[-1], float(prob))
+        return ''.join(chars), confidences
+
+
+class BatchOcrEngine(CtcDecoder):
+    """批量OCR推理引擎，与 ddddocr.DdddOcr 共用模型会话和字符集（权重只加载一份）"""
+
+    channels = 1  # 模型输入为灰度图
+
+    def __init__(self, ocr):
+        """
+        Args:
+            ocr: 已初始化的 ddddocr.DdddOcr 实例（OCR 模式）
+        """
+        engine = ocr.ocr_engine
+        self._init_charset(engine.get_charset())
+        self.height = 64
+
+        model = onnx.load(ort_runtime.ocr_model_path(engine.beta))
+        self.batched = not is_dynamically_quantized(model)
+        if self.batched:
+            self.session = self._load_session(model)
+            # ddddocr 的单张识别也使用动态 batch 的会话，释放原会话
+            engine.session = self.session
+        else:
+            self.session = engine.session
+        del model
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def _load_session(model):
+        """将模型输入的 batch 维度改为动态后创建会话"""
+        model.graph.input[0].type.tensor_type.shape.dim[0].dim_param = 'batch'
+        # 输出的声明形状与实际 (seq, batch, classes) 不符，清空以避免运行时告警
+        for output in model.graph.output:
+            output.type.tensor_type.shape.ClearField('dim')
+        return ort_runtime.create_session(model.SerializeToString())
+
+    def prepare(self, gray):
+        """
+        将灰度图转换为模型输入（缩放方式与 ddddocr 的预处理一致）
+
+        Args:
+            gray: 形状为 (H, W) 的 uint8 灰度数组
+
+        Returns:
+            np.ndarray: 形状为 (64, W') 的 float32 数组
+        """
+        height, width = gray.shape[:2]
+        target_width = max(1, int(width * (self.height / height)))
+        image = Image.fromarray(np.ascontiguousarray(gray)).resize((target_width, self.height), Image.LANCZOS)
+        return np.asarray(image, dtype=np.float32) / 255.0
+
+    def _groups(self, arrays):
+        """按推理分组：同宽的图片一组（量化模型每张一组），返回索引列表的列表"""
+        if not self.batched:
+            return [[i] for i in range(len(arrays))]
+        groups = defaultdict(list)
+        for i, arr in enumerate(arrays):
+            groups[arr.shape[1]].append(i)
+        return list(groups.values())
+
+    def run(self, arrays):
+        """
+        对一组同宽的图片执行一次推理
+
+        Args:
+            arrays: prepare() 返回的同宽数组列表
+
+        Returns:
+            np.ndarray: 形状为 (B, T, C) 的 logits
+        """
+        batch = np.stack(arrays)[:, None, :, :]
+        output = self.session.run(None, {self.input_name: batch})[0]
+        return output.transpose(1, 0, 2)  # (T, B, C) -> (B, T, C)
+
+    def infer(self, arrays):
+        """批量推理，返回与输入顺序一致的 (T, C) logits 列表"""
+        outputs = [None] * len(arrays)
+        for group in self._groups(arrays):
+            for i, logits in zip(group, self.run([arrays[i] for i in group])):
+                outputs[i] = logits
+        return outputs
+
+    def recognize(self, arrays, allowed=None):
+        """
+        批量识别，返回与输入顺序一致的文本列表
+
+        Args:
+            arrays: prepare() 返回的数组列表
+            allowed: allowed_indices() 返回的类别索引，只在这些类别中解码
+        """
+        texts = [None] * len(arrays)
+        for group in self._groups(arrays):
+            logits = self.run([arrays[i] for i in group])
+            if allowed is None:
+                indices = logits.argmax(axis=-1)
+            else:
+                indices = allowed[logits[:, :, allowed].argmax(axis=-1)]
+            for i, text in zip(group, self.decode(indices)):
+                texts[i] = text
+        return texts
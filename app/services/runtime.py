@@ -0,0 +1,446 @@
+"""ONNX Runtime 会话配置
+
+ddddocr 用默认参数创建 onnxruntime 会话：每个会话的 intra-op 线程数等于 CPU 核数，
+多个 gunicorn worker、每个 worker 多个推理线程同时推理时，线程数远超核数，
+互相抢占反而降低吞吐量。这里统一创建所有识别/检测会话（替换 ddddocr 创建的会话），
+线程数、图优化级别和执行模式由 ORT_* 配置决定：
+
+- ORT_INTRA_OP_THREADS 为 0 时按 CPU 核数 / (WORKERS * INFERENCE_POOL_SIZE) 自动计算，
+  保证所有 worker 的推理线程加起来不超过核数
+- ORT_OCR_MODEL 选择识别模型。ddddocr 默认的 common_old.onnx 是动态量化模型，
+  量化参数按整个输入张量计算，同批的其他图片会改变结果，只能逐张推理（见 ocr_engine）：
+  - float（默认）：把 common_old.onnx 的量化权重还原为浮点权重（结构和字符集不变），
+    结果不受同批图片影响，可以合并推理；单张推理比量化模型慢，模型文件约为 4 倍
+  - quantized：直接使用 common_old.onnx，逐张推理，结果与 ddddocr 完全一致
+  - beta：ddddocr 的 common.onnx（浮点模型，字符集不同，识别结果与默认模型不同）
+- ORT_QUANTIZED_MODELS 中列出的模型改用 INT8 量化版本，量化后的文件保存在
+  ORT_MODEL_CACHE_DIR 中，之后直接加载：
+  - ocr：动态量化（权重 INT8，激活按输入计算量化参数）。common_old.onnx
+    本身已是动态量化模型，不再处理；量化后的模型只能逐张推理
+  - det：静态量化（QDQ），需要用 ORT_CALIBRATION_DIR 中的样本图片统计激活范围，
+    未配置时使用原模型（检测模型以卷积为主，动态量化比原模型更慢）
+
+各参数组合的吞吐量对比见 benchmarks/ort_sweep.py。
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+import onnx
+import onnxruntime
+
+logger = logging.getLogger(__name__)
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+QUANTIZABLE_MODELS = ('ocr', 'det')
+OCR_MODELS = ('float', 'quantized', 'beta')
+CALIBRATION_IMAGES = 32  # 静态量化最多使用的样本图片数
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+
+def cpu_count():
+    """当前进程可用的 CPU 核数"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def is_dynamically_quantized(model):
+    """模型中是否包含按输入动态计算量化参数的算子"""
+    return any(node.op_type.startswith('DynamicQuantize') for node in model.graph.node)
+
+
+def _digest(path):
+    """模型文件内容的摘要（量化结果的文件名，模型更新后重新量化）"""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _CalibrationReader:
+    """静态量化的校准数据（实现 onnxruntime.quantization.CalibrationDataReader 接口）"""
+
+    def __init__(self, input_name, arrays):
+        self._inputs = iter([{input_name: array} for array in arrays])
+
+    def get_next(self):
+        return next(self._inputs, None)
+
+
+class OrtRuntime:
+    """onnxruntime 会话工厂（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.intra_op_threads = 0
+        self.inter_op_threads = 1
+        self.graph_optimization = 'all'
+        self.execution_mode = 'sequential'
+        self.allow_spinning = True
+        self.quantized_models = set()
+        self.ocr_model = 'float'
+        self.cache_dir = '/tmp/captcha-api-models'
+        self.calibration_dir = ''
+        self._concurrency = 1
+
+    def init_app(self, app):
+        """根据应用配置设置会话参数"""
+        self.configure(
+            intra_op_threads=app.config.get('ORT_INTRA_OP_THREADS', 0),
+            inter_op_threads=app.config.get('ORT_INTER_OP_THREADS', 1),
+            graph_optimization=app.config.get('ORT_GRAPH_OPTIMIZATION', 'all'),
+            execution_mode=app.config.get('ORT_EXECUTION_MODE', 'sequential'),
+            allow_spinning=app.config.get('ORT_ALLOW_SPINNING', True),
+            quantized_models=app.config.get('ORT_QUANTIZED_MODELS', ''),
+            ocr_model=app.config.get('ORT_OCR_MODEL', 'float'),
+        )
+        self.cache_dir = app.config.get('ORT_MODEL_CACHE_DIR', self.cache_dir)
+        self.calibration_dir = app.config.get('ORT_CALIBRATION_DIR', '')
+        # 同时推理的会话数：每个 worker 的推理线程数 * worker 数
+        pool_size = app.config.get('INFERENCE_POOL_SIZE', 2) if app.config.get('INFERENCE_POOL_ENABLED', True) else 1
+        self._concurrency = max(1, pool_size) * max(1, int(os.environ.get('WORKERS', 1)))
+
+    def configure(self, intra_op_threads=None, inter_op_threads=None, graph_optimization=None,
+                  execution_mode=None, allow_spinning=None, quantized_models=None, ocr_model=None):
+        """
+        修改会话参数（只影响之后创建的会话），未传入的参数保持不变
+
+        Raises:
+            ValueError: 参数无效
+        """
+        if graph_optimization is not None and graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"不支持的图优化级别: {graph_optimization}")
+        if execution_mode is not None and execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"不支持的执行模式: {execution_mode}")
+        if ocr_model is not None and ocr_model not in OCR_MODELS:
+            raise ValueError(f"不支持的识别模型: {ocr_model}，可选 {'/'.join(OCR_MODELS)}")
+        if isinstance(quantized_models, str):
+            quantized_models = {name.strip() for name in quantized_models.split(',') if name.strip()}
+        unknown = set(quantized_models or ()) - set(QUANTIZABLE_MODELS)
+        if unknown:
+            raise ValueError(f"不支持量化的模型: {', '.join(sorted(unknown))}")
+
+        if intra_op_threads is not None:
+            self.intra_op_threads = max(0, int(intra_op_threads))
+        if inter_op_threads is not None:
+            self.inter_op_threads = max(0, int(inter_op_threads))
+        if graph_optimization is not None:
+            self.graph_optimization = graph_optimization
+        if execution_mode is not None:
+            self.execution_mode = execution_mode
+        if allow_spinning is not None:
+            self.allow_spinning = bool(allow_spinning)
+        if quantized_models is not None:
+            self.quantized_models = set(quantized_models)
+        if ocr_model is not None:
+            self.ocr_model = ocr_model
+
+    @property
+    def intra_op_threads_effective(self):
+        """实际使用的 intra-op 线程数（0 表示按 CPU 核数和并发推理数自动计算）"""
+        if self.intra_op_threads:
+            return self.intra_op_threads
+        return max(1, cpu_count() // self._concurrency)
+
+    def session_options(self):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads_effective
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization]
+        options.execution_mode = EXECUTION_MODES[self.execution_mode]
+        if not self.allow_spinning:
+            # 空闲的线程不自旋等待，多个会话共享 CPU 时减少无效的 CPU 占用
+            options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+            options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+        return options
+
+    def create_session(self, model):
+        """
+        按当前配置创建 CPU 推理会话
+
+        Args:
+            model: 模型文件路径或序列化后的模型
+        """
+        return onnxruntime.InferenceSession(model, self.session_options(), providers=['CPUExecutionProvider'])
+
+    def model_path(self, kind, path, preprocess=None):
+        """
+        按配置选择模型文件：kind 在 ORT_QUANTIZED_MODELS 中时返回量化后的模型（必要时先量化）
+
+        Args:
+            kind: ocr 或 det
+            path: 原模型路径
+            preprocess: 检测模型的预处理函数（BGR 数组 -> 模型输入），用于准备校准数据
+
+        Returns:
+            str: 模型文件路径，无法量化时返回原路径
+        """
+        if kind not in self.quantized_models:
+            return path
+        target = os.path.join(
+            self.cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{_digest(path)}.int8.onnx"
+        )
+        if os.path.exists(target):
+            return target
+        try:
+            if kind == 'ocr':
+                if is_dynamically_quantized(onnx.load(path)):
+                    logger.info(f"{os.path.basename(path)} 已是量化模型，直接使用")
+                    return path
+                quantize_dynamic(path, target)
+            else:
+                arrays = self._calibration_arrays(preprocess)
+                if not arrays:
+                    logger.warning('未配置 ORT_CALIBRATION_DIR 或目录中没有图片，检测模型不量化')
+                    return path
+                quantize_static(path, target, arrays)
+        except Exception as e:
+            logger.error(f"模型量化失败，使用原模型 {path}: {e}")
+            return path
+        logger.info(f"已生成量化模型: {target}")
+        return target
+
+    def ocr_model_path(self, beta=False):
+        """
+        按 ORT_OCR_MODEL 选择识别模型文件（ddddocr 实例以 beta=True 创建时使用 common.onnx）
+
+        Returns:
+            str: 模型文件路径，无法还原为浮点模型时返回原模型
+        """
+        import ddddocr
+
+        base_dir = os.path.dirname(ddddocr.__file__)
+        if beta:
+            return self.model_path('ocr', os.path.join(base_dir, 'common.onnx'))
+        path = os.path.join(base_dir, 'common_old.onnx')
+        if self.ocr_model == 'float':
+            path = self._float_model(path)
+        return self.model_path('ocr', path)
+
+    def _float_model(self, path):
+        target = os.path.join(
+            self.cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{_digest(path)}.float.onnx"
+        )
+        if os.path.exists(target):
+            return target
+        try:
+            dequantize_dynamic(path, target)
+        except Exception as e:
+            logger.error(f"还原浮点模型失败，使用原模型 {path}: {e}")
+            return path
+        logger.info(f"已生成浮点模型: {target}")
+        return target
+
+    def _calibration_arrays(self, preprocess):
+        if not self.calibration_dir or preprocess is None:
+            return []
+        import cv2
+
+        try:
+            names = sorted(os.listdir(self.calibration_dir))
+        except OSError:
+            return []
+        arrays = []
+        for name in names:
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(self.calibration_dir, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                arrays.append(preprocess(image))
+            if len(arrays) >= CALIBRATION_IMAGES:
+                break
+        return arrays
+
+    def configure_ocr(self, ocr):
+        """
+        用当前配置重新创建 ddddocr.DdddOcr 实例的会话
+
+        Returns:
+            ddddocr.DdddOcr: 传入的实例
+        """
+        import ddddocr
+        from app.services.detection import preprocess_input
+
+        base_dir = os.path.dirname(ddddocr.__file__)
+        if ocr.ocr_engine is not None:
+            engine = ocr.ocr_engine
+            engine.session = self.create_session(self.ocr_model_path(engine.beta))
+        if ocr.detection_engine is not None:
+            engine = ocr.detection_engine
+            path = self.model_path(
+                'det', os.path.join(base_dir, 'common_det.onnx'), lambda image: preprocess_input(engine, image)
+            )
+            engine.session = self.create_session(path)
+        return ocr
+
+    def get_stats(self):
+        """获取会话配置"""
+        return {
+            'intra_op_threads': self.intra_op_threads_effective,
+            'inter_op_threads': self.inter_op_threads,
+            'graph_optimization': self.graph_optimization,
+            'execution_mode': self.execution_mode,
+            'allow_spinning': self.allow_spinning,
+            'quantized_models': sorted(self.quantized_models),
+            'ocr_model': self.ocr_model,
+            'cpu_count': cpu_count()
+        }
+
+
+def _write_atomically(target, write):
+    """先写入临时文件再重命名，多个进程同时量化时不会读到写了一半的文件"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f"{target}.{os.getpid()}.tmp"
+    try:
+        write(temporary)
+        os.replace(temporary, target)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def quantize_dynamic(path, target):
+    """动态量化（权重 INT8）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic as quantize
+
+    _write_atomically(target, lambda output: quantize(path, output, weight_type=QuantType.QUInt8))
+
+
+def quantize_static(path, target, arrays):
+    """
+    静态量化（QDQ 格式，激活 UINT8、权重 INT8）
+
+    Args:
+        arrays: 校准用的模型输入列表，每个形状与模型输入一致
+    """
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static as quantize
+
+    input_name = onnx.load(path, load_external_data=False).graph.input[0].name
+    _write_atomically(target, lambda output: quantize(
+        path, output, _CalibrationReader(input_name, arrays),
+        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8
+    ))
+
+
+def _dequantize(model):
+    """
+    把动态量化模型中的 ConvInteger / MatMulInteger / DynamicQuantizeLSTM 及其前后的量化、
+    反量化节点替换为使用浮点权重的 Conv / MatMul / LSTM（权重按 (q - zero_point) * scale 还原）
+
+    Raises:
+        ValueError: 模型结构与 onnxruntime 动态量化的输出不符
+    """
+    from onnx import helper, numpy_helper
+
+    graph = model.graph
+    initializers = {tensor.name: tensor for tensor in graph.initializer}
+    producers = {output: node for node in graph.node for output in node.output}
+    consumers = {}
+    for node in graph.node:
+        for name in node.input:
+            consumers.setdefault(name, []).append(node)
+
+    def const(name):
+        if name not in initializers:
+            raise ValueError(f"量化参数不是常量: {name}")
+        return numpy_helper.to_array(initializers[name])
+
+    def weight(quantized, zero_point, scale):
+        return (const(quantized).astype(np.float32) - const(zero_point).astype(np.float32)) * const(scale)
+
+    def follow(name, op_type):
+        nodes = consumers.get(name, [])
+        if len(nodes) != 1 or nodes[0].op_type != op_type:
+            raise ValueError(f"无法识别的量化结构: {name}")
+        return nodes[0]
+
+    def float_output(node):
+        """整数输出 ->（加量化后的偏置）-> Cast -> 乘以量化系数：返回 (乘法节点, 原浮点偏置)"""
+        bias = None
+        nodes = consumers.get(node.output[0], [])
+        if len(nodes) == 1 and nodes[0].op_type == 'Add':
+            # 偏置按输入的量化系数动态量化：Div(偏置, 系数) -> Floor -> Cast -> Reshape
+            rounded = producers[producers[producers[nodes[0].input[1]].input[0]].input[0]]
+            bias = const(producers[rounded.input[0]].input[0])
+            cast = follow(nodes[0].output[0], 'Cast')
+        else:
+            cast = follow(node.output[0], 'Cast')
+        return follow(cast.output[0], 'Mul'), bias
+
+    replaced = {}  # 原节点位置 -> (新节点, 被取代的乘法节点)
+    tensors = []
+    for index, node in enumerate(graph.node):
+        if node.op_type in ('ConvInteger', 'MatMulInteger'):
+            source = producers[node.input[0]]
+            if source.op_type != 'DynamicQuantizeLinear':
+                raise ValueError(f"无法识别的量化结构: {node.name}")
+            mul, bias = float_output(node)
+            output = mul.output[0]
+            w = numpy_helper.from_array(
+                weight(node.input[1], node.input[3], node.input[1].replace('_quantized', '_scale')), f"{output}_float_w"
+            )
+            inputs = [source.input[0], w.name]
+            tensors.append(w)
+            if bias is not None:
+                b = numpy_helper.from_array(bias, f"{output}_float_b")
+                inputs.append(b.name)
+                tensors.append(b)
+            new = helper.make_node('Conv' if node.op_type == 'ConvInteger' else 'MatMul', inputs, [output], name=output)
+            new.attribute.extend(node.attribute)
+            replaced[index] = (new, mul)
+        elif node.op_type == 'DynamicQuantizeLSTM':
+            x, w_q, r_q, b, lengths, h0, c0, p, w_s, w_zp, r_s, r_zp = (list(node.input) + [''] * 12)[:12]
+            names = []
+            # 量化权重为 (方向, 输入, 4 * 隐藏单元)，按方向量化；LSTM 的权重为 (方向, 4 * 隐藏单元, 输入)
+            for quantized, scale, zero_point, suffix in ((w_q, w_s, w_zp, 'W'), (r_q, r_s, r_zp, 'R')):
+                value = (const(quantized).astype(np.float32) - const(zero_point).astype(np.float32)[:, None, None]) \
+                    * const(scale)[:, None, None]
+                tensor = numpy_helper.from_array(
+                    np.ascontiguousarray(value.transpose(0, 2, 1)), f"{node.output[0]}_float_{suffix}"
+                )
+                tensors.append(tensor)
+                names.append(tensor.name)
+            new = helper.make_node('LSTM', [x, *names, b, lengths, h0, c0, p], list(node.output), name=node.output[0])
+            new.attribute.extend(node.attribute)
+            replaced[index] = (new, None)
+    if not replaced:
+        raise ValueError('模型中没有动态量化的算子')
+
+    superseded = {id(mul) for _, mul in replaced.values() if mul is not None}
+    nodes = [replaced[i][0] if i in replaced else node for i, node in enumerate(graph.node) if id(node) not in superseded]
+    graph.initializer.extend(tensors)
+    # 删除不再使用的量化节点和常量
+    needed = {output.name for output in graph.output}
+    kept = []
+    for node in reversed(nodes):
+        if needed.intersection(node.output):
+            kept.append(node)
+            needed.update(name for name in node.input if name)
+    del graph.node[:]
+    graph.node.extend(reversed(kept))
+    used = [tensor for tensor in graph.initializer if tensor.name in needed]
+    del graph.initializer[:]
+    graph.initializer.extend(used)
+    return model
+
+
+def dequantize_dynamic(path, target):
+    """把动态量化模型还原为浮点模型（结果不再受同批其他输入影响）"""
+    model = _dequantize(onnx.load(path))
+    onnx.checker.check_model(model)
+    _write_atomically(target, lambda output: onnx.save(model, output))
+
+
+ort_runtime = OrtRuntime()
@@ -0,0 +1,197 @@
+"""滑块匹配
+
+基于 OpenCV 的滑块匹配和滑块对比，直接使用已解码的像素数组，不经过 ddddocr 的
+PIL 加载和格式转换。结果格式与 ddddocr 的 slide_match / slide_comparison 一致
+（target 为缺口中心坐标）。
+
+slide_match 在灰度图（simple_target）或 Canny 边缘图上做 TM_CCOEFF_NORMED 模板匹配：
+- 滑块图带透明通道时，按不透明区域裁剪模板，透明部分作为掩码排除在相关计算之外；
+  滑块图与背景同高时（整列的滑块条），只在滑块所在的水平带内搜索
+- 由粗到细的金字塔匹配：在最粗一层的整个搜索带内找出若干候选位置，
+  逐层放大后只在候选位置附近的小窗口内重新匹配
+- 灰度匹配的得分低于 FULL_SEARCH_SCORE 时（候选位置可能漏掉了缺口），再在原分辨率下完整搜索一次
+- confidence 为原分辨率下最佳位置的匹配得分（0~1）
+"""
+import cv2
+import numpy as np
+
+MIN_TEMPLATE_SIDE = 16  # 金字塔最粗一层模板的最小边长
+MAX_PYRAMID_LEVELS = 2  # 最多缩小的次数（每次缩小一半）
+CANDIDATES = 3  # 最粗一层保留的候选位置数
+REFINE_RADIUS = 3  # 逐层细化时候选位置周围的搜索半径（像素）
+BAND_MARGIN = 4  # 水平搜索带上下额外保留的像素
+ALPHA_THRESHOLD = 16  # 透明度高于该值的像素视为滑块的一部分
+CANNY_THRESHOLDS = (50, 150)  # 与 ddddocr 的边缘匹配一致
+FULL_SEARCH_SCORE = 0.8  # 灰度匹配得分低于该值时回退到原分辨率完整搜索（边缘匹配的得分普遍较低，不回退）
+DIFF_THRESHOLD = 30  # 与 ddddocr 的滑块对比一致
+
+
+def _trim(gray, alpha):
+    """
+    按透明通道裁剪滑块模板
+
+    Returns:
+        tuple: (模板, 掩码, 不透明区域在原图中的行范围 (y0, y1))；
+               没有透明通道时掩码和行范围为 None，模板完全不透明时掩码为 None
+    """
+    if alpha is None or alpha.shape != gray.shape:
+        return gray, None, None
+    mask = alpha > ALPHA_THRESHOLD
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        return gray, None, None
+    y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    template = gray[y0:y1, x0:x1].copy()
+    inside = mask[y0:y1, x0:x1]
+    if inside.all():
+        return template, None, (int(y0), int(y1))
+    # 透明部分填充为均值，避免边缘图在透明区域的边界上产生多余的边缘
+    template[~inside] = int(template[inside].mean())
+    return template, inside.astype(np.uint8), (int(y0), int(y1))
+
+
+def _features(gray, simple_target):
+    """匹配使用的特征图：灰度图或 Canny 边缘图"""
+    return gray if simple_target else cv2.Canny(gray, *CANNY_THRESHOLDS)
+
+
+def _levels(template):
+    """金字塔缩小次数，保证最粗一层的模板边长不小于 MIN_TEMPLATE_SIDE"""
+    levels = 0
+    side = min(template.shape)
+    while levels < MAX_PYRAMID_LEVELS and side >> (levels + 1) >= MIN_TEMPLATE_SIDE:
+        levels += 1
+    return levels
+
+
+def _match(image, template, mask=None):
+    result = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+    # 纯色区域的相关系数无定义
+    return np.nan_to_num(result, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+
+
+def _peaks(result, count, size):
+    """得分最高的 count 个位置，相邻位置（小于半个模板）只保留一个"""
+    result = result.copy()
+    half_h, half_w = size[0] // 2, size[1] // 2
+    peaks = []
+    for _ in range(count):
+        _, score, _, (x, y) = cv2.minMaxLoc(result)
+        if score <= -1:
+            break
+        peaks.append((x, y))
+        result[max(0, y - half_h):y + half_h + 1, max(0, x - half_w):x + half_w + 1] = -1
+    return peaks
+
+
+def _refine(image, template, mask, x, y):
+    """在 (x, y) 附近的小窗口内重新匹配，返回 (得分, x, y)"""
+    height, width = image.shape[:2]
+    th, tw = template.shape[:2]
+    x0, x1 = max(0, min(x, width - tw) - REFINE_RADIUS), min(width - tw, x + REFINE_RADIUS)
+    y0, y1 = max(0, min(y, height - th) - REFINE_RADIUS), min(height - th, y + REFINE_RADIUS)
+    result = _match(image[y0:y1 + th, x0:x1 + tw], template, mask)
+    _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+    return score, x0 + dx, y0 + dy
+
+
+def _locate(image, template, mask=None):
+    """由粗到细的金字塔模板匹配，返回 (得分, x, y)"""
+    levels = _levels(template)
+    images, templates, masks = [image], [template], [mask]
+    for _ in range(levels):
+        images.append(cv2.pyrDown(images[-1]))
+        templates.append(cv2.pyrDown(templates[-1]))
+        if mask is not None:
+            height, width = templates[-1].shape[:2]
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        masks.append(mask)
+
+    coarse = _match(images[-1], templates[-1], masks[-1])
+    candidates = [(None, x, y) for x, y in _peaks(coarse, CANDIDATES, templates[-1].shape)] or [(None, 0, 0)]
+    for level in range(levels - 1, -1, -1):
+        candidates = [
+            _refine(images[level], templates[level], masks[level], x * 2, y * 2) for _, x, y in candidates
+        ]
+    if levels == 0:
+        candidates = [(float(coarse[y, x]), x, y) for _, x, y in candidates]
+    return max(candidates)
+
+
+def slide_match(sliding, back, alpha=None, simple_target=True):
+    """
+    滑块匹配
+
+    Args:
+        sliding: 滑块图的灰度数组
+        back: 背景图的灰度数组
+        alpha: 滑块图的透明通道（没有时为 None）
+        simple_target: True 时匹配灰度图，False 时匹配 Canny 边缘图
+
+    Returns:
+        dict: {'target': [x, y], 'target_x', 'target_y', 'confidence'}，坐标为缺口中心
+    """
+    template, mask, rows = _trim(sliding, alpha)
+
+    # 与背景同高的滑块条：滑块只可能出现在不透明区域所在的水平带内
+    top = 0
+    if rows is not None and sliding.shape[0] == back.shape[0]:
+        top = max(0, rows[0] - BAND_MARGIN)
+        back = back[top:min(back.shape[0], rows[1] + BAND_MARGIN)]
+
+    th, tw = template.shape[:2]
+    if th > back.shape[0] or tw > back.shape[1]:
+        raise ValueError('滑块图片大于背景图片')
+
+    image, template = _features(back, simple_target), _features(template, simple_target)
+    score, x, y = _locate(image, template, mask)
+    if simple_target and score < FULL_SEARCH_SCORE and _levels(template):
+        result = _match(image, template, mask)
+        _, full_score, _, (full_x, full_y) = cv2.minMaxLoc(result)
+        if full_score > score:
+            score, x, y = full_score, full_x, full_y
+    center_x, center_y = int(x + tw // 2), int(top + y + th // 2)
+    return {
+        'target': [center_x, center_y],
+        'target_x': center_x,
+        'target_y': center_y,
+        'confidence': round(float(np.clip(score, 0.0, 1.0)), 4)
+    }
+
+
+def slide_comparison(target, background):
+    """
+    滑块对比：比较带缺口的图片和完整背景图，找出差异最大的区域
+
+    Args:
+        target: 带缺口图片的 BGR 数组
+        background: 完整背景图的 BGR 数组（尺寸与 target 相同）
+
+    Returns:
+        dict: {'target': [x, y], 'target_x', 'target_y', 'confidence'}，
+              confidence 为最大差异区域占全部差异像素的比例
+    """
+    if target.shape != background.shape:
+        raise ValueError('两张图片的尺寸必须相同')
+    diff = cv2.cvtColor(cv2.absdiff(target, background), cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+    kernel = np.ones((3, 3), np.uint8)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return {'target': [0, 0], 'target_x': 0, 'target_y': 0, 'confidence': 0.0}
+
+    largest = max(contours, key=cv2.contourArea)
+    x, y, w, h = cv2.boundingRect(largest)
+    center_x, center_y = x + w // 2, y + h // 2
+    changed = cv2.countNonZero(binary)
+    inside = cv2.countNonZero(binary[y:y + h, x:x + w])
+    return {
+        'target': [center_x, center_y],
+        'target_x': center_x,
+        'target_y': center_y,
+        'confidence': round(inside / changed, 4) if changed else 0.0
+    }
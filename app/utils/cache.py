@@ -0,0 +1,198 @@
+"""识别结果缓存
+
+以解码后的图片字节哈希 + 调用参数作为键，缓存 CaptchaService 的识别结果。
+默认使用进程内 LRU/TTL 缓存；配置 RESULT_CACHE_URL 后使用 Redis，
+使所有 gunicorn worker 共享同一份缓存。
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.stats import CACHE_EVICTIONS, CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """进程内 LRU 缓存，按序列化后的字节数控制内存占用"""
+
+    name = 'memory'
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at and expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        entry_size = len(key) + len(value)
+        if entry_size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires_at)
+            self._size += entry_size
+            # 超出内存预算时淘汰最久未使用的条目
+            while self._size > self.max_bytes and self._data:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                CACHE_EVICTIONS.inc()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        value, _ = self._data.pop(key)
+        self._size -= len(key) + len(value)
+
+    def info(self):
+        return {
+            'entries': len(self._data),
+            'size_bytes': self._size,
+            'max_bytes': self.max_bytes
+        }
+
+
+class RedisBackend:
+    """Redis 共享缓存，TTL 由 Redis 负责，内存上限由 Redis 的 maxmemory 策略控制"""
+
+    name = 'redis'
+
+    def __init__(self, url, ttl, prefix='captcha:result:'):
+        import redis  # 可选依赖，仅在配置共享后端时需要
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl if self.ttl > 0 else None)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    def info(self):
+        return {'prefix': self.prefix}
+
+
+class ResultCache:
+    """识别结果缓存（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+
+    def init_app(self, app):
+        """根据应用配置初始化缓存后端"""
+        self.enabled = app.config.get('RESULT_CACHE_ENABLED', True)
+        if not self.enabled:
+            self.backend = None
+            return
+
+        ttl = app.config.get('RESULT_CACHE_TTL', 600)
+        url = app.config.get('RESULT_CACHE_URL', '')
+        self.backend = None
+        if url:
+            try:
+                self.backend = RedisBackend(url, ttl)
+            except Exception as e:
+                app.logger.warning(f"共享缓存后端初始化失败，回退到进程内缓存: {e}")
+        if self.backend is None:
+            self.backend = MemoryBackend(app.config.get('RESULT_CACHE_MAX_BYTES', 32 * 1024 * 1024), ttl)
+
+    @staticmethod
+    def make_key(method, *images, **params):
+        """
+        生成缓存键
+
+        Args:
+            method: 识别方法名
+            *images: 解码后的图片字节
+            **params: 影响结果的调用参数
+
+        Returns:
+            str: 缓存键
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(method.encode())
+        for image_bytes in images:
+            digest.update(len(image_bytes).to_bytes(8, 'little'))
+            digest.update(image_bytes)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return f"{method}:{digest.hexdigest()}"
+
+    def get(self, key):
+        """读取缓存，未命中返回 None"""
+        if not self.enabled or self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            CACHE_REQUESTS.labels('error').inc()
+            logger.warning(f"读取缓存失败: {e}")
+            return None
+        if value is None:
+            CACHE_REQUESTS.labels('miss').inc()
+            return None
+        CACHE_REQUESTS.labels('hit').inc()
+        return json.loads(value)
+
+    def set(self, key, result):
+        """写入缓存，识别失败（None）的结果不缓存"""
+        if not self.enabled or self.backend is None or result is None:
+            return
+        try:
+            self.backend.set(key, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            CACHE_REQUESTS.labels('error').inc()
+            logger.warning(f"写入缓存失败: {e}")
+
+    def get_or_compute(self, key, compute):
+        """命中则直接返回缓存结果，否则调用 compute 并写入缓存"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        result = compute()
+        self.set(key, result)
+        return result
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def get_stats(self):
+        """获取缓存配置和容量（命中统计见 stats.get_cache_stats）"""
+        stats = {
+            'enabled': self.enabled,
+            'backend': self.backend.name if self.backend else None
+        }
+        if self.backend is not None:
+            stats.update(self.backend.info())
+        return stats
+
+
+result_cache = ResultCache()
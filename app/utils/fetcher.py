@@ -0,0 +1,428 @@
+"""图片 URL 下载
+
+- 每个 host 复用一个 keep-alive 的 requests.Session，避免每次请求都重新 DNS/TCP/TLS
+- 同一请求中的多个 URL 并发下载（gevent worker 中为协程，ASGI 模式下使用 httpx 异步下载）
+- 按 Cache-Control / ETag 缓存下载结果，过期后用条件请求重新验证
+- 按 host 统计延迟和错误（host 由客户端提交的 URL 决定，超过 max_hosts 个后
+  新的 host 合并统计到 "other"，Session 按 LRU 淘汰，内存占用有上限；
+  被淘汰的 Session 在没有请求使用后才关闭）
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.utils.stats import FETCH_LATENCY, FETCH_REQUESTS
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+READ_CHUNK_SIZE = 64 * 1024
+# 超出 max_hosts 后的 host 统计名
+OTHER_HOST = 'other'
+
+
+class _BodyBuffer:
+    """按 Content-Length 预分配、长度未知时按倍数扩容的响应体缓冲区"""
+
+    def __init__(self, content_length, max_size, chunk_size=READ_CHUNK_SIZE):
+        expected = int(content_length) if content_length and content_length.isdigit() else 0
+        if expected > max_size:
+            raise ValueError(f"图片大小超过限制: {expected} > {max_size}")
+        self.max_size = max_size
+        self.buffer = bytearray(expected or chunk_size)
+        self.view = memoryview(self.buffer)
+        self.size = 0
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        if end > self.max_size:
+            raise ValueError(f"图片大小超过限制: {end} > {self.max_size}")
+        if end > len(self.buffer):
+            # 长度未知或与 Content-Length 不符（如 gzip 编码）时扩容
+            self.view.release()
+            self.buffer.extend(bytearray(max(end, len(self.buffer) * 2) - len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        self.view[self.size:end] = chunk
+        self.size = end
+
+    def getvalue(self):
+        """
+        已读取的内容：缓冲区恰好填满时返回整个缓冲区的视图（不复制），
+        否则复制为 bytes，避免缓存中的视图占住多余的缓冲区（缓存按内容长度计算大小）
+        """
+        if self.size == len(self.buffer):
+            return self.view
+        content = bytes(self.view[:self.size])
+        self.view.release()
+        return content
+
+
+def read_body(response, max_size, chunk_size=READ_CHUNK_SIZE):
+    """
+    流式读取响应体
+
+    按 Content-Length 预分配缓冲区（超过 max_size 时不读取响应体直接拒绝），
+    长度未知时按倍数扩容，总拷贝量与图片大小成线性关系。
+
+    Returns:
+        memoryview | bytes: 响应体，见 _BodyBuffer.getvalue
+
+    Raises:
+        ValueError: 文件过大
+    """
+    body = _BodyBuffer(response.headers.get('Content-Length', ''), max_size, chunk_size)
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        body.write(chunk)
+    return body.getvalue()
+
+
+async def read_body_async(response, max_size, chunk_size=READ_CHUNK_SIZE):
+    """read_body 的异步版本，用于 httpx 的流式响应"""
+    body = _BodyBuffer(response.headers.get('Content-Length', ''), max_size, chunk_size)
+    async for chunk in response.aiter_bytes(chunk_size):
+        body.write(chunk)
+    return body.getvalue()
+
+
+class _CacheEntry:
+    __slots__ = ('content', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, content, etag, last_modified, expires_at):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+
+class _ByteCache:
+    """按字节数限制大小的 LRU 缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if len(entry.content) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old.content)
+            self._data[key] = entry
+            self._size += len(entry.content)
+            while self._size > self.max_bytes and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted.content)
+
+    def info(self):
+        return {'entries': len(self._data), 'size_bytes': self._size, 'max_bytes': self.max_bytes}
+
+
+class _HostSession:
+    """一个 host 的 Session 及正在使用它的请求数"""
+
+    __slots__ = ('session', 'users', 'evicted')
+
+    def __init__(self, session):
+        self.session = session
+        self.users = 0
+        self.evicted = False
+
+
+class ImageFetcher:
+    """图片下载器（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.pool_maxsize = 10
+        self.concurrency = 8
+        self.cache_ttl = 300
+        self.cache = _ByteCache(16 * 1024 * 1024)
+        self.max_hosts = 64
+        self._sessions = OrderedDict()
+        self._executor = None
+        self._executor_pid = None
+        self._async_client = None
+        self._async_client_loop = None
+        self._lock = threading.Lock()
+        self._hosts = set()  # 单独统计的 host
+
+    def init_app(self, app):
+        """根据应用配置初始化下载参数"""
+        self.pool_maxsize = app.config.get('FETCH_POOL_MAXSIZE', 10)
+        self.concurrency = max(1, app.config.get('FETCH_CONCURRENCY', 8))
+        self.cache_ttl = app.config.get('FETCH_CACHE_TTL', 300)
+        self.cache = _ByteCache(app.config.get('FETCH_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+        self.max_hosts = max(1, app.config.get('FETCH_MAX_HOSTS', 64))
+
+    @contextmanager
+    def _session(self, host):
+        """使用 host 的 Session（被淘汰的 Session 在最后一个使用者结束后关闭）"""
+        entry = self._acquire_session(host)
+        try:
+            yield entry.session
+        finally:
+            with self._lock:
+                entry.users -= 1
+                idle = entry.evicted and entry.users == 0
+            if idle:
+                entry.session.close()
+
+    def _acquire_session(self, host):
+        idle = []
+        with self._lock:
+            entry = self._sessions.get(host)
+            if entry is not None:
+                self._sessions.move_to_end(host)
+            else:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = 'Mozilla/5.0'
+                entry = self._sessions[host] = _HostSession(session)
+                while len(self._sessions) > self.max_hosts:
+                    # 淘汰最久未使用的 host，正在使用的 Session 由最后一个使用者关闭
+                    _, evicted = self._sessions.popitem(last=False)
+                    evicted.evicted = True
+                    if evicted.users == 0:
+                        idle.append(evicted.session)
+            entry.users += 1
+        for session in idle:
+            session.close()
+        return entry
+
+    def _get_executor(self):
+        # 线程池不能跨 fork 使用，每个 worker 进程各自创建
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fetch')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _expires_at(self, response):
+        """根据 Cache-Control 计算过期时间，返回 None 表示不缓存"""
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return None
+        if 'no-cache' in cache_control:
+            # 可以缓存，但每次使用前都需要重新验证
+            return 0
+        match = _MAX_AGE_RE.search(cache_control)
+        ttl = int(match.group(1)) if match else self.cache_ttl
+        return time.monotonic() + ttl
+
+    def _host_label(self, host):
+        """统计使用的 host 名：前 max_hosts 个 host 单独统计，之后的合并为 other"""
+        if host in self._hosts:
+            return host
+        with self._lock:
+            if len(self._hosts) < self.max_hosts:
+                self._hosts.add(host)
+                return host
+        return OTHER_HOST
+
+    def _record(self, host, elapsed, error=False, cache_hit=False, not_modified=False):
+        label = self._host_label(host)
+        if cache_hit:
+            FETCH_REQUESTS.labels(label, 'cache_hit').inc()
+            return
+        FETCH_REQUESTS.labels(label, 'error' if error else 'not_modified' if not_modified else 'ok').inc()
+        FETCH_LATENCY.labels(label).observe(elapsed)
+
+    def _lookup(self, url, host):
+        """
+        查找缓存
+
+        Returns:
+            tuple: (缓存项, 是否仍然有效)；过期的缓存项用于发起条件请求
+        """
+        entry = self.cache.get(url)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._record(host, 0, cache_hit=True)
+            return entry, True
+        return entry, False
+
+    @staticmethod
+    def _conditional_headers(entry):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def _revalidated(self, entry, response):
+        """304 响应：刷新缓存项的有效期"""
+        expires_at = self._expires_at(response)
+        entry.expires_at = expires_at if expires_at is not None else 0
+
+    def _store(self, url, response, content):
+        expires_at = self._expires_at(response)
+        if expires_at is not None:
+            self.cache.set(url, _CacheEntry(
+                content,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                expires_at
+            ))
+
+    def fetch(self, url, max_size, timeout):
+        """
+        下载图片
+
+        Args:
+            url: 图片地址
+            max_size: 最大文件大小（字节）
+            timeout: 请求超时时间（秒）
+
+        Returns:
+            memoryview | bytes: 图片字节流
+
+        Raises:
+            ValueError: 文件过大
+            requests.RequestException: 下载失败
+        """
+        host = urlsplit(url).netloc
+        entry, fresh = self._lookup(url, host)
+        if fresh:
+            return entry.content
+
+        started = time.perf_counter()
+        try:
+            with self._session(host) as session:
+                response = session.get(
+                    url,
+                    timeout=timeout,
+                    headers=self._conditional_headers(entry),
+                    verify=True,  # 启用 SSL 验证
+                    allow_redirects=True,
+                    stream=True  # 流式下载，避免大文件问题
+                )
+                with response:
+                    if response.status_code == 304 and entry is not None:
+                        self._revalidated(entry, response)
+                        self._record(host, time.perf_counter() - started, not_modified=True)
+                        return entry.content
+
+                    response.raise_for_status()
+                    content = read_body(response, max_size)
+        except Exception:
+            self._record(host, time.perf_counter() - started, error=True)
+            raise
+
+        self._record(host, time.perf_counter() - started)
+        self._store(url, response, content)
+        return content
+
+    def _get_async_client(self):
+        # httpx 的客户端绑定创建它的事件循环
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            import httpx  # 可选依赖，仅 ASGI 模式需要
+
+            self._async_client = httpx.AsyncClient(
+                headers={'User-Agent': 'Mozilla/5.0'},
+                limits=httpx.Limits(max_keepalive_connections=self.pool_maxsize),
+                follow_redirects=True
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def fetch_async(self, url, max_size, timeout):
+        """
+        异步下载图片（ASGI 模式），与 fetch 共用缓存和统计
+
+        Raises:
+            ValueError: 文件过大
+            httpx.HTTPError: 下载失败
+        """
+        host = urlsplit(url).netloc
+        entry, fresh = self._lookup(url, host)
+        if fresh:
+            return entry.content
+
+        started = time.perf_counter()
+        try:
+            request = self._get_async_client().stream(
+                'GET', url, headers=self._conditional_headers(entry), timeout=timeout
+            )
+            async with request as response:
+                if response.status_code == 304 and entry is not None:
+                    self._revalidated(entry, response)
+                    self._record(host, time.perf_counter() - started, not_modified=True)
+                    return entry.content
+
+                response.raise_for_status()
+                content = await read_body_async(response, max_size)
+        except Exception:
+            self._record(host, time.perf_counter() - started, error=True)
+            raise
+
+        self._record(host, time.perf_counter() - started)
+        self._store(url, response, content)
+        return content
+
+    async def fetch_many_async(self, urls, max_size, timeout):
+        """
+        异步并发下载多个图片，并发数与 fetch_many 相同
+
+        Returns:
+            list: 与 urls 顺序一致，下载失败的位置为对应的异常对象
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(url):
+            async with semaphore:
+                try:
+                    return await self.fetch_async(url, max_size, timeout)
+                except Exception as e:
+                    return e
+
+        return await asyncio.gather(*(fetch_one(url) for url in urls))
+
+    async def aclose(self):
+        """关闭异步客户端"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def fetch_many(self, urls, max_size, timeout):
+        """
+        并发下载多个图片
+
+        Returns:
+            list: 与 urls 顺序一致，下载失败的位置为对应的异常对象
+        """
+        def fetch_one(url):
+            try:
+                return self.fetch(url, max_size, timeout)
+            except Exception as e:
+                return e
+
+        if len(urls) <= 1:
+            return [fetch_one(url) for url in urls]
+        return list(self._get_executor().map(fetch_one, urls))
+
+    def get_stats(self):
+        """获取下载缓存状态（按 host 的下载统计见 stats.get_fetch_stats）"""
+        return {'cache': self.cache.info(), 'max_hosts': self.max_hosts}
+
+image_fetcher = ImageFetcher()
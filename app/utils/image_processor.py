@@ -3,8 +3,23 @@ from io import BytesIO
 import cv2
 import numpy as np
 import requests
+from flask import has_request_context, request
 from PIL import Image, ImageEnhance
 
+from app.utils.fetcher import image_fetcher
+from app.utils.stats import stage_timer
+
+# ASGI 模式下请求中的 URL 图片已在事件循环中异步下载，结果（或 ValueError）按 URL 存放在 WSGI environ 中
+PREFETCHED_ENVIRON_KEY = 'captcha_api.prefetched_images'
+
+def _is_url(image_data):
+    return isinstance(image_data, str) and image_data.startswith(('http://', 'https://'))
+
+def _get_prefetched():
+    if has_request_context():
+        return request.environ.get(PREFETCHED_ENVIRON_KEY) or {}
+    return {}
+
 def get_image_bytes(image_data, max_size=5*1024*1024, timeout=10):
     """
     将不同格式的图像数据转换为字节流
@@ -15,38 +30,28 @@ def get_image_bytes(image_data, max_size=5*1024*1024, timeout=10):
         timeout: 请求超时时间（秒）
     
     Returns:
-        bytes: 图片字节流
+        bytes: 图片字节流（URL 下载的图片为 memoryview，不额外复制）
     
     Raises:
         ValueError: 不支持的数据类型或文件过大
     """
-    if isinstance(image_data, bytes):
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
         if len(image_data) > max_size:
             raise ValueError(f"图片大小超过限制: {len(image_data)} > {max_size}")
         return image_data
     
     elif isinstance(image_data, str):
         # 判断是否为URL
-        if image_data.startswith(('http://', 'https://')):
-            try:
-                response = requests.get(
-                    image_data, 
-                    timeout=timeout,
-                    headers={'User-Agent': 'Mozilla/5.0'},
-                    verify=True,  # 启用 SSL 验证
-                    allow_redirects=True,
-                    stream=True  # 流式下载，避免大文件问题
-                )
-                response.raise_for_status()
-                
-                # 读取内容
-                content = b''
-                for chunk in response.iter_content(chunk_size=8192):
-                    content += chunk
-                    if len(content) > max_size:
-                        raise ValueError(f"图片大小超过限制: {len(content)} > {max_size}")
-                
+        if _is_url(image_data):
+            prefetched = _get_prefetched()
+            if image_data in prefetched:
+                content = prefetched[image_data]
+                if isinstance(content, Exception):
+                    raise content
                 return content
+            try:
+                with stage_timer('fetch'):
+                    return image_fetcher.fetch(image_data, max_size, timeout)
             except requests.RequestException as e:
                 raise ValueError(f"图片下载失败: {str(e)}")
         
@@ -68,56 +73,183 @@ def get_image_bytes(image_data, max_size=5*1024*1024, timeout=10):
     else:
         raise ValueError(f"不支持的图片数据类型: {type(image_data)}")
 
-def preprocess_image(image_bytes, enhance=False, denoise=False, binarize=False):
+def get_images_bytes(images, max_size=5*1024*1024, timeout=10, return_exceptions=False):
     """
-    图片预处理函数
+    批量获取图片字节流，其中的 URL 并发下载
     
     Args:
-        image_bytes: 图片字节流
+        images: 图片数据列表（bytes/URL/base64）
+        max_size: 最大文件大小（字节）
+        timeout: 请求超时时间（秒）
+        return_exceptions: 为 True 时失败项以 ValueError 对象返回，否则直接抛出
+    
+    Returns:
+        list: 与 images 顺序一致的图片字节流
+    """
+    urls = list(dict.fromkeys(image for image in images if _is_url(image)))
+    prefetched = _get_prefetched()
+    downloaded = {url: prefetched[url] for url in urls if url in prefetched}
+    missing = [url for url in urls if url not in downloaded]
+    if missing:
+        with stage_timer('fetch'):
+            downloaded.update(zip(missing, image_fetcher.fetch_many(missing, max_size, timeout)))
+    
+    results = []
+    for image in images:
+        try:
+            if _is_url(image):
+                content = downloaded[image]
+                if isinstance(content, requests.RequestException):
+                    raise ValueError(f"图片下载失败: {str(content)}")
+                if isinstance(content, Exception):
+                    raise content
+                results.append(content)
+            else:
+                results.append(get_image_bytes(image, max_size, timeout))
+        except ValueError as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+def decode_image(image_bytes):
+    """
+    将图片字节流解码为 BGR 像素数组
+    
+    Args:
+        image_bytes: 图片字节流（bytes/memoryview）
+    
+    Returns:
+        np.ndarray: 形状为 (H, W, 3) 的 uint8 数组
+    
+    Raises:
+        ValueError: 无法解码
+    """
+    with stage_timer('decode'):
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            # OpenCV 不支持的格式回退到 PIL
+            try:
+                image = Image.open(BytesIO(image_bytes)).convert('RGB')
+            except Exception as e:
+                raise ValueError(f"图片解码失败: {e}")
+            image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+    return image
+
+def _may_have_alpha(data):
+    """根据文件头判断图片是否可能带透明通道（JPEG 和不含 tRNS 的 RGB/灰度 PNG 一定不带）"""
+    header = bytes(data[:26])
+    if header[:2] == b'\xff\xd8':
+        return False
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and len(header) == 26 and header[25] in (0, 2):
+        raw = data if isinstance(data, bytes) else bytes(data)
+        return b'tRNS' in raw[:raw.find(b'IDAT')]
+    return True
+
+class DecodedImage:
+    """
+    只解码一次的图片
+    
+    保存原始字节（用于计算缓存键）和解码后的像素数组，预处理、检测和识别都直接
+    使用数组，各步骤之间不再进行 PNG 编码/解码。
+    """
+    
+    __slots__ = ('data', '_bgr', '_gray', '_alpha')
+    
+    def __init__(self, data, bgr=None):
+        self.data = data
+        self._bgr = bgr
+        self._gray = None
+        self._alpha = False  # 未读取
+    
+    @property
+    def bgr(self):
+        """BGR 数组（二值化后为单通道），首次访问时解码"""
+        if self._bgr is None:
+            self._bgr = decode_image(self.data)
+        return self._bgr
+    
+    @property
+    def gray(self):
+        """灰度数组"""
+        if self._gray is None:
+            image = self.bgr
+            self._gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+    
+    @property
+    def alpha(self):
+        """透明通道（uint8 数组），图片没有透明通道时为 None；首次访问时再解码一次原图"""
+        if self._alpha is False:
+            self._alpha = None
+            if not _may_have_alpha(self.data):
+                return None
+            image = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+            if image is not None and image.ndim == 3 and image.shape[2] == 4:
+                self._alpha = image[:, :, 3]
+        return self._alpha
+    
+    @property
+    def rgb(self):
+        """RGB 数组"""
+        image = self.bgr
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB if image.ndim == 2 else cv2.COLOR_BGR2RGB)
+    
+    def preprocess(self, **options):
+        """返回预处理后的新图片，参数同 preprocess_array"""
+        return DecodedImage(self.data, preprocess_array(self.bgr, **options))
+
+def preprocess_array(image, enhance=False, denoise=False, binarize=False):
+    """
+    图片预处理（直接处理像素数组）
+    
+    Args:
+        image: BGR 像素数组
         enhance: 是否增强对比度和锐度
         denoise: 是否去噪（已禁用，保留参数兼容性）
         binarize: 是否二值化
     
     Returns:
-        bytes: 处理后的图片字节流
+        np.ndarray: 处理后的 BGR 数组（二值化时为单通道）
     """
-    try:
-        image = Image.open(BytesIO(image_bytes))
-        
-        # 转换为RGB模式（处理RGBA、灰度等格式）
-        if image.mode not in ('RGB', 'L'):
-            image = image.convert('RGB')
-        
+    with stage_timer('preprocess'):
         if enhance:
-            # 增强对比度
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            # 增强锐度
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.5)
-        
-        # 转换为numpy数组用于OpenCV处理
-        img_array = np.array(image)
-        
-        # 确保是3通道图像
-        if len(img_array.shape) == 2:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2BGR)
-        elif img_array.shape[2] == 4:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
+            # 增强对比度和锐度（PIL 与数组之间只有内存拷贝，没有编解码）
+            pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            pil_image = ImageEnhance.Contrast(pil_image).enhance(1.5)
+            pil_image = ImageEnhance.Sharpness(pil_image).enhance(1.5)
+            image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
         
         # 注意：去噪功能已禁用，因为 cv2.fastNlMeansDenoisingColored 
         # 在某些情况下会导致递归错误
         # if denoise:
-        #     img_array = cv2.fastNlMeansDenoisingColored(img_array, None, 3, 3, 7, 21)
+        #     image = cv2.fastNlMeansDenoisingColored(image, None, 3, 3, 7, 21)
         
         if binarize:
             # 转灰度
-            gray = cv2.cvtColor(img_array, cv2.COLOR_BGR2GRAY)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             # 自适应二值化
-            img_array = cv2.adaptiveThreshold(
+            image = cv2.adaptiveThreshold(
                 gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
                 cv2.THRESH_BINARY, 11, 2
             )
+    return image
+
+def preprocess_image(image_bytes, enhance=False, denoise=False, binarize=False):
+    """
+    图片预处理函数（字节流接口，服务内部使用 DecodedImage.preprocess）
+    
+    Args:
+        image_bytes: 图片字节流
+        enhance: 是否增强对比度和锐度
+        denoise: 是否去噪（已禁用，保留参数兼容性）
+        binarize: 是否二值化
+    
+    Returns:
+        bytes: 处理后的图片字节流
+    """
+    try:
+        img_array = preprocess_array(decode_image(image_bytes), enhance, denoise, binarize)
         
         # 转回bytes
         _, buffer = cv2.imencode('.png', img_array)
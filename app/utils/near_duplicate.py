@@ -0,0 +1,170 @@
+"""近似重复图片缓存
+
+很多验证码服务会把同一张验证码以不同的 JPEG 质量或元数据重新编码后再次下发，
+字节哈希（result_cache）无法命中。这里对最近识别过的图片计算感知哈希，新图片与
+同一接口、同一参数、同一尺寸的已识别图片的汉明距离不超过 NEAR_DUPLICATE_MAX_DISTANCE
+时直接返回已识别的结果，不再推理。
+
+- phash（默认）：缩小为 4size x 4size 后做 DCT，取左上角 size x size 个低频系数与中位数比较，
+  只反映整体结构，JPEG 压缩噪声主要影响高频，对重新编码稳定
+- dhash：缩小为 (size+1) x size 的灰度图，比较相邻像素的明暗，计算更快，但 size 较大时
+  每个像素只对应很小的区域，容易受压缩噪声影响
+- 哈希位数为 size * size（默认 16，256 位），位数越多越不容易把不同的验证码误判为相同
+
+合成样本上（benchmarks/near_duplicate.py），256 位 phash、阈值 16 时重新编码的图片全部命中，
+未见过的验证码没有误匹配；64 位哈希阈值超过 8~12 后误匹配迅速增加。
+
+索引是进程内的环形缓冲区（NEAR_DUPLICATE_MAX_ENTRIES 条，满后覆盖最早的条目），
+查找时对同一命名空间的全部条目做一次向量化的异或和位计数。解码、缩放和 DCT 由
+CaptchaService 提交到推理线程池计算，不占用请求协程。阈值过大时不同的验证码
+也可能命中，默认关闭，启用前用 benchmarks/near_duplicate.py 在样本上测量命中率和误匹配率。
+"""
+import hashlib
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app.utils.stats import NEAR_DUPLICATE_DISTANCE, NEAR_DUPLICATE_REQUESTS
+
+HASH_METHODS = ('dhash', 'phash')
+# 每个字节中 1 的个数
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def dhash(gray, size=16):
+    """差值哈希，返回 size * size 位（按字节打包）"""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray, size=16):
+    """DCT 感知哈希，返回 size * size 位（按字节打包）"""
+    small = cv2.resize(gray, (size * 4, size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:size, :size]
+    return np.packbits(low > np.median(low))
+
+
+HASH_FUNCTIONS = {'dhash': dhash, 'phash': phash}
+
+
+class NearDuplicateCache:
+    """近似重复图片缓存（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.enabled = False
+        self.method = 'phash'
+        self.hash_size = 16
+        self.max_distance = 16
+        self.max_entries = 4096
+        self.ttl = 600
+        self._lock = threading.Lock()
+        self._allocate()
+
+    def init_app(self, app):
+        """
+        根据应用配置初始化索引
+
+        Raises:
+            ValueError: 哈希方法无效
+        """
+        self.enabled = app.config.get('NEAR_DUPLICATE_CACHE_ENABLED', False)
+        self.method = app.config.get('NEAR_DUPLICATE_HASH', 'phash')
+        if self.method not in HASH_METHODS:
+            raise ValueError(f"不支持的感知哈希: {self.method}，可选 {'/'.join(HASH_METHODS)}")
+        # 哈希按字节打包，位数需为 8 的倍数
+        self.hash_size = max(8, int(app.config.get('NEAR_DUPLICATE_HASH_SIZE', 16)) // 8 * 8)
+        self.max_distance = max(0, int(app.config.get('NEAR_DUPLICATE_MAX_DISTANCE', 16)))
+        self.max_entries = max(1, int(app.config.get('NEAR_DUPLICATE_MAX_ENTRIES', 4096)))
+        self.ttl = app.config.get('NEAR_DUPLICATE_TTL', 600)
+        self._allocate()
+
+    def _allocate(self):
+        with self._lock:
+            self._hashes = np.zeros((self.max_entries, self.hash_size * self.hash_size // 8), dtype=np.uint8)
+            self._namespaces = np.zeros(self.max_entries, dtype=np.int64)
+            self._expires = np.zeros(self.max_entries, dtype=np.float64)  # 0 表示空
+            self._results = [None] * self.max_entries
+            self._next = 0
+
+    @staticmethod
+    def namespace(method, image, **params):
+        """
+        命名空间：识别方法、调用参数和图片尺寸都相同的图片之间才比较
+
+        Args:
+            method: 识别方法名
+            image: DecodedImage
+            **params: 影响结果的调用参数
+        """
+        height, width = image.gray.shape[:2]
+        key = json.dumps([method, width, height, params], sort_keys=True).encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little', signed=True)
+
+    def image_hash(self, image):
+        """DecodedImage 的感知哈希"""
+        return HASH_FUNCTIONS[self.method](image.gray, self.hash_size)
+
+    def key(self, method, image, **params):
+        """(命名空间, 感知哈希)，需要解码图片，在推理线程池中调用"""
+        return self.namespace(method, image, **params), self.image_hash(image)
+
+    def lookup(self, method, namespace, image_hash):
+        """
+        查找距离最近的已识别图片
+
+        Returns:
+            距离不超过阈值时返回其识别结果，否则返回 None
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            rows = np.flatnonzero((self._namespaces == namespace) & (self._expires > now))
+            if rows.size:
+                distances = _POPCOUNT[np.bitwise_xor(self._hashes[rows], image_hash)].sum(axis=1)
+                best = int(distances.argmin())
+                distance = int(distances[best])
+                if distance <= self.max_distance:
+                    value = self._results[rows[best]]
+                    NEAR_DUPLICATE_REQUESTS.labels(method, 'hit').inc()
+                    NEAR_DUPLICATE_DISTANCE.observe(distance)
+                    return json.loads(value)
+        NEAR_DUPLICATE_REQUESTS.labels(method, 'miss').inc()
+        return None
+
+    def add(self, namespace, image_hash, result):
+        """记录一张已识别的图片（识别失败的结果不记录）"""
+        if not self.enabled or result is None:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else float('inf')
+        # 与 result_cache 相同，保存序列化后的结果，命中时返回新的对象
+        value = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            row = self._next
+            self._next = (row + 1) % self.max_entries
+            self._hashes[row] = image_hash
+            self._namespaces[row] = namespace
+            self._expires[row] = expires_at
+            self._results[row] = value
+
+    def clear(self):
+        self._allocate()
+
+    def get_stats(self):
+        """获取索引配置和条目数（命中统计见 stats.get_near_duplicate_stats）"""
+        with self._lock:
+            entries = int(np.count_nonzero(self._expires > time.monotonic()))
+        return {
+            'enabled': self.enabled,
+            'hash': self.method,
+            'hash_bits': self.hash_size * self.hash_size,
+            'max_distance': self.max_distance,
+            'entries': entries,
+            'max_entries': self.max_entries
+        }
+
+
+near_duplicate_cache = NearDuplicateCache()
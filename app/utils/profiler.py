@@ -0,0 +1,368 @@
+"""按需采样的请求性能分析
+
+管理员通过 /admin/profile 打开后，按 sample_rate 抽样请求进行性能分析，duration 秒后自动关闭：
+- cprofile：用 cProfile 记录被抽样请求的全部函数调用（包括推理线程池中执行的部分），
+  开销较大，适合短时间、低抽样率使用；汇总结果可以导出为 .prof 文件（snakeviz 等工具查看）
+  或按累计耗时排序的文本
+- sampling：后台线程每隔 SAMPLING_INTERVAL 秒记录一次正在处理被抽样请求的线程的调用栈，
+  开销很小；汇总为 collapsed stack 格式（"a;b;c 次数"），可直接用 flamegraph.pl 或
+  speedscope 生成火焰图
+
+gevent worker 中所有请求协程共用一个系统线程：cprofile 模式下同一时刻只分析其中一个请求，
+请求等待期间切换到的其他协程的调用也会被记录；sampling 模式采样到的调用栈可能属于
+同一时刻正在执行的其他请求。
+
+开关写在 PROFILE_DIR 下的 control.json 中，每个 worker 每秒检查一次，因此请求落在
+任一 worker 上都能打开或关闭所有 worker 的分析；各 worker 把汇总结果定期写入同一目录，
+读取时合并。
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g
+
+PROFILE_MODES = ('cprofile', 'sampling')
+SAMPLING_INTERVAL = 0.005  # 秒
+CONTROL_CHECK_INTERVAL = 1.0  # 检查开关文件的间隔（秒）
+DUMP_INTERVAL = 2.0  # 汇总结果写入文件的最短间隔（秒）
+MAX_DURATION = 3600  # 单次分析的最长时间（秒）
+MAX_STACK_DEPTH = 64
+
+_collector = contextvars.ContextVar('captcha_profile_collector', default=None)
+
+
+class _Collector:
+    """一个被抽样请求的分析数据（请求线程和推理线程各自的 cProfile）"""
+
+    __slots__ = ('profiles', 'lock', 'thread')
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.thread = threading.get_ident()  # 请求线程，其中的调用已由请求的 cProfile 记录
+
+
+def run_profiled(func, *args, **kwargs):
+    """
+    执行 func：当前请求被 cProfile 抽样时，在当前线程中单独记录 func 的调用
+    （cProfile 只记录启动它的线程，推理线程池中的任务需要各自记录）
+    """
+    collector = _collector.get()
+    if collector is None or collector.thread == threading.get_ident():
+        return func(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        with collector.lock:
+            collector.profiles.append(profile)
+
+
+def _frame_stack(frame):
+    """调用栈（从外到内），格式为 "函数名 (文件名:行号)" """
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return ';'.join(stack)
+
+
+class RequestProfiler:
+    """请求性能分析（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.directory = '/tmp/captcha-api-profiles'
+        self._control = None
+        self._control_checked = 0.0
+        self._stats = None  # cProfile 汇总（pstats.Stats）
+        self._stacks = Counter()  # sampling 汇总
+        self._profiled_requests = 0
+        self._dumped_at = 0.0
+        self._dirty = False
+        self._threads = {}  # 正在处理被抽样请求的线程: 计数
+        self._cprofile_threads = set()  # 正在执行 cProfile 的请求线程
+        self._sampler = None
+        self._sampler_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """注册请求钩子"""
+        self.directory = app.config.get('PROFILE_DIR', self.directory)
+        app.before_request(self._start)
+        app.teardown_request(self._stop)
+
+    # 开关（写入 control.json，所有 worker 共享）
+
+    def _control_path(self):
+        return os.path.join(self.directory, 'control.json')
+
+    def enable(self, mode, sample_rate=1.0, duration=60):
+        """
+        打开性能分析，并清除之前的分析结果
+
+        Raises:
+            ValueError: 参数无效
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode 必须是 {'/'.join(PROFILE_MODES)} 之一")
+        try:
+            sample_rate, duration = float(sample_rate), float(duration)
+        except (TypeError, ValueError):
+            raise ValueError('sample_rate 和 duration 必须是数字')
+        if not 0 < sample_rate <= 1:
+            raise ValueError('sample_rate 必须在 (0, 1] 之间')
+        if not 0 < duration <= MAX_DURATION:
+            raise ValueError(f"duration 必须在 (0, {MAX_DURATION}] 秒之间")
+
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.startswith(('cprofile-', 'sampling-', 'requests-')):
+                os.remove(os.path.join(self.directory, name))
+        control = {
+            'id': f"{time.time():.6f}",
+            'mode': mode,
+            'sample_rate': sample_rate,
+            'until': time.time() + duration
+        }
+        temporary = f"{self._control_path()}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(control, f)
+        os.replace(temporary, self._control_path())
+        self._control_checked = 0.0
+        return control
+
+    def disable(self):
+        """关闭性能分析（保留已有的分析结果）"""
+        try:
+            os.remove(self._control_path())
+        except FileNotFoundError:
+            pass
+        self._control_checked = 0.0
+
+    def _active(self):
+        """当前生效的开关，未打开或已过期时返回 None"""
+        now = time.time()
+        if now - self._control_checked >= CONTROL_CHECK_INTERVAL:
+            try:
+                with open(self._control_path()) as f:
+                    control = json.load(f)
+            except (OSError, ValueError):
+                control = None
+            if control != self._control:
+                self._switch(control)
+            self._control_checked = now
+        control = self._control
+        if control is None or now >= control['until']:
+            if self._dirty:
+                self._dump(force=True)
+            return None
+        return control
+
+    def _switch(self, control):
+        """开关变化：关闭时写出剩余的结果；开始新的分析时（旧结果已被 enable 删除）丢弃汇总数据"""
+        with self._lock:
+            if control is None and self._dirty:
+                self._dump(force=True, locked=True)
+            self._stats = None
+            self._stacks = Counter()
+            self._profiled_requests = 0
+            self._dirty = False
+            self._control = control
+
+    # 请求钩子
+
+    def _start(self):
+        control = self._active()
+        if control is None or random.random() >= control['sample_rate']:
+            return
+        if control['mode'] == 'cprofile':
+            # 一个线程中同时只能有一个 cProfile（gevent worker 中并发的请求共用一个线程）
+            with self._lock:
+                if threading.get_ident() in self._cprofile_threads:
+                    return
+                self._cprofile_threads.add(threading.get_ident())
+            g._profile_mode = control['mode']
+            collector = _Collector()
+            profile = cProfile.Profile()
+            collector.profiles.append(profile)
+            g._profile_token = _collector.set(collector)
+            g._profile_collector = collector
+            profile.enable()
+        else:
+            g._profile_mode = control['mode']
+            self._ensure_sampler()
+            self._track_thread(1)
+
+    def _stop(self, exc=None):
+        mode = g.pop('_profile_mode', None)
+        if mode is None:
+            return
+        if mode == 'cprofile':
+            collector = g.pop('_profile_collector')
+            collector.profiles[0].disable()
+            _collector.reset(g.pop('_profile_token'))
+            with self._lock:
+                self._cprofile_threads.discard(threading.get_ident())
+                with collector.lock:
+                    profiles = list(collector.profiles)
+                for profile in profiles:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+                self._profiled_requests += 1
+                self._dirty = True
+        else:
+            self._track_thread(-1)
+            with self._lock:
+                self._profiled_requests += 1
+                self._dirty = True
+        self._dump()
+
+    def _track_thread(self, delta):
+        ident = threading.get_ident()
+        with self._lock:
+            count = self._threads.get(ident, 0) + delta
+            if count > 0:
+                self._threads[ident] = count
+            else:
+                self._threads.pop(ident, None)
+
+    def track_task(self, func, *args, **kwargs):
+        """在推理线程中执行 func，当前请求被抽样时一并分析该线程"""
+        if _collector.get() is not None:
+            return run_profiled(func, *args, **kwargs)
+        if self._control is None or self._control.get('mode') != 'sampling' or not self._threads:
+            return func(*args, **kwargs)
+        self._track_thread(1)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._track_thread(-1)
+
+    # sampling
+
+    def _ensure_sampler(self):
+        # fork 后子进程中没有父进程的线程，需要按进程重新启动
+        if self._sampler is not None and self._sampler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sampler is None or self._sampler_pid != os.getpid():
+                self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+                self._sampler_pid = os.getpid()
+                self._sampler.start()
+
+    def _sample(self):
+        while True:
+            time.sleep(SAMPLING_INTERVAL)
+            if not self._threads:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in list(self._threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._stacks[_frame_stack(frame)] += 1
+
+    # 结果
+
+    def _dump(self, force=False, locked=False):
+        """把当前 worker 的汇总结果写入 PROFILE_DIR（限制写入频率）"""
+        now = time.time()
+        if not self._dirty or (not force and now - self._dumped_at < DUMP_INTERVAL):
+            return
+        if not locked:
+            with self._lock:
+                return self._dump(force=True, locked=True)
+        pid = os.getpid()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self._stats is not None:
+                self._stats.dump_stats(os.path.join(self.directory, f"cprofile-{pid}.prof"))
+            if self._stacks:
+                path = os.path.join(self.directory, f"sampling-{pid}.txt")
+                with open(f"{path}.tmp", 'w') as f:
+                    f.writelines(f"{stack} {count}\n" for stack, count in self._stacks.items())
+                os.replace(f"{path}.tmp", path)
+            with open(os.path.join(self.directory, f"requests-{pid}.txt"), 'w') as f:
+                f.write(str(self._profiled_requests))
+        except OSError:
+            return
+        self._dumped_at = now
+        self._dirty = False
+
+    def _files(self, prefix):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.startswith(prefix)]
+
+    def status(self):
+        """开关状态和所有 worker 已分析的请求数"""
+        self._active()
+        self._dump(force=True)
+        control = self._control
+        requests = 0
+        for path in self._files('requests-'):
+            try:
+                with open(path) as f:
+                    requests += int(f.read() or 0)
+            except (OSError, ValueError):
+                pass
+        return {
+            'enabled': control is not None and time.time() < control['until'],
+            'mode': control and control['mode'],
+            'sample_rate': control and control['sample_rate'],
+            'remaining_seconds': max(0, round(control['until'] - time.time(), 1)) if control else 0,
+            'profiled_requests': requests
+        }
+
+    def collapsed_stacks(self):
+        """合并所有 worker 的 sampling 结果（collapsed stack 格式文本）"""
+        stacks = Counter()
+        for path in self._files('sampling-'):
+            if path.endswith('.tmp'):
+                continue
+            with open(path) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack:
+                        stacks[stack] += int(count)
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def cprofile_stats(self):
+        """合并所有 worker 的 cProfile 结果，没有结果时返回 None"""
+        paths = [path for path in self._files('cprofile-') if path.endswith('.prof')]
+        return pstats.Stats(*paths) if paths else None
+
+    def cprofile_text(self, limit=50, sort='cumulative'):
+        stats = self.cprofile_stats()
+        if stats is None:
+            return ''
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def cprofile_dump(self):
+        """合并后的 .prof 文件内容（marshal 格式）"""
+        stats = self.cprofile_stats()
+        if stats is None:
+            return b''
+        import marshal
+        return marshal.dumps(stats.stats)
+
+
+request_profiler = RequestProfiler()
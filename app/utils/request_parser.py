@@ -0,0 +1,85 @@
+"""请求参数解析
+
+识别接口除 JSON（图片为 base64/URL 字符串）外，还接受二进制上传，省去 base64 编解码：
+
+- multipart/form-data：图片作为文件字段上传（/capcode 为 slidingImage 和 backImage，
+  /batch/classification 为多个 images 字段），其他参数作为普通表单字段。
+  表单解析后文件字段和文本字段分开保存，无法还原两者之间的顺序，因此同一个列表字段
+  不能混用文件和文本（base64/URL），否则返回 400
+- application/octet-stream：请求体即图片（对应 image 参数），其他参数放在 URL 查询参数中
+"""
+from flask import request
+
+# 表单/查询参数中需要转换为布尔值的字段
+BOOLEAN_FIELDS = ('preprocess', 'simpleTarget')
+# 需要转换为整数的字段（无法转换时保留原字符串，由路由校验）
+INTEGER_FIELDS = ('y_coordinate',)
+# 可以重复出现、解析为列表的字段
+LIST_FIELDS = ('images',)
+
+
+def _parse_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _parse_fields(fields):
+    """将表单/查询参数转换为与 JSON 请求体一致的结构"""
+    data = {}
+    for name in fields:
+        values = fields.getlist(name)
+        if name in LIST_FIELDS:
+            data[name] = values
+        elif name in BOOLEAN_FIELDS:
+            data[name] = _parse_bool(values[0])
+        elif name in INTEGER_FIELDS:
+            data[name] = _parse_int(values[0])
+        else:
+            data[name] = values[0]
+    return data
+
+
+def get_query_data():
+    """URL 查询参数（类型转换与表单字段一致），用于请求体不是参数的接口"""
+    return _parse_fields(request.args)
+
+
+def get_request_data():
+    """
+    按 Content-Type 解析请求参数
+
+    Returns:
+        dict: 与 JSON 请求体结构一致的参数字典，二进制上传的图片为 bytes；
+              请求体为空时可能返回 None
+
+    Raises:
+        ValueError: multipart 请求的列表字段同时包含文件和文本
+    """
+    mimetype = request.mimetype
+
+    if mimetype == 'multipart/form-data':
+        data = _parse_fields(request.form)
+        for name in request.files:
+            contents = [storage.read() for storage in request.files.getlist(name)]
+            if name in LIST_FIELDS:
+                if name in data:
+                    raise ValueError(f"{name} 不能同时包含文件和文本字段")
+                data[name] = contents
+            else:
+                data[name] = contents[0]
+        return data
+
+    if mimetype == 'application/octet-stream':
+        data = get_query_data()
+        body = request.get_data(cache=False)
+        if body:
+            data['image'] = body
+        return data
+
+    return request.get_json()
@@ -1,62 +1,483 @@
+"""请求统计与监控指标
+
+指标使用 prometheus_client 记录，/metrics 以文本格式输出，/stats 由同一份指标汇总生成
+（包括请求、处理阶段、结果缓存、跨请求批处理、推理线程池、图片下载、自定义模型、流式批量识别和离线任务）。
+设置 PROMETHEUS_MULTIPROC_DIR 后（gunicorn.conf.py 中默认设置）各 worker 把指标写入
+该目录下的文件，抓取时合并，/metrics 和 /stats 看到的是所有 worker 的汇总数据。
+"""
+import os
 import time
+from contextlib import contextmanager
 from functools import wraps
+
 from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+from app.utils import timing
+
+# 请求延迟分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+# 处理阶段耗时分桶（秒）
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# 批大小分桶
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+REQUESTS = Counter(
+    'captcha_requests', '请求数', ['endpoint', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'captcha_request_duration_seconds', '请求处理耗时', ['endpoint'], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'captcha_requests_in_progress', '正在处理的请求数', ['endpoint'], multiprocess_mode='livesum'
+)
+STAGE_LATENCY = Histogram(
+    'captcha_stage_duration_seconds', '处理阶段耗时（下载、解码、预处理、推理、序列化）', ['stage'],
+    buckets=STAGE_BUCKETS
+)
+INFERENCE_IN_FLIGHT = Gauge(
+    'captcha_inference_in_flight', '推理线程池中正在执行和排队的任务数', multiprocess_mode='livesum'
+)
+INFERENCE_TASKS = Counter(
+    'captcha_inference_tasks', '推理线程池任务数（completed 执行完成，rejected 因排队已满被拒绝）', ['result']
+)
+CACHE_REQUESTS = Counter(
+    'captcha_cache_requests', '识别结果缓存查询次数', ['result']  # hit / miss / error
+)
+CACHE_EVICTIONS = Counter(
+    'captcha_cache_evictions', '进程内识别结果缓存因超出内存上限淘汰的条目数'
+)
+MICRO_BATCH_SIZE = Histogram(
+    'captcha_micro_batch_size', '跨请求批处理每批的请求数', buckets=BATCH_SIZE_BUCKETS
+)
+MICRO_BATCH_WAIT = Histogram(
+    'captcha_micro_batch_wait_seconds', '请求在批处理队列中等待的时间（批处理带来的额外延迟）',
+    buckets=STAGE_BUCKETS
+)
+MICRO_BATCH_QUEUE_DEPTH = Gauge(
+    'captcha_micro_batch_queue_depth', '等待凑批的请求数', multiprocess_mode='livesum'
+)
+MICRO_BATCH_REJECTED = Counter(
+    'captcha_micro_batch_rejected', '因批处理队列已满被拒绝的请求数'
+)
+FETCH_REQUESTS = Counter(
+    'captcha_fetch_requests', '图片下载次数', ['host', 'result']  # ok / error / not_modified / cache_hit
+)
+FETCH_LATENCY = Histogram(
+    'captcha_fetch_duration_seconds', '图片下载耗时（不含缓存命中）', ['host'], buckets=LATENCY_BUCKETS
+)
+CUSTOM_MODEL_INFERENCE = Histogram(
+    'captcha_custom_model_inference_seconds', '自定义模型单张图片的推理耗时', ['model'], buckets=STAGE_BUCKETS
+)
+CUSTOM_MODEL_LOADS = Counter(
+    'captcha_custom_model_loads', '自定义模型加载次数', ['model', 'result']  # loaded / reloaded / failed
+)
+CUSTOM_MODEL_LOAD_LATENCY = Histogram(
+    'captcha_custom_model_load_seconds', '自定义模型加载耗时', ['model'], buckets=LATENCY_BUCKETS
+)
+CUSTOM_MODEL_UNLOADS = Counter(
+    'captcha_custom_model_unloads', '自定义模型因超出内存上限或文件删除被卸载的次数', ['model']
+)
+
+STREAM_ITEMS = Counter(
+    'captcha_stream_items', '流式批量识别处理的图片数', ['type', 'result']  # ok / error / busy
+)
+
+JOB_ITEMS = Counter(
+    'captcha_job_items', '离线任务处理的图片数', ['type', 'result']  # ok / error
+)
+JOB_QUEUE_LAG = Histogram(
+    'captcha_job_queue_lag_seconds', '离线任务从提交到图片开始处理的时间',
+    buckets=(1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+)
+JOB_QUEUED_ITEMS = Gauge(
+    'captcha_job_pending_items', '离线任务中等待处理的图片数（来自共享数据库）', multiprocess_mode='livemax'
+)
+JOB_OLDEST_AGE = Gauge(
+    'captcha_job_oldest_pending_seconds', '最早提交的未完成任务已等待的时间', multiprocess_mode='livemax'
+)
+
+NEAR_DUPLICATE_REQUESTS = Counter(
+    'captcha_near_duplicate_requests', '近似重复图片缓存的查找次数', ['method', 'result']  # hit / miss
+)
+NEAR_DUPLICATE_DISTANCE = Histogram(
+    'captcha_near_duplicate_distance', '近似重复图片缓存命中时的汉明距离',
+    buckets=(0, 1, 2, 4, 6, 8, 12, 16, 24, 32)
+)
+
+ADMISSION_DECISIONS = Counter(
+    'captcha_admission_decisions', '准入控制的决定', ['endpoint', 'result']  # admitted / queued / shed
+)
+ADMISSION_WAIT = Histogram(
+    'captcha_admission_wait_seconds', '超出延迟目标的请求在准入前等待的时间',
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+ADMISSION_OUTSTANDING = Gauge(
+    'captcha_admission_outstanding_seconds', '已准入、未完成的请求的估计推理耗时之和', multiprocess_mode='livesum'
+)
+
+
+@contextmanager
+def stage_timer(stage, span=None):
+    """记录一个处理阶段的耗时，同时记录到当前请求的耗时分解中（名称为 span，默认与 stage 相同）"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        timing.record(span or stage, start_time, elapsed)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """记录响应序列化耗时的 JSON provider"""
+
+    def dumps(self, obj, **kwargs):
+        with stage_timer('serialize'):
+            return super().dumps(obj, **kwargs)
 
-# 统计数据
-stats = {
-    'total_requests': 0,
-    'successful_requests': 0,
-    'failed_requests': 0,
-    'total_processing_time': 0,
-    'endpoints': {}
-}
 
 def track_stats(endpoint_name):
-    """统计装饰器"""
+    """
+    统计装饰器：记录请求数（按响应状态码）、耗时和正在处理的请求数
+
+    流式响应（如 /batch/stream）在输出结束或客户端断开、服务器关闭响应时才记录，
+    耗时包含整个输出过程，而不只是创建生成器的时间
+    """
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            start_time = time.time()
-            stats['total_requests'] += 1
-            
-            if endpoint_name not in stats['endpoints']:
-                stats['endpoints'][endpoint_name] = {
-                    'count': 0,
-                    'success': 0,
-                    'failed': 0,
-                    'avg_time': 0
-                }
-            
-            stats['endpoints'][endpoint_name]['count'] += 1
-            
+            start_time = time.perf_counter()
+            in_progress = REQUESTS_IN_PROGRESS.labels(endpoint_name)
+            in_progress.inc()
+            status = '500'
+            streamed = False
+
+            def finish():
+                in_progress.dec()
+                REQUESTS.labels(endpoint_name, status).inc()
+                REQUEST_LATENCY.labels(endpoint_name).observe(time.perf_counter() - start_time)
+
             try:
-                result = f(*args, **kwargs)
-                stats['successful_requests'] += 1
-                stats['endpoints'][endpoint_name]['success'] += 1
-                return result
+                response = current_app.make_response(f(*args, **kwargs))
+                status = str(response.status_code)
+                if response.is_streamed:
+                    response.call_on_close(finish)
+                    streamed = True
+                return response
             except Exception as e:
-                stats['failed_requests'] += 1
-                stats['endpoints'][endpoint_name]['failed'] += 1
-                raise e
+                # HTTPException 和 InferenceBusyError 带有对应的状态码
+                status = str(getattr(e, 'code', None) or 500)
+                raise
             finally:
-                processing_time = time.time() - start_time
-                stats['total_processing_time'] += processing_time
-                endpoint_stats = stats['endpoints'][endpoint_name]
-                endpoint_stats['avg_time'] = (
-                    (endpoint_stats['avg_time'] * (endpoint_stats['count'] - 1) + processing_time) 
-                    / endpoint_stats['count']
-                )
+                if not streamed:
+                    finish()
         return wrapper
     return decorator
 
+
+def _get_registry():
+    """多进程模式下合并所有 worker 的指标文件"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def generate_metrics():
+    """
+    生成文本格式的监控指标
+
+    Returns:
+        tuple: (指标文本, Content-Type)
+    """
+    return generate_latest(_get_registry()), CONTENT_TYPE_LATEST
+
+
+def _collect(registry):
+    """按指标名汇总样本：{样本名: [(labels, value)]}"""
+    samples = {}
+    for metric in registry.collect():
+        for sample in metric.samples:
+            samples.setdefault(sample.name, []).append((sample.labels, sample.value))
+    return samples
+
+
+def _histograms(samples, name, label):
+    """把直方图样本整理为 {标签值: {'buckets': [(上界, 累计数)], 'count', 'sum'}}，无标签的直方图 label 传 None"""
+    result = {}
+    for labels, value in samples.get(f'{name}_bucket', []):
+        entry = result.setdefault(labels.get(label), {'buckets': [], 'count': 0, 'sum': 0.0})
+        entry['buckets'].append((float(labels['le']), value))
+    for labels, value in samples.get(f'{name}_count', []):
+        if labels.get(label) in result:
+            result[labels.get(label)]['count'] = value
+    for labels, value in samples.get(f'{name}_sum', []):
+        if labels.get(label) in result:
+            result[labels.get(label)]['sum'] = value
+    for entry in result.values():
+        entry['buckets'].sort()
+    return result
+
+
+def _histogram(samples, name):
+    """无标签的直方图"""
+    return _histograms(samples, name, None).get(None, {'buckets': [], 'count': 0, 'sum': 0.0})
+
+
+def _quantile(q, buckets):
+    """根据直方图分桶估算分位数（桶内线性插值，与 PromQL histogram_quantile 一致）"""
+    if not buckets or buckets[-1][1] == 0:
+        return 0.0
+    rank = q * buckets[-1][1]
+    lower, previous = 0.0, 0
+    for upper, cumulative in buckets:
+        if cumulative >= rank:
+            if upper == float('inf'):
+                return lower
+            if cumulative == previous:
+                return upper
+            return lower + (upper - lower) * (rank - previous) / (cumulative - previous)
+        lower, previous = upper, cumulative
+    return lower
+
+
+def get_stage_stats(samples=None):
+    """获取各处理阶段的调用次数、平均耗时和分位数"""
+    if samples is None:
+        samples = _collect(_get_registry())
+
+    def fmt(seconds):
+        return f"{seconds * 1000:.3f}ms"
+
+    stages = {}
+    for stage, entry in sorted(_histograms(samples, 'captcha_stage_duration_seconds', 'stage').items()):
+        count = int(entry['count'])
+        stages[stage] = {
+            'count': count,
+            'avg_time': fmt(entry['sum'] / count) if count else "0ms",
+            'p50': fmt(_quantile(0.5, entry['buckets'])),
+            'p95': fmt(_quantile(0.95, entry['buckets'])),
+            'p99': fmt(_quantile(0.99, entry['buckets']))
+        }
+    return stages
+
+
+def _values(samples, name, label):
+    """把计数器样本整理为 {标签值: 数值}"""
+    return {labels[label]: value for labels, value in samples.get(name, [])}
+
+
+def _total(samples, name):
+    return sum(value for _, value in samples.get(name, []))
+
+
+def _bucket_counts(buckets):
+    """把累计分桶转换为各区间的数量，如 {'1': 3, '2': 1, '3-4': 5, '65+': 0}"""
+    counts = {}
+    lower, previous = 0, 0
+    for upper, cumulative in buckets:
+        if upper == float('inf'):
+            name = f"{lower + 1}+"
+        else:
+            upper = int(upper)
+            name = str(upper) if upper == lower + 1 else f"{lower + 1}-{upper}"
+            lower = upper
+        counts[name] = int(cumulative - previous)
+        previous = cumulative
+    return counts
+
+
+def get_cache_stats(samples):
+    """结果缓存的命中统计"""
+    requests = _values(samples, 'captcha_cache_requests_total', 'result')
+    hits, misses = int(requests.get('hit', 0)), int(requests.get('miss', 0))
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'errors': int(requests.get('error', 0)),
+        'evictions': int(_total(samples, 'captcha_cache_evictions_total')),
+        'hit_rate': f"{(hits / total * 100):.2f}%" if total > 0 else "0%"
+    }
+
+
+def get_near_duplicate_stats(samples):
+    """近似重复图片缓存按识别方法的命中统计"""
+    methods = {}
+    for labels, value in samples.get('captcha_near_duplicate_requests_total', []):
+        entry = methods.setdefault(labels['method'], {'hits': 0, 'misses': 0})
+        entry['hits' if labels['result'] == 'hit' else 'misses'] = int(value)
+    hits = sum(entry['hits'] for entry in methods.values())
+    total = hits + sum(entry['misses'] for entry in methods.values())
+    distance = _histogram(samples, 'captcha_near_duplicate_distance')
+    return {
+        'methods': methods,
+        'hits': hits,
+        'hit_rate': f"{(hits / total * 100):.2f}%" if total > 0 else "0%",
+        'avg_hit_distance': round(distance['sum'] / distance['count'], 2) if distance['count'] else 0
+    }
+
+
+def get_micro_batch_stats(samples):
+    """跨请求批处理的批大小分布、队列长度和额外延迟"""
+    size = _histogram(samples, 'captcha_micro_batch_size')
+    wait = _histogram(samples, 'captcha_micro_batch_wait_seconds')
+    batches, items = int(size['count']), int(size['sum'])
+    return {
+        'queue_depth': int(_total(samples, 'captcha_micro_batch_queue_depth')),
+        'rejected': int(_total(samples, 'captcha_micro_batch_rejected_total')),
+        'batches': batches,
+        'items': items,
+        'avg_batch_size': round(items / batches, 2) if batches else 0,
+        'batch_size_histogram': _bucket_counts(size['buckets']),
+        'avg_added_latency_ms': round(wait['sum'] / wait['count'] * 1000, 3) if wait['count'] else 0,
+        'p95_added_latency_ms': round(_quantile(0.95, wait['buckets']) * 1000, 3)
+    }
+
+
+def get_inference_pool_stats(samples):
+    """推理线程池的任务统计"""
+    tasks = _values(samples, 'captcha_inference_tasks_total', 'result')
+    return {
+        'in_flight': int(_total(samples, 'captcha_inference_in_flight')),
+        'completed': int(tasks.get('completed', 0)),
+        'rejected': int(tasks.get('rejected', 0))
+    }
+
+
+def get_fetch_stats(samples):
+    """按 host 统计图片下载次数、错误和耗时"""
+    latencies = _histograms(samples, 'captcha_fetch_duration_seconds', 'host')
+    hosts = {}
+    for labels, value in samples.get('captcha_fetch_requests_total', []):
+        entry = hosts.setdefault(labels['host'], {'requests': 0, 'errors': 0, 'cache_hits': 0, 'not_modified': 0})
+        count = int(value)
+        if labels['result'] == 'cache_hit':
+            entry['cache_hits'] += count
+            continue
+        entry['requests'] += count
+        if labels['result'] == 'error':
+            entry['errors'] += count
+        elif labels['result'] == 'not_modified':
+            entry['not_modified'] += count
+    for host, entry in hosts.items():
+        latency = latencies.get(host, {'buckets': [], 'count': 0, 'sum': 0.0})
+        entry['avg_time'] = f"{(latency['sum'] / latency['count'] if latency['count'] else 0):.3f}s"
+        entry['p95_time'] = f"{_quantile(0.95, latency['buckets']):.3f}s"
+    return {'hosts': hosts}
+
+
+def get_custom_model_stats(samples):
+    """按模型统计自定义模型的推理耗时和加载次数"""
+    inferences = _histograms(samples, 'captcha_custom_model_inference_seconds', 'model')
+    loads = _histograms(samples, 'captcha_custom_model_load_seconds', 'model')
+    unloads = _values(samples, 'captcha_custom_model_unloads_total', 'model')
+    models = {}
+    for labels, value in samples.get('captcha_custom_model_loads_total', []):
+        entry = models.setdefault(labels['model'], {'loads': 0, 'reloads': 0, 'load_failures': 0})
+        key = {'loaded': 'loads', 'reloaded': 'reloads', 'failed': 'load_failures'}.get(labels['result'])
+        if key:
+            entry[key] += int(value)
+    for name, entry in models.items():
+        inference = inferences.get(name, {'buckets': [], 'count': 0, 'sum': 0.0})
+        load = loads.get(name, {'count': 0, 'sum': 0.0})
+        entry['unloads'] = int(unloads.get(name, 0))
+        entry['avg_load_seconds'] = round(load['sum'] / load['count'], 3) if load['count'] else 0
+        entry['inferences'] = int(inference['count'])
+        entry['avg_inference_ms'] = (
+            round(inference['sum'] / inference['count'] * 1000, 3) if inference['count'] else 0
+        )
+        entry['p95_inference_ms'] = round(_quantile(0.95, inference['buckets']) * 1000, 3)
+    return {'models': models}
+
+
+def get_stream_stats(samples):
+    """按识别类型统计流式批量识别的图片数"""
+    types = {}
+    for labels, value in samples.get('captcha_stream_items_total', []):
+        entry = types.setdefault(labels['type'], {'ok': 0, 'error': 0, 'busy': 0})
+        entry[labels['result']] = int(value)
+    return {'types': types}
+
+
+def get_job_stats(samples):
+    """离线任务的处理数量和排队延迟"""
+    items = {}
+    for labels, value in samples.get('captcha_job_items_total', []):
+        entry = items.setdefault(labels['type'], {'ok': 0, 'error': 0})
+        entry[labels['result']] = int(value)
+    lag = _histogram(samples, 'captcha_job_queue_lag_seconds')
+    return {
+        'items': items,
+        'avg_queue_lag_seconds': round(lag['sum'] / lag['count'], 3) if lag['count'] else 0,
+        'p95_queue_lag_seconds': round(_quantile(0.95, lag['buckets']), 3)
+    }
+
+
+def get_admission_stats(samples):
+    """准入控制按接口统计的准入、排队后准入和拒绝数"""
+    endpoints = {}
+    for labels, value in samples.get('captcha_admission_decisions_total', []):
+        entry = endpoints.setdefault(labels['endpoint'], {'admitted': 0, 'queued': 0, 'shed': 0})
+        entry[labels['result']] = int(value)
+    wait = _histogram(samples, 'captcha_admission_wait_seconds')
+    return {
+        'endpoints': endpoints,
+        'shed': sum(entry['shed'] for entry in endpoints.values()),
+        'outstanding_seconds': round(_total(samples, 'captcha_admission_outstanding_seconds'), 4),
+        'avg_wait_ms': round(wait['sum'] / wait['count'] * 1000, 3) if wait['count'] else 0,
+        'p95_wait_ms': round(_quantile(0.95, wait['buckets']) * 1000, 3)
+    }
+
+
 def get_stats_data():
-    """获取统计数据"""
-    avg_time = stats['total_processing_time'] / stats['total_requests'] if stats['total_requests'] > 0 else 0
+    """获取统计数据（多进程模式下为所有 worker 的汇总）"""
+    samples = _collect(_get_registry())
+    latencies = _histograms(samples, 'captcha_request_duration_seconds', 'endpoint')
+    in_progress = {labels['endpoint']: value for labels, value in samples.get('captcha_requests_in_progress', [])}
+
+    endpoints = {}
+    for labels, value in samples.get('captcha_requests_total', []):
+        entry = endpoints.setdefault(labels['endpoint'], {'count': 0, 'success': 0, 'failed': 0, 'status': {}})
+        count = int(value)
+        entry['count'] += count
+        entry['success' if labels['status'].startswith(('2', '3')) else 'failed'] += count
+        entry['status'][labels['status']] = count
+
+    total_requests = successful_requests = 0
+    total_processing_time = 0.0
+    for name, entry in endpoints.items():
+        latency = latencies.get(name, {'buckets': [], 'sum': 0.0})
+        entry['avg_time'] = round(latency['sum'] / entry['count'], 4) if entry['count'] else 0
+        entry['p50'] = round(_quantile(0.5, latency['buckets']), 4)
+        entry['p95'] = round(_quantile(0.95, latency['buckets']), 4)
+        entry['p99'] = round(_quantile(0.99, latency['buckets']), 4)
+        entry['in_progress'] = int(in_progress.get(name, 0))
+        total_requests += entry['count']
+        successful_requests += entry['success']
+        total_processing_time += latency['sum']
+
+    avg_time = total_processing_time / total_requests if total_requests > 0 else 0
     return {
-        'total_requests': stats['total_requests'],
-        'successful_requests': stats['successful_requests'],
-        'failed_requests': stats['failed_requests'],
-        'success_rate': f"{(stats['successful_requests'] / stats['total_requests'] * 100):.2f}%" if stats['total_requests'] > 0 else "0%",
+        'total_requests': total_requests,
+        'successful_requests': successful_requests,
+        'failed_requests': total_requests - successful_requests,
+        'success_rate': f"{(successful_requests / total_requests * 100):.2f}%" if total_requests > 0 else "0%",
         'average_processing_time': f"{avg_time:.3f}s",
-        'endpoints': stats['endpoints']
+        'endpoints': endpoints,
+        'stages': get_stage_stats(samples),
+        'cache': get_cache_stats(samples),
+        'near_duplicate': get_near_duplicate_stats(samples),
+        'micro_batch': get_micro_batch_stats(samples),
+        'inference_pool': get_inference_pool_stats(samples),
+        'fetcher': get_fetch_stats(samples),
+        'custom_models': get_custom_model_stats(samples),
+        'stream': get_stream_stats(samples),
+        'jobs': get_job_stats(samples),
+        'admission': get_admission_stats(samples)
     }
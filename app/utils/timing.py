@@ -0,0 +1,168 @@
+"""单个请求的耗时分解
+
+stats.stage_timer 记录的各处理阶段（下载、解码、预处理、推理、序列化）同时记录到当前
+请求的耗时分解中。推理线程池中执行的任务通过 bind() 继承请求的上下文（contextvars），
+批处理线程把等待和执行时间记录到各自请求中，ASGI 模式下事件循环中的图片下载时间
+通过 WSGI environ 传入。
+
+请求中带 X-Timing: 1 请求头或 timing=1 查询参数时，响应带 Server-Timing 头
+（浏览器开发者工具可以直接显示），JSON 响应中增加 timing 字段：
+{'total_ms', 'stages': {名称: {'duration_ms', 'count'}}, 'spans': [{'name', 'start_ms', 'duration_ms'}]}。
+REQUEST_TIMING=always 时所有响应都带 Server-Timing 头，off 时不记录。
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+
+# ASGI 模式下请求进入 Flask 之前下载图片的耗时（秒）
+PREFETCH_SECONDS_ENVIRON_KEY = 'captcha_api.prefetch_seconds'
+TIMING_MODES = ('off', 'request', 'always')
+MAX_SPANS = 256  # 单个请求最多保留的时间段（点选验证码逐框识别时可能很多）
+
+_current = contextvars.ContextVar('captcha_request_timing', default=None)
+
+
+class RequestTiming:
+    """一个请求中记录的时间段（可能由多个线程同时写入）"""
+
+    __slots__ = ('started', 'spans', 'dropped', '_lock')
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, started, elapsed):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append((name, started - self.started, elapsed))
+            else:
+                self.dropped += 1
+
+    def stages(self):
+        """按名称汇总：{名称: [总耗时, 次数]}，按首次出现的顺序"""
+        stages = {}
+        for name, _, elapsed in self.spans:
+            entry = stages.setdefault(name, [0.0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+        return stages
+
+    def server_timing(self, total):
+        """Server-Timing 响应头（毫秒）"""
+        entries = [
+            f'{name};dur={elapsed * 1000:.3f}' + (f';desc="x{count}"' if count > 1 else '')
+            for name, (elapsed, count) in self.stages().items()
+        ]
+        entries.append(f'total;dur={total * 1000:.3f}')
+        return ', '.join(entries)
+
+    def to_dict(self, total):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            'total_ms': round(total * 1000, 3),
+            'stages': {
+                name: {'duration_ms': round(elapsed * 1000, 3), 'count': count}
+                for name, (elapsed, count) in self.stages().items()
+            },
+            'spans': [
+                {'name': name, 'start_ms': round(start * 1000, 3), 'duration_ms': round(elapsed * 1000, 3)}
+                for name, start, elapsed in spans
+            ],
+            'dropped_spans': self.dropped
+        }
+
+
+def current():
+    """当前请求的耗时记录，没有时返回 None"""
+    return _current.get()
+
+
+def record(name, started, elapsed):
+    """记录一个时间段到当前请求（不在请求中或未开启时忽略）"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, started, elapsed)
+
+
+@contextmanager
+def span(name):
+    """记录一个时间段（只记录到当前请求，不计入监控指标）"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, started, time.perf_counter() - started)
+
+
+def bind(func):
+    """返回在当前上下文的副本中执行 func 的函数，用于提交到其他线程"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+class RequestTimer:
+    """请求耗时分解（参考 Flask 扩展的 init_app 用法）"""
+
+    def __init__(self):
+        self.mode = 'request'
+
+    def init_app(self, app):
+        """根据 REQUEST_TIMING 配置注册请求钩子"""
+        self.mode = app.config.get('REQUEST_TIMING', 'request')
+        if self.mode not in TIMING_MODES:
+            raise ValueError(f"REQUEST_TIMING 必须是 {'/'.join(TIMING_MODES)} 之一: {self.mode}")
+        if self.mode == 'off':
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._reset)
+
+    @staticmethod
+    def _requested():
+        value = request.headers.get('X-Timing') or request.args.get('timing')
+        return str(value).lower() in ('1', 'true')
+
+    def _start(self):
+        requested = self._requested()
+        if not requested and self.mode != 'always':
+            return
+        now = time.perf_counter()
+        prefetch = request.environ.get(PREFETCH_SECONDS_ENVIRON_KEY)
+        timing = RequestTiming(now - prefetch if prefetch else now)
+        if prefetch:
+            timing.add('fetch', timing.started, prefetch)
+        g._timing = timing
+        g._timing_requested = requested
+        g._timing_token = _current.set(timing)
+
+    def _finish(self, response):
+        timing = g.get('_timing')
+        if timing is None:
+            return response
+        total = time.perf_counter() - timing.started
+        response.headers['Server-Timing'] = timing.server_timing(total)
+        if g._timing_requested and response.is_json and not response.is_streamed:
+            data = response.get_json(silent=True)
+            if isinstance(data, dict):
+                data['timing'] = timing.to_dict(total)
+                response.set_data(current_app.json.dumps(data))
+        return response
+
+    @staticmethod
+    def _reset(exc=None):
+        token = g.pop('_timing_token', None)
+        if token is not None:
+            _current.reset(token)
+
+
+request_timer = RequestTimer()
@@ -0,0 +1,19 @@
+"""ASGI 入口（需安装 uvicorn 和 httpx）
+
+    uvicorn asgi:app --host :: --port 7777
+"""
+from app import create_app
+from app.asgi import AsgiBridge
+
+flask_app = create_app()
+app = AsgiBridge(flask_app)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=flask_app.config['HOST'],
+        port=flask_app.config['PORT'],
+        log_level=flask_app.config.get('LOG_LEVEL', 'INFO').lower()
+    )
@@ -0,0 +1,119 @@
+"""算术验证码基准
+
+- 表达式处理的单次开销：旧实现（两次 re.sub，每次调用都导入 ast/operator、重建运算符表并
+  遍历语法树）vs app.services.arithmetic（预编译正则 + 递归下降解析，分别统计未命中和命中
+  表达式缓存的情况）
+- 解码：在全部类别上 argmax vs 只在算术字符集中 argmax 的耗时
+- 端到端：合成算术验证码在两种解码方式下的正确率
+
+用法:
+    python -m benchmarks.arithmetic [--samples 100] [--repeat 2000]
+"""
+import argparse
+import re
+import time
+import warnings
+
+import ddddocr
+
+from app.services import arithmetic
+from app.services.ocr_engine import BatchOcrEngine
+from app.utils.image_processor import DecodedImage
+from benchmarks import fixtures
+
+EXPRESSIONS = ['3+5=?', '9*8-?', '12-7=?', '(4+6)/2=', '7x3=?', '8÷2=?']
+
+
+def legacy_solve(text):
+    """旧实现（CaptchaService.calculate 中的清理和 _safe_eval）"""
+    import ast
+    import operator
+
+    expression = re.sub('=.*', '', text)
+    expression = re.sub('[^0-9+\\-*/().]', '', expression)
+    if not expression:
+        return None
+    operators = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.USub: operator.neg,
+    }
+
+    def eval_node(node):
+        if isinstance(node, ast.Num):
+            return node.n
+        elif isinstance(node, ast.BinOp):
+            return operators[type(node.op)](eval_node(node.left), eval_node(node.right))
+        elif isinstance(node, ast.UnaryOp):
+            return operators[type(node.op)](eval_node(node.operand))
+        raise ValueError(f"不支持的表达式类型: {type(node)}")
+
+    try:
+        result = eval_node(ast.parse(expression, mode='eval').body)
+        return int(result) if isinstance(result, float) and result.is_integer() else result
+    except Exception:
+        return None
+
+
+def new_solve(text):
+    try:
+        return arithmetic.solve(text)
+    except ValueError:
+        return None
+
+
+def new_solve_cold(text):
+    arithmetic.evaluate.cache_clear()
+    return new_solve(text)
+
+
+def per_call(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in EXPRESSIONS:
+            func(text)
+    return (time.perf_counter() - started) / (repeat * len(EXPRESSIONS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', DeprecationWarning)  # 旧实现使用的 ast.Num
+    print('expression (per call)')
+    per_call(legacy_solve, args.repeat // 10)  # 预热
+    base = None
+    for name, func in (('legacy', legacy_solve), ('parser', new_solve_cold), ('parser cached', new_solve)):
+        elapsed = per_call(func, args.repeat)
+        base = base or elapsed
+        print(f"{name:>16} {elapsed * 1e6:>8.2f}us {base / elapsed:>6.1f}x")
+
+    ocr = ddddocr.DdddOcr(show_ad=False)
+    batch_ocr = BatchOcrEngine(ocr)
+    allowed = batch_ocr.allowed_indices(arithmetic.CHARSET)
+    samples = fixtures.generate('arithmetic', args.samples, args.seed)
+    logits = [batch_ocr.run([batch_ocr.prepare(DecodedImage(s['image']).gray)]) for s in samples]
+
+    print('decode (per image)')
+    for name, decode in (
+        ('full charset', lambda x: batch_ocr.decode(x.argmax(axis=-1))),
+        ('arithmetic', lambda x: batch_ocr.decode(allowed[x[:, :, allowed].argmax(axis=-1)])),
+    ):
+        started = time.perf_counter()
+        texts = [decode(x)[0] for x in logits]
+        elapsed = (time.perf_counter() - started) / len(logits)
+        correct = sum(legacy_solve(t) == s['answer'] for t, s in zip(texts, samples))
+        solved = sum(new_solve(t) == s['answer'] for t, s in zip(texts, samples))
+        print(
+            f"{name:>16} {elapsed * 1e6:>8.2f}us  accuracy legacy {correct / len(samples):.0%}, "
+            f"arithmetic.solve {solved / len(samples):.0%}"
+        )
+
+
+if __name__ == '__main__':
+    main()
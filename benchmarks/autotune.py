@@ -0,0 +1,427 @@
+"""部署参数调优
+
+在当前机器上测量后给出 WORKERS、WORKER_CLASS、INFERENCE_POOL_SIZE 和 ORT_INTRA_OP_THREADS
+的建议值，可以直接写成 .env 文件（docker-compose 的 env_file，gunicorn.conf.py 读取）。
+
+测量（合成样本，关闭限流、结果缓存和准入控制）：
+1. 内存：与 gunicorn 的 preload_app 相同，在当前进程中创建应用并预加载模型（master），
+   再 fork 出一个 worker 依次调用每个接口，统计 worker 独占的内存（/proc/<pid>/smaps_rollup
+   的 Private_*，包括写时复制的页和推理时分配的内存），即每增加一个 worker 需要的内存
+2. CPU：worker 中单线程、intra-op 线程数为 1 依次请求每个接口，记录每个请求的 CPU 时间、
+   耗时和其中的推理时间（onnxruntime 推理期间释放 GIL，其余时间需要持有 GIL）
+3. --sweep：按候选的 worker 数 * 推理线程数启动多个进程（每个进程独立创建应用，
+   模拟 gunicorn worker）并发请求 --mix 中的接口，测量实际吞吐量
+
+建议值的计算：
+- 所有 worker 同时推理的线程数 = CPU 核数（每个推理 1 个 intra-op 线程时吞吐量最高，
+  见 benchmarks/ort_sweep.py）
+- 每个 worker 中需要持有 GIL 的部分（解码、预处理、序列化）最多占满 1 个核，
+  worker 数至少为 CPU 核数 * GIL 占比；再受 (内存预算 - master 内存) / 每个 worker 内存 限制
+- 每个 worker 的推理线程数不超过 1 / GIL 占比（更多的线程只会等待 GIL），worker 数受内存限制
+  而不足时，剩余的核分给 intra-op 线程
+- 指定 --sweep 时改用实测吞吐量最高的组合
+
+用法:
+    python -m benchmarks.autotune
+    python -m benchmarks.autotune --memory-budget 2048 --mix classification=8,select=1 --env-file tuning.env
+    python -m benchmarks.autotune --sweep --duration 10 --json results/tune.json
+"""
+import argparse
+import gc
+import json
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from benchmarks import fixtures
+from benchmarks.suite import CASES, _batch_payload, _rss_bytes
+
+CASES_BY_NAME = {case.name: case for case in CASES}
+# 推理期间释放 GIL 的耗时分解名称（点选验证码为 detect / recognize）
+INFERENCE_SPANS = ('inference', 'detect', 'recognize')
+# 每个 worker 的内存余量（max_requests 重启前的碎片、自定义模型等）
+MEMORY_HEADROOM = 1.25
+# 压测时关闭会影响测量的功能
+TUNE_ENV = {
+    'RATELIMIT_ENABLED': 'False',
+    'RESULT_CACHE_ENABLED': 'False',
+    'ADMISSION_ENABLED': 'False',
+    'JOB_QUEUE_ENABLED': 'False',
+    'MODEL_WARMUP': 'ocr,batch_ocr,det',
+}
+
+
+def _private_bytes(pid):
+    """进程独占的内存（fork 后未与父进程共享的页），无法读取 smaps_rollup 时为 RSS"""
+    try:
+        total = 0
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    total += int(line.split()[1]) * 1024
+        return total
+    except (OSError, ValueError):
+        return _rss_bytes(pid)
+
+
+def memory_budget():
+    """可用内存：cgroup 内存上限（容器中），否则为 MemAvailable"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def parse_mix(value):
+    """解析 --mix（如 classification=8,select=1），返回 {接口名: 权重}"""
+    mix = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in CASES_BY_NAME:
+            raise ValueError(f"未知接口: {name}，可选 {','.join(CASES_BY_NAME)}")
+        mix[name] = float(weight) if weight else 1.0
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError('--mix 至少包含一个权重大于 0 的接口')
+    return mix
+
+
+def _payload(case, samples, index):
+    if case.build is None:
+        return _batch_payload(samples, index)
+    return case.build(samples[index % len(samples)])
+
+
+def _tune_config():
+    """测量单个请求成本用的配置：单个推理线程、intra-op 线程数为 1，不合并请求"""
+    from app.config import Config
+
+    class TuneConfig(Config):
+        RATELIMIT_ENABLED = False
+        RESULT_CACHE_ENABLED = False
+        ADMISSION_ENABLED = False
+        JOB_QUEUE_ENABLED = False
+        MODEL_WARMUP = TUNE_ENV['MODEL_WARMUP']
+        # 跨请求批处理在独立线程中推理，推理时间无法计入请求的耗时分解
+        MICRO_BATCH_ENABLED = False
+        INFERENCE_POOL_SIZE = 1
+        ORT_INTRA_OP_THREADS = 1
+        REQUEST_TIMING = 'request'
+
+    return TuneConfig
+
+
+def _profile_endpoints(app, names, requests, seed):
+    """依次请求每个接口，返回每个请求的平均 CPU 时间、耗时和推理时间（毫秒）"""
+    client = app.test_client()
+    results = {}
+    samples = {}
+    for name in names:
+        case = CASES_BY_NAME[name]
+        if case.kind not in samples:
+            samples[case.kind] = fixtures.generate(case.kind, 16, seed)
+        for index in range(2):  # 预热（首次推理时分配内存）
+            client.post(case.path, json=_payload(case, samples[case.kind], index))
+        cpu = wall = inference = 0.0
+        failed = 0
+        for index in range(requests):
+            payload = _payload(case, samples[case.kind], index)
+            cpu_started, started = time.process_time(), time.perf_counter()
+            response = client.post(case.path, json=payload, headers={'X-Timing': '1'})
+            wall += time.perf_counter() - started
+            cpu += time.process_time() - cpu_started
+            body = response.get_json(silent=True) or {}
+            if response.status_code != 200:
+                failed += 1
+            stages = (body.get('timing') or {}).get('stages', {})
+            inference += sum(stages.get(span, {}).get('duration_ms', 0) for span in INFERENCE_SPANS) / 1000
+        results[name] = {
+            'cpu_ms': round(cpu / requests * 1000, 3),
+            'wall_ms': round(wall / requests * 1000, 3),
+            'inference_ms': round(inference / requests * 1000, 3),
+            'failed': failed,
+        }
+    return results
+
+
+def profile(names, requests, seed):
+    """
+    按 preload_app 的方式创建应用后 fork 一个 worker 测量接口成本和 worker 内存
+
+    Returns:
+        dict: {'master_rss_mb', 'worker_private_mb', 'worker_rss_mb', 'endpoints'}
+    """
+    from app import create_app
+
+    app = create_app(_tune_config())
+    gc.collect()
+    gc.freeze()  # 与 gunicorn.conf.py 的 when_ready 相同
+    master_rss = _rss_bytes(os.getpid())
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            endpoints = _profile_endpoints(app, names, requests, seed)
+            result = {
+                'endpoints': endpoints,
+                'worker_private_mb': round(_private_bytes(os.getpid()) / 1024 / 1024, 1),
+                'worker_rss_mb': round(_rss_bytes(os.getpid()) / 1024 / 1024, 1),
+            }
+        except Exception as e:
+            result = {'error': f"{type(e).__name__}: {e}"}
+            status = 1
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(result, f)
+        os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    result = json.loads(data) if data else {'error': 'worker 异常退出'}
+    if 'error' in result:
+        raise RuntimeError(f"测量失败: {result['error']}")
+    result['master_rss_mb'] = round(master_rss / 1024 / 1024, 1)
+    return result
+
+
+def weighted_cost(endpoints, mix):
+    """按接口比例加权的单个请求 CPU 时间（毫秒）和推理时间占比"""
+    total = sum(mix.values())
+    cpu = sum(endpoints[name]['cpu_ms'] * weight for name, weight in mix.items()) / total
+    wall = sum(endpoints[name]['wall_ms'] * weight for name, weight in mix.items())
+    inference = sum(endpoints[name]['inference_ms'] * weight for name, weight in mix.items())
+    return cpu, min(1.0, inference / wall) if wall else 0.0
+
+
+def _worker_class():
+    """gevent 已安装时使用 gevent worker（推理在系统线程中执行），否则使用 gthread"""
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        return 'gthread'
+    return 'gevent'
+
+
+def recommend(result, mix, cores, budget_mb):
+    """根据测量结果计算建议的部署参数"""
+    cpu_ms, inference_share = weighted_cost(result['endpoints'], mix)
+    gil_share = max(0.0, 1.0 - inference_share)
+    worker_mb = result['worker_private_mb'] * MEMORY_HEADROOM
+    max_workers = int((budget_mb - result['master_rss_mb']) // worker_mb) if worker_mb else cores
+    notes = []
+    if max_workers < 1:
+        notes.append(f"内存预算 {budget_mb:.0f}MB 不足以运行 1 个 worker（master {result['master_rss_mb']}MB"
+                     f" + worker {worker_mb:.0f}MB），仍按 1 个 worker 计算")
+        max_workers = 1
+
+    # 持有 GIL 的部分在每个 worker 中最多占满 1 个核
+    workers = min(cores, max_workers, max(1, math.ceil(cores * gil_share)))
+    if workers < max(1, math.ceil(cores * gil_share)):
+        notes.append(f"worker 数受内存限制（最多 {max_workers} 个），Python 部分可能无法用满 CPU")
+    # 每个 worker 中超过 1 / GIL 占比的推理线程只会等待 GIL，剩余的核由 intra-op 线程使用
+    threads_per_worker = math.ceil(1 / gil_share) if gil_share > 0 else cores
+    pool_size = max(1, min(math.ceil(cores / workers), threads_per_worker))
+    intra_op_threads = max(1, cores // (workers * pool_size))
+    worker_class = _worker_class()
+    config = {
+        'WORKERS': workers,
+        'WORKER_CLASS': worker_class,
+        'INFERENCE_POOL_SIZE': pool_size,
+        'ORT_INTRA_OP_THREADS': intra_op_threads,
+    }
+    if worker_class == 'gthread':
+        # gthread 每个线程处理一个连接，等待推理的请求也占用线程
+        config['WORKER_THREADS'] = pool_size * 4
+    return {
+        'config': config,
+        'estimated_memory_mb': round(result['master_rss_mb'] + workers * result['worker_private_mb'], 1),
+        'estimated_max_rps': round(cores * 1000 / cpu_ms, 1) if cpu_ms else None,
+        'mix_cpu_ms': round(cpu_ms, 3),
+        'gil_share': round(gil_share, 3),
+        'max_workers_by_memory': max_workers,
+        'notes': notes,
+    }
+
+
+def _sweep_worker(env, mix, pool_size, seed, ready, start, deadline_queue, results):
+    """--sweep 的一个进程（spawn 启动，导入应用前设置环境变量，Config 在导入时读取）"""
+    os.environ.update(env)
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    from app import create_app
+    app = create_app()
+    names = [name for name, weight in mix.items() for _ in range(max(1, round(weight)))]
+    samples = {}
+    for name in set(names):
+        kind = CASES_BY_NAME[name].kind
+        samples.setdefault(kind, fixtures.generate(kind, 16, seed))
+    ready.release()
+    start.wait()
+    deadline = deadline_queue.get()
+    counts = []
+
+    def client_loop(offset):
+        client = app.test_client()
+        count = index = 0
+        while time.time() < deadline:
+            case = CASES_BY_NAME[names[(offset + index) % len(names)]]
+            response = client.post(case.path, json=_payload(case, samples[case.kind], index))
+            index += 1
+            if response.status_code == 200:
+                count += 1
+        counts.append(count)
+
+    # 每个推理线程配 2 个并发请求，保证推理线程一直有任务
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(pool_size * 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(sum(counts))
+
+
+def measure_config(workers, pool_size, intra_op_threads, mix, duration, seed):
+    """启动 workers 个进程测量一个组合的吞吐量（requests/s）"""
+    context = multiprocessing.get_context('spawn')
+    env = dict(TUNE_ENV, WORKERS=str(workers), INFERENCE_POOL_SIZE=str(pool_size),
+               ORT_INTRA_OP_THREADS=str(intra_op_threads))
+    ready, start = context.Semaphore(0), context.Event()
+    deadline_queue, results = context.Queue(), context.Queue()
+    processes = [
+        context.Process(target=_sweep_worker,
+                        args=(env, mix, pool_size, seed, ready, start, deadline_queue, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            # 创建应用和加载模型
+            if not ready.acquire(timeout=300):
+                raise RuntimeError('worker 启动超时')
+        deadline = time.time() + duration
+        for _ in processes:
+            deadline_queue.put(deadline)
+        start.set()
+        total = sum(results.get(timeout=duration + 120) for _ in processes)
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+    return total / duration
+
+
+def sweep_candidates(cores, max_workers):
+    """候选组合：worker 数 * 推理线程数在 CPU 核数附近"""
+    candidates = set()
+    for workers in range(1, min(cores, max_workers) + 1):
+        for pool_size in {max(1, cores // workers), math.ceil(cores / workers), math.ceil(cores / workers) + 1}:
+            candidates.add((workers, pool_size, max(1, cores // (workers * pool_size))))
+    return sorted(candidates)
+
+
+def env_file(recommendation, result, cores, budget_mb):
+    """生成 .env 片段"""
+    lines = [
+        f"# benchmarks.autotune {time.strftime('%Y-%m-%d %H:%M:%S')}：{cores} 核，内存预算 {budget_mb:.0f}MB，"
+        f"master {result['master_rss_mb']}MB + 每个 worker {result['worker_private_mb']}MB",
+    ]
+    lines += [f"{name}={value}" for name, value in recommendation['config'].items()]
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memory-budget', type=float, default=0,
+                        help='所有 worker 可用的内存（MB），默认为 cgroup 上限或 MemAvailable 的 80%%')
+    parser.add_argument('--cores', type=int, default=0, help='可用的 CPU 核数（默认为当前进程可用的核数）')
+    parser.add_argument('--mix', default=','.join(case.name for case in CASES if case.name != 'crop'),
+                        help='线上各接口的请求比例，如 classification=8,select=1（默认各接口相同）')
+    parser.add_argument('--requests', type=int, default=20, help='测量每个接口成本的请求数')
+    parser.add_argument('--sweep', action='store_true', help='实际启动多个进程测量候选组合的吞吐量')
+    parser.add_argument('--duration', type=float, default=5, help='--sweep 每个组合的压测时长（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env-file', metavar='PATH', help='建议值写入该文件（.env 格式）')
+    parser.add_argument('--json', metavar='PATH', help='测量结果保存为 JSON')
+    args = parser.parse_args()
+
+    # 不在模块顶层导入应用：--sweep 的子进程需要先设置环境变量再导入 app.config
+    from app.services.runtime import cpu_count
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    cores = args.cores or cpu_count()
+    budget_mb = args.memory_budget or memory_budget() * 0.8 / 1024 / 1024
+
+    result = profile(list(mix), args.requests, args.seed)
+    print(f"cpu cores: {cores}  memory budget: {budget_mb:.0f}MB")
+    print(f"master rss: {result['master_rss_mb']}MB  worker private: {result['worker_private_mb']}MB "
+          f"(rss {result['worker_rss_mb']}MB)")
+    print(f"{'endpoint':>22} {'cpu':>9} {'wall':>9} {'inference':>10} {'max rps':>8}")
+    for name, entry in result['endpoints'].items():
+        max_rps = cores * 1000 / entry['cpu_ms'] if entry['cpu_ms'] else 0
+        print(f"{name:>22} {entry['cpu_ms']:>7.2f}ms {entry['wall_ms']:>7.2f}ms {entry['inference_ms']:>8.2f}ms "
+              f"{max_rps:>8.1f}" + (f"  ({entry['failed']} failed)" if entry['failed'] else ''))
+
+    recommendation = recommend(result, mix, cores, budget_mb)
+    if args.sweep:
+        sweep = []
+        print(f"\n{'workers':>7} {'pool':>4} {'intra':>5} {'rps':>8}")
+        for workers, pool_size, intra in sweep_candidates(cores, recommendation['max_workers_by_memory']):
+            rps = measure_config(workers, pool_size, intra, mix, args.duration, args.seed)
+            sweep.append({'workers': workers, 'pool_size': pool_size, 'intra_op_threads': intra, 'rps': round(rps, 2)})
+            print(f"{workers:>7} {pool_size:>4} {intra:>5} {rps:>8.2f}")
+        best = max(sweep, key=lambda entry: entry['rps'])
+        recommendation['config'].update(
+            WORKERS=best['workers'], INFERENCE_POOL_SIZE=best['pool_size'], ORT_INTRA_OP_THREADS=best['intra_op_threads']
+        )
+        recommendation['estimated_memory_mb'] = round(
+            result['master_rss_mb'] + best['workers'] * result['worker_private_mb'], 1
+        )
+        recommendation['sweep'] = sweep
+
+    print(f"\nmix cpu/request: {recommendation['mix_cpu_ms']}ms  GIL share: {recommendation['gil_share']:.0%}  "
+          f"estimated max: {recommendation['estimated_max_rps']} req/s  "
+          f"estimated memory: {recommendation['estimated_memory_mb']}MB")
+    for note in recommendation['notes']:
+        print(f"注意: {note}")
+    content = env_file(recommendation, result, cores, budget_mb)
+    print('\n' + content, end='')
+
+    if args.env_file:
+        with open(args.env_file, 'w') as f:
+            f.write(content)
+        print(f"建议值已保存: {args.env_file}", file=sys.stderr)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({'cores': cores, 'memory_budget_mb': round(budget_mb, 1), 'mix': mix,
+                       'profile': result, 'recommendation': recommendation}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
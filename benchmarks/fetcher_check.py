@@ -0,0 +1,213 @@
+"""图片下载器检查
+
+在本地线程中启动一个 http.server 作为图片源，检查 ImageFetcher 的以下行为：
+
+- ETag：no-cache 的响应被缓存，再次下载时发送 If-None-Match，收到 304 后返回缓存内容
+- max-age：有效期内直接命中缓存不发请求，过期后重新下载
+- 并发：fetch_many（以及安装了 httpx 时的 fetch_many_async）并发下载多个 URL，结果顺序与输入一致
+- host 上限：超过 max_hosts 的 host 合并统计为 other，Session 数量不超过上限，
+  正在使用的 Session 被淘汰后等使用结束才关闭
+- 响应体缓冲区：长度未知时扩容的缓冲区返回与内容等长的 bytes（缓存大小按实际占用计算）
+
+任何一项不符合预期时以非零状态码退出。
+
+用法:
+    python -m benchmarks.fetcher_check
+"""
+import asyncio
+import http.server
+import sys
+import threading
+import time
+
+from app.utils.fetcher import OTHER_HOST, ImageFetcher, _BodyBuffer
+
+MAX_SIZE = 5 * 1024 * 1024
+TIMEOUT = 5
+SLOW_DELAY = 0.3
+
+
+class _Origin:
+    """图片源的请求计数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.not_modified = 0
+        self.active = 0
+        self.max_active = 0
+
+    def count(self, path):
+        with self.lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+
+
+def make_handler(origin):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            path = self.path
+            origin.count(path)
+            body = path.encode() * 64
+            if path.startswith('/etag'):
+                etag = '"v1"'
+                if self.headers.get('If-None-Match') == etag:
+                    with origin.lock:
+                        origin.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self._send(body, {'ETag': etag, 'Cache-Control': 'no-cache'})
+            elif path.startswith('/max-age'):
+                self._send(body, {'Cache-Control': 'max-age=1'})
+            elif path.startswith('/slow'):
+                with origin.lock:
+                    origin.active += 1
+                    origin.max_active = max(origin.max_active, origin.active)
+                time.sleep(SLOW_DELAY)
+                with origin.lock:
+                    origin.active -= 1
+                self._send(body, {'Cache-Control': 'no-store'})
+            else:
+                self._send(body, {'Cache-Control': 'no-store'})
+
+        def _send(self, body, headers):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_origin():
+    origin = _Origin()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), make_handler(origin))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, origin
+
+
+class Checker:
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, name, ok, detail=''):
+        print(f"{'OK  ' if ok else 'FAIL'} {name}{f': {detail}' if detail else ''}")
+        if not ok:
+            self.failures += 1
+
+
+def check_etag(checker, fetcher, base, origin):
+    url = f'{base}/etag.png'
+    first = bytes(fetcher.fetch(url, MAX_SIZE, TIMEOUT))
+    second = bytes(fetcher.fetch(url, MAX_SIZE, TIMEOUT))
+    checker.check('etag: 重新验证返回缓存内容', first == second == b'/etag.png' * 64)
+    checker.check('etag: 第二次请求收到 304', origin.not_modified == 1, f'304 次数 {origin.not_modified}')
+
+
+def check_max_age(checker, fetcher, base, origin):
+    url = f'{base}/max-age.png'
+    fetcher.fetch(url, MAX_SIZE, TIMEOUT)
+    fetcher.fetch(url, MAX_SIZE, TIMEOUT)
+    hits = origin.hits.get('/max-age.png', 0)
+    checker.check('max-age: 有效期内命中缓存', hits == 1, f'源站请求 {hits} 次')
+    time.sleep(1.1)
+    fetcher.fetch(url, MAX_SIZE, TIMEOUT)
+    hits = origin.hits.get('/max-age.png', 0)
+    checker.check('max-age: 过期后重新下载', hits == 2, f'源站请求 {hits} 次')
+
+
+def check_concurrency(checker, fetcher, base, origin):
+    urls = [f'{base}/slow/{i}.png' for i in range(fetcher.concurrency)]
+    started = time.perf_counter()
+    contents = fetcher.fetch_many(urls, MAX_SIZE, TIMEOUT)
+    elapsed = time.perf_counter() - started
+    expected = [f'/slow/{i}.png'.encode() * 64 for i in range(len(urls))]
+    checker.check('fetch_many: 结果顺序与输入一致', [bytes(c) for c in contents] == expected)
+    checker.check(
+        'fetch_many: 并发下载', elapsed < SLOW_DELAY * len(urls) / 2,
+        f'{len(urls)} 个 URL 耗时 {elapsed:.2f}s，源站最大并发 {origin.max_active}'
+    )
+
+    try:
+        import httpx  # noqa: F401 可选依赖，仅 ASGI 模式需要
+    except ImportError:
+        print('SKIP fetch_many_async: 未安装 httpx')
+        return
+
+    async def run_async():
+        try:
+            return await fetcher.fetch_many_async(urls, MAX_SIZE, TIMEOUT)
+        finally:
+            await fetcher.aclose()
+
+    origin.max_active = 0
+    started = time.perf_counter()
+    contents = asyncio.run(run_async())
+    elapsed = time.perf_counter() - started
+    checker.check('fetch_many_async: 结果顺序与输入一致', [bytes(c) for c in contents] == expected)
+    checker.check(
+        'fetch_many_async: 并发下载', elapsed < SLOW_DELAY * len(urls) / 2,
+        f'{len(urls)} 个 URL 耗时 {elapsed:.2f}s，源站最大并发 {origin.max_active}'
+    )
+
+
+def check_host_limit(checker, fetcher):
+    fetcher.max_hosts = 4
+    labels = set()
+    closed = []
+    with fetcher._session('img0.example.com') as held:
+        held.close = lambda: closed.append(held)
+        for i in range(20):
+            host = f'img{i}.example.com'
+            labels.add(fetcher._host_label(host))
+            with fetcher._session(host):
+                pass
+        checker.check('host 上限: 使用中的 Session 被淘汰时不关闭', not closed)
+    checker.check('host 上限: 被淘汰的 Session 在使用结束后关闭', closed == [held])
+    checker.check(
+        'host 上限: 超出的 host 合并为 other',
+        len(labels) <= fetcher.max_hosts + 1 and OTHER_HOST in labels, f'统计 host 数 {len(labels)}'
+    )
+    checker.check('host 上限: Session 数不超过上限', len(fetcher._sessions) <= fetcher.max_hosts)
+
+
+def check_body_buffer(checker):
+    body = _BodyBuffer('', MAX_SIZE, chunk_size=1024)
+    for _ in range(3):
+        body.write(b'x' * 1000)
+    content = body.getvalue()
+    checker.check('缓冲区: 扩容后返回等长的内容', len(content) == 3000 and bytes(content) == b'x' * 3000,
+                  f'{type(content).__name__} {len(content)}')
+    exact = _BodyBuffer('3000', MAX_SIZE)
+    exact.write(b'x' * 3000)
+    checker.check('缓冲区: Content-Length 准确时不复制', isinstance(exact.getvalue(), memoryview))
+
+
+def main():
+    server, origin = start_origin()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    checker = Checker()
+    try:
+        check_etag(checker, ImageFetcher(), base, origin)
+        check_max_age(checker, ImageFetcher(), base, origin)
+        check_concurrency(checker, ImageFetcher(), base, origin)
+        check_host_limit(checker, ImageFetcher())
+        check_body_buffer(checker)
+    finally:
+        server.shutdown()
+    sys.exit(1 if checker.failures else 0)
+
+
+if __name__ == '__main__':
+    main()
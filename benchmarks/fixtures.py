@@ -0,0 +1,190 @@
+"""合成验证码样本
+
+在本地生成各识别接口使用的验证码图片，不依赖外部文件和网络；同一个随机种子生成的
+样本完全相同，便于在不同提交之间对比基准结果。每个样本是一个 dict，image 等字段为 PNG
+字节流，其余字段是用于检查识别结果的标准答案。
+
+- text: 4~6 位字母数字的文字验证码（/classification、/batch/classification）
+- arithmetic: "3+5=?" 形式的算术验证码（/calculate）
+- slider: 滑块和带缺口的背景图（/capcode、/slideComparison、/crop）
+- slider_strip: 带透明通道、与背景同高的异形滑块条（/capcode）
+- click: 多个分散文字的点选验证码（/select、/detection）
+"""
+import io
+import random
+import string
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+FONT_NAMES = ('DejaVuSans.ttf', 'DejaVuSerif.ttf', 'DejaVuSans-Bold.ttf')
+TEXT_CHARS = string.ascii_lowercase + string.digits
+CLICK_CHARS = 'ABCDEFGHJKLMNPQRTUVWXY2345678'
+SLIDER_SIZE = 50
+
+
+def _font(rng, size):
+    try:
+        return ImageFont.truetype(rng.choice(FONT_NAMES), size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _noise(rng, draw, size, lines=3, points=60):
+    width, height = size
+    for _ in range(lines):
+        draw.line(
+            [(rng.randrange(width), rng.randrange(height)), (rng.randrange(width), rng.randrange(height))],
+            fill=tuple(rng.randint(100, 200) for _ in range(3)), width=1
+        )
+    for _ in range(points):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+
+
+def render_text(text, rng=None, size=(120, 40)):
+    """
+    生成文字验证码
+
+    Returns:
+        bytes: PNG 图片
+    """
+    rng = rng or random.Random()
+    image = Image.new('RGB', size, tuple(rng.randint(210, 245) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    _noise(rng, draw, size)
+    font = _font(rng, rng.randint(24, 28))
+    x = rng.randint(2, 8)
+    for char in text:
+        draw.text((x, rng.randint(0, 6)), char, fill=tuple(rng.randint(10, 80) for _ in range(3)), font=font)
+        x += font.getlength(char) + rng.randint(0, 3)
+    return _png(image)
+
+
+def text_captcha(rng):
+    """文字验证码：{'image', 'text'}"""
+    text = ''.join(rng.choices(TEXT_CHARS, k=rng.randint(4, 6)))
+    return {'image': render_text(text, rng), 'text': text}
+
+
+def arithmetic_captcha(rng):
+    """算术验证码：{'image', 'answer'}"""
+    a, b = rng.randint(1, 9), rng.randint(1, 9)
+    op = rng.choice('+-*')
+    answer = {'+': a + b, '-': a - b, '*': a * b}[op]
+    return {'image': render_text(f'{a}{op}{b}=?', rng, size=(130, 40)), 'answer': answer}
+
+
+def _slider_background(rng, size):
+    width, height = size
+    background = Image.new('RGB', size)
+    draw = ImageDraw.Draw(background)
+    for y in range(height):
+        shade = int(80 + 120 * y / height)
+        draw.line([(0, y), (width, y)], fill=(shade, rng.randint(100, 160), 255 - shade))
+    for _ in range(25):
+        x, y, r = rng.randrange(width), rng.randrange(height), rng.randint(5, 25)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    return background.filter(ImageFilter.GaussianBlur(1))
+
+
+def slider_captcha(rng, size=(300, 150)):
+    """
+    滑块验证码
+
+    Returns:
+        dict: sliding 滑块，back 带缺口的背景，full 无缺口的背景，
+              combined 滑块在上、背景在下的拼接图，split_y 拼接处的 y 坐标，target_x 缺口中心的 x 坐标
+    """
+    width, height = size
+    background = _slider_background(rng, size)
+
+    x = rng.randint(SLIDER_SIZE + 20, width - SLIDER_SIZE - 10)
+    y = rng.randint(10, height - SLIDER_SIZE - 10)
+    box = (x, y, x + SLIDER_SIZE, y + SLIDER_SIZE)
+    piece = background.crop(box)
+
+    # 缺口：半透明的暗色区域
+    hole = background.copy()
+    hole.paste(Image.eval(piece, lambda v: v // 2 + 30), box)
+
+    # /crop 使用的上下拼接图：上半部分为滑块（按背景宽度补齐），下半部分为背景
+    combined = Image.new('RGB', (width, SLIDER_SIZE + height), (255, 255, 255))
+    combined.paste(piece, (0, 0))
+    combined.paste(hole, (0, SLIDER_SIZE))
+    return {
+        'sliding': _png(piece),
+        'back': _png(hole),
+        'full': _png(background),
+        'combined': _png(combined),
+        'split_y': SLIDER_SIZE,
+        'target_x': x + SLIDER_SIZE // 2
+    }
+
+
+def slider_strip_captcha(rng, size=(300, 150)):
+    """
+    整列滑块条：滑块图为 RGBA、与背景同高，只有滑块所在区域不透明（方块加右侧凸起）
+
+    Returns:
+        dict: sliding 滑块条，back 带缺口的背景，target_x / target_y 缺口中心坐标
+    """
+    width, height = size
+    background = _slider_background(rng, size)
+    mask = Image.new('L', (SLIDER_SIZE, SLIDER_SIZE), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.rectangle((0, 8, SLIDER_SIZE - 10, SLIDER_SIZE - 1), fill=255)
+    draw.ellipse((SLIDER_SIZE - 18, 20, SLIDER_SIZE - 1, 37), fill=255)
+
+    x = rng.randint(SLIDER_SIZE + 20, width - SLIDER_SIZE - 10)
+    y = rng.randint(2, height - SLIDER_SIZE - 2)
+    box = (x, y, x + SLIDER_SIZE, y + SLIDER_SIZE)
+    piece = background.crop(box)
+
+    strip = Image.new('RGBA', (SLIDER_SIZE, height), (0, 0, 0, 0))
+    strip.paste(piece, (0, y), mask)
+    hole = background.copy()
+    hole.paste(Image.eval(piece, lambda v: v // 2 + 30), box, mask)
+    return {
+        'sliding': _png(strip),
+        'back': _png(hole),
+        'target_x': x + SLIDER_SIZE // 2,
+        'target_y': y + (8 + SLIDER_SIZE) // 2
+    }
+
+
+def click_captcha(rng, size=(340, 160)):
+    """点选验证码：{'image', 'chars'}"""
+    width, height = size
+    image = Image.new('RGB', size, tuple(rng.randint(180, 250) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    _noise(rng, draw, size, lines=4, points=200)
+    count = rng.randint(3, 5)
+    slot = width // count
+    chars = rng.sample(CLICK_CHARS, count)
+    for i, char in enumerate(chars):
+        font = _font(rng, rng.randint(32, 42))
+        draw.text(
+            (i * slot + rng.randint(4, max(5, slot - 48)), rng.randint(5, height - 55)),
+            char, fill=tuple(rng.randint(0, 90) for _ in range(3)), font=font
+        )
+    return {'image': _png(image), 'chars': chars}
+
+
+GENERATORS = {
+    'text': text_captcha,
+    'arithmetic': arithmetic_captcha,
+    'slider': slider_captcha,
+    'slider_strip': slider_strip_captcha,
+    'click': click_captcha,
+}
+
+
+def generate(kind, count, seed=0):
+    """生成 count 个指定类型的样本（同一 seed 结果相同）"""
+    rng = random.Random(f'{kind}:{seed}')
+    return [GENERATORS[kind](rng) for _ in range(count)]
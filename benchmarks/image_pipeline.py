@@ -0,0 +1,137 @@
+"""图片处理流水线基准
+
+对比旧实现（每个阶段都以 PNG 字节流交接：预处理后重新编码、ddddocr 再解码，
+点选验证码的每个裁剪区域都编码一次 PNG）与新实现（每个请求只解码一次，
+后续阶段直接传递数组）的耗时；点选验证码另外对比逐个识别与交给批量识别引擎
+（缩放后同宽的裁剪区域合并为一次推理），检查两者的识别结果是否完全一致，
+并输出实际的推理次数。
+图片在脚本中合成，不依赖外部文件。
+
+用法:
+    python -m benchmarks.image_pipeline [--repeat 30]
+"""
+import argparse
+import time
+
+import cv2
+import ddddocr
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from app.services.detection import detect_bboxes
+from app.services.ocr_engine import BatchOcrEngine
+from app.utils.image_processor import DecodedImage, preprocess_image
+
+
+def make_image(text, size, positions):
+    """合成带文字的验证码图片，返回 PNG 字节流"""
+    image = Image.new('RGB', size, (200, 220, 240))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype('DejaVuSans.ttf', 36)
+    except OSError:
+        font = ImageFont.load_default()
+    for char, position in zip(text, positions):
+        draw.text(position, char, fill=(20, 20, 20), font=font)
+    _, buffer = cv2.imencode('.png', cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR))
+    return buffer.tobytes()
+
+
+def classify_legacy(ocr, image_bytes):
+    """旧实现：预处理 -> PNG 编码 -> ddddocr 解码识别"""
+    return ocr.classification(preprocess_image(image_bytes, enhance=True, denoise=True))
+
+
+def classify_decoded(ocr, image_bytes):
+    """新实现：解码一次，预处理结果直接以灰度数组送入模型"""
+    image = DecodedImage(image_bytes).preprocess(enhance=True, denoise=True)
+    return ocr.classification(image.gray)
+
+
+def select_legacy(det, ocr, image_bytes):
+    """旧实现：检测时再解码一次，每个裁剪区域编码为 PNG 后识别"""
+    im = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    texts = []
+    for x1, y1, x2, y2 in det.detection(image_bytes):
+        _, buffer = cv2.imencode('.png', im[y1:y2, x1:x2])
+        texts.append(ocr.classification(buffer.tobytes()))
+    return texts
+
+
+def select_decoded(det, ocr, image_bytes):
+    """新实现：检测和识别共用一次解码的数组"""
+    image = DecodedImage(image_bytes)
+    gray = image.gray
+    return [
+        ocr.classification(np.ascontiguousarray(gray[y1:y2, x1:x2]))
+        for x1, y1, x2, y2 in detect_bboxes(det, image.bgr)
+    ]
+
+
+def select_batched(det, batch_ocr, image_bytes):
+    """新实现：所有裁剪区域交给批量识别引擎（同宽的合并推理）"""
+    image = DecodedImage(image_bytes)
+    gray = image.gray
+    crops = [batch_ocr.prepare(gray[y1:y2, x1:x2]) for x1, y1, x2, y2 in detect_bboxes(det, image.bgr)]
+    return batch_ocr.recognize(crops)
+
+
+def crops_per_char(ocr, crops):
+    """点选验证码的识别阶段：逐个识别"""
+    return [ocr.classification(np.ascontiguousarray(crop)) for crop in crops]
+
+
+def crops_batched(batch_ocr, crops):
+    """点选验证码的识别阶段：批量识别引擎"""
+    return batch_ocr.recognize([batch_ocr.prepare(crop) for crop in crops])
+
+
+def bench(func, args, repeat):
+    func(*args)  # 预热
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    ocr = ddddocr.DdddOcr(show_ad=False)
+    det = ddddocr.DdddOcr(det=True, ocr=False, show_ad=False)
+    batch_ocr = BatchOcrEngine(ocr)
+    text_image = make_image('abcd', (120, 40), [(8 + i * 26, 0) for i in range(4)])
+    click_image = make_image('ABCDEF', (340, 160), [(10 + i * 55, 30 + (i % 2) * 60) for i in range(6)])
+    decoded = DecodedImage(click_image)
+    crops = [decoded.gray[y1:y2, x1:x2] for x1, y1, x2, y2 in detect_bboxes(det, decoded.bgr)]
+
+    cases = [
+        ('preprocess', lambda b: preprocess_image(b, enhance=True, denoise=True), (text_image,),
+         lambda b: DecodedImage(b).preprocess(enhance=True, denoise=True).gray, (text_image,)),
+        ('classify+preprocess', classify_legacy, (ocr, text_image), classify_decoded, (ocr, text_image)),
+        ('click_select', select_legacy, (det, ocr, click_image), select_decoded, (det, ocr, click_image)),
+        ('click_select batched', select_legacy, (det, ocr, click_image),
+         select_batched, (det, batch_ocr, click_image)),
+        (f'click ocr ({len(crops)} crops)', crops_per_char, (ocr, crops), crops_batched, (batch_ocr, crops)),
+    ]
+    print(f"{'stage':>20} {'legacy':>10} {'new':>10} {'speedup':>8}")
+    for name, legacy, legacy_args, new_func, new_args in cases:
+        old = bench(legacy, legacy_args, args.repeat)
+        new = bench(new_func, new_args, args.repeat)
+        print(f"{name:>20} {old * 1000:>8.2f}ms {new * 1000:>8.2f}ms {old / new:>7.1f}x")
+
+    # 批量识别必须与逐个识别结果一致
+    per_char = crops_per_char(ocr, crops)
+    batched = crops_batched(batch_ocr, crops)
+    print(f"click ocr parity: {'OK' if per_char == batched else 'MISMATCH'} {per_char} / {batched}")
+    # 裁剪区域缩放后宽度不同时不能合并，推理次数接近裁剪区域数
+    runs = len(batch_ocr._groups([batch_ocr.prepare(crop) for crop in crops]))
+    print(f"click ocr runs: {runs} 次推理 / {len(crops)} 个裁剪区域（batched={batch_ocr.batched}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""HTTP 压测
+
+以固定并发持续请求一个识别接口，输出吞吐量（requests/s）和延迟分位数，用于对比
+gevent（gunicorn）部署与 ASGI（uvicorn）部署。每个请求使用新生成的验证码图片，
+避免命中识别结果缓存。
+
+用法:
+    # 先启动服务（压测时关闭限流），例如
+    #   RATELIMIT_ENABLED=False gunicorn -c gunicorn.conf.py run:app
+    #   RATELIMIT_ENABLED=False uvicorn asgi:app --port 7777
+    python -m benchmarks.load_test --url http://127.0.0.1:7777 --concurrency 16 --duration 20
+
+    # --mode url：图片由压测进程内置的 HTTP 服务提供，服务端按 URL 下载
+    python -m benchmarks.load_test --mode url
+"""
+import argparse
+import base64
+import http.server
+import io
+import itertools
+import json
+import random
+import string
+import threading
+import time
+from collections import Counter
+
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+_counter = itertools.count()
+
+
+def render_captcha(text):
+    """生成 120x40 的文字验证码 PNG"""
+    image = Image.new('RGB', (120, 40), (230, 230, 230))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype('DejaVuSans.ttf', 28)
+    except OSError:
+        font = ImageFont.load_default()
+    draw.text((8, 2), text, fill=(30, 30, 30), font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def random_text():
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=4))
+
+
+class _ImageHandler(http.server.BaseHTTPRequestHandler):
+    """/captcha/<text>.png 返回对应文字的验证码"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        text = self.path.rsplit('/', 1)[-1].split('.')[0].split('-')[0] or 'abcd'
+        body = render_captcha(text)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_image_server(port):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _ImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_request(mode, image_port):
+    """按模式构造请求参数"""
+    text = random_text()
+    if mode == 'url':
+        # 加上序号保证 URL 唯一，不命中下载缓存
+        return {'json': {'image': f'http://127.0.0.1:{image_port}/captcha/{text}-{next(_counter)}.png'}}
+    image = render_captcha(text)
+    if mode == 'binary':
+        return {'data': image, 'headers': {'Content-Type': 'application/octet-stream'}}
+    return {'json': {'image': base64.b64encode(image).decode()}}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def worker(session, url, args, deadline, latencies, statuses, lock):
+    while time.perf_counter() < deadline:
+        kwargs = build_request(args.mode, args.image_port)
+        started = time.perf_counter()
+        try:
+            status = session.post(url, timeout=args.timeout, **kwargs).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] += 1
+
+
+def run(args):
+    url = args.url.rstrip('/') + args.endpoint
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    sessions = [requests.Session() for _ in range(args.concurrency)]  # 每个并发连接保持 keep-alive
+
+    if args.warmup > 0:
+        warmup_deadline = time.perf_counter() + args.warmup
+        threads = [threading.Thread(target=worker, args=(session, url, args, warmup_deadline, [], Counter(), lock))
+                   for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=worker, args=(session, url, args, deadline, latencies, statuses, lock))
+               for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'url': url,
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'duration': round(elapsed, 2),
+        'requests': len(latencies),
+        'status': dict(statuses),
+        'rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 1),
+            'p90': round(percentile(latencies, 0.90) * 1000, 1),
+            'p99': round(percentile(latencies, 0.99) * 1000, 1),
+            'max': round((latencies[-1] if latencies else 0) * 1000, 1)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:7777', help='服务地址')
+    parser.add_argument('--endpoint', default='/classification')
+    parser.add_argument('--mode', choices=('base64', 'binary', 'url'), default='base64', help='图片传递方式')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='压测时长（秒）')
+    parser.add_argument('--warmup', type=float, default=3, help='预热时长（秒），不计入结果')
+    parser.add_argument('--timeout', type=float, default=30, help='单个请求超时（秒）')
+    parser.add_argument('--image-port', type=int, default=8765, help='--mode url 时内置图片服务的端口')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args()
+
+    if args.mode == 'url':
+        start_image_server(args.image_port)
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    latency = result['latency_ms']
+    print(f"{result['url']} mode={result['mode']} concurrency={result['concurrency']} duration={result['duration']}s")
+    print(f"requests: {result['requests']}  status: {result['status']}  throughput: {result['rps']} req/s")
+    print(f"latency: p50={latency['p50']}ms p90={latency['p90']}ms p99={latency['p99']}ms max={latency['max']}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""近似重复图片缓存：命中率和误匹配率
+
+把一组不同的验证码（合成样本或 --images 目录中的图片）的前一半作为已识别的图片放入索引，
+再用以下查询测量各感知哈希和汉明距离阈值的效果：
+
+- 重新编码：索引中的图片以不同 JPEG 质量、加元数据的 PNG 重新编码，应当命中自身
+  - hit：命中的比例；wrong：命中了另一张验证码的比例（会返回错误答案）
+- 未见过：后一半图片及其重新编码的版本，不应命中任何条目
+  - false：命中的比例（索引越大越容易误匹配，可用 --samples 调整索引大小）
+
+只比较尺寸相同的图片（与服务中的命名空间一致）；hash 为单张图片计算哈希的耗时。
+
+用法:
+    python -m benchmarks.near_duplicate
+    python -m benchmarks.near_duplicate --kinds text --samples 1000 --thresholds 4,8,16
+    python -m benchmarks.near_duplicate --images captchas/ --hashes dhash:16,phash:16
+"""
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from app.utils.image_processor import DecodedImage
+from app.utils.near_duplicate import HASH_FUNCTIONS, _POPCOUNT
+from benchmarks import fixtures
+
+JPEG_QUALITIES = (95, 75, 50, 30)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+
+def variants(data):
+    """同一张图片的重新编码版本：{名称: 字节}"""
+    image = Image.open(io.BytesIO(data)).convert('RGB')
+    result = {}
+    for quality in JPEG_QUALITIES:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality)
+        result[f'jpeg{quality}'] = buffer.getvalue()
+    info = PngInfo()
+    info.add_text('Comment', f'served at {time.time()}')
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', pnginfo=info, optimize=True)
+    result['png_meta'] = buffer.getvalue()
+    return result
+
+
+def load_images(kinds, count, seed, directory):
+    """返回不同验证码的原图字节，按 (来源, 图片) 列出"""
+    if directory:
+        names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+        images = []
+        for name in names[:count or None]:
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append(f.read())
+        return {os.path.basename(os.path.normpath(directory)): images}
+    return {kind: [sample['image'] for sample in fixtures.generate(kind, count, seed)] for kind in kinds}
+
+
+def _hash_all(function, size, images):
+    """[(尺寸, 哈希)]，以及每张图片计算哈希的平均耗时（微秒）"""
+    decoded = [DecodedImage(data) for data in images]
+    for image in decoded:
+        image.gray  # 只统计哈希，不统计解码
+    started = time.perf_counter()
+    hashes = [(image.gray.shape, function(image.gray, size)) for image in decoded]
+    return hashes, (time.perf_counter() - started) / len(decoded) * 1e6
+
+
+def nearest(index, query):
+    """索引中与 query 尺寸相同、距离最近的条目：(序号, 距离)，没有时为 (None, None)"""
+    shape, value = query
+    rows = [i for i, (entry_shape, _) in enumerate(index) if entry_shape == shape]
+    if not rows:
+        return None, None
+    distances = _POPCOUNT[np.bitwise_xor(np.stack([index[i][1] for i in rows]), value)].sum(axis=1)
+    best = int(distances.argmin())
+    return rows[best], int(distances[best])
+
+
+def evaluate(images, function, size):
+    """
+    计算所有查询与索引的最近距离
+
+    Returns:
+        tuple: (已索引图片的重新编码 [(自身序号, 最近序号, 距离)], 未见过的图片 [距离], 哈希耗时)
+    """
+    half = max(1, len(images) // 2)
+    index, hash_time = _hash_all(function, size, images[:half])
+    known = []
+    for i, data in enumerate(images[:half]):
+        queries, _ = _hash_all(function, size, list(variants(data).values()))
+        for query in queries:
+            match, distance = nearest(index, query)
+            known.append((i, match, distance))
+    unseen = []
+    for data in images[half:]:
+        queries, _ = _hash_all(function, size, [data] + list(variants(data).values()))
+        unseen.extend(nearest(index, query)[1] for query in queries)
+    return known, unseen, hash_time
+
+
+def _rate(count, total):
+    return f"{count / total * 100:.1f}%" if total else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kinds', default='text,arithmetic,click', help='合成样本类型')
+    parser.add_argument('--images', metavar='DIR', help='使用目录中的真实验证码（每个文件是一张不同的验证码）')
+    parser.add_argument('--samples', type=int, default=200, help='每种样本的数量（一半放入索引）')
+    parser.add_argument('--hashes', default='dhash:8,dhash:16,phash:8,phash:16', help='哈希方法:边长（位数为边长的平方）')
+    parser.add_argument('--thresholds', default='0,2,4,8,12,16,24,32', help='汉明距离阈值')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    thresholds = [int(value) for value in args.thresholds.split(',') if value.strip()]
+    hashes = []
+    for item in args.hashes.split(','):
+        name, _, size = item.strip().partition(':')
+        if name not in HASH_FUNCTIONS:
+            parser.error(f"未知哈希方法: {name}，可选 {', '.join(HASH_FUNCTIONS)}")
+        hashes.append((name, int(size or 16)))
+    sources = load_images(args.kinds.split(','), args.samples, args.seed, args.images)
+
+    print(f"{'source':>12} {'hash':>6} {'bits':>5} {'hash':>8} {'max':>4} {'hit':>7} {'wrong':>7} {'false':>7}")
+    for source, images in sources.items():
+        if len(images) < 2:
+            print(f"{source}: 至少需要 2 张图片")
+            continue
+        for name, size in hashes:
+            known, unseen, hash_time = evaluate(images, HASH_FUNCTIONS[name], size)
+            for threshold in thresholds:
+                hits = [(own, match) for own, match, distance in known if distance is not None and distance <= threshold]
+                wrong = sum(own != match for own, match in hits)
+                false = sum(distance is not None and distance <= threshold for distance in unseen)
+                print(f"{source:>12} {name:>6} {size * size:>5} {hash_time:>6.1f}us {threshold:>4} "
+                      f"{_rate(len(hits), len(known)):>7} {_rate(wrong, len(known)):>7} {_rate(false, len(unseen)):>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""onnxruntime 会话参数扫描
+
+对每个模型和参数组合（intra-op 线程数、图优化级别、执行模式、线程自旋、INT8 量化）创建
+推理会话，用 --concurrency 个线程同时推理合成样本（模拟 worker 数 * 推理线程数），
+输出吞吐量、每核吞吐量、CPU 占用、延迟和与基准组合的结果一致率。
+
+- img/s：墙钟吞吐量；img/s/core：吞吐量 / 可用核数（扩容时按核计算的容量）
+- cpu：平均占用的核数；img/cpu-s：每 CPU 秒处理的图片数（线程过多时自旋和调度的开销会使其下降）
+- match：与该模型第一个组合的输出一致的比例（量化版本与原模型比较；OCR 为识别文本，检测为检测框）
+
+模型：
+- ocr：默认的 common_old.onnx（本身是动态量化模型）
+- ocr_beta / ocr_beta_int8：common.onnx 及其动态量化版本
+- det / det_int8：检测模型及其静态量化版本（用另一组点选样本校准）
+
+用法:
+    python -m benchmarks.ort_sweep
+    python -m benchmarks.ort_sweep --models det,det_int8 --threads 1,2,4 --concurrency 1,4 --duration 5
+    python -m benchmarks.ort_sweep --graph-opt disable,basic,all --exec-mode sequential,parallel --spinning on,off
+"""
+import argparse
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+import ddddocr
+import numpy as np
+import onnxruntime
+
+from app.services import runtime
+from app.services.detection import detect_bboxes, preprocess_input
+from app.services.ocr_engine import BatchOcrEngine
+from app.services.runtime import ort_runtime
+from app.utils.image_processor import DecodedImage
+from benchmarks import fixtures
+
+MODEL_DIR = os.path.dirname(ddddocr.__file__)
+MODELS = ('ocr', 'ocr_beta', 'ocr_beta_int8', 'det', 'det_int8')
+
+
+def _csv(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+class OcrTarget:
+    """OCR 模型：每张图片一次 session.run + 贪心解码"""
+
+    def __init__(self, path, samples):
+        self.path = path
+        ocr = ddddocr.DdddOcr(show_ad=False)
+        self.decoder = BatchOcrEngine(ocr)
+        self.inputs = [self.decoder.prepare(DecodedImage(s['image']).gray)[None, None] for s in samples]
+        self.session = None
+
+    def load(self):
+        self.session = ort_runtime.create_session(self.path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run(self, i):
+        logits = self.session.run(None, {self.input_name: self.inputs[i]})[0]
+        return self.decoder.decode(logits.transpose(1, 0, 2).argmax(axis=-1))[0]
+
+    @staticmethod
+    def same(a, b):
+        return a == b
+
+
+class DetTarget:
+    """检测模型：完整的 detect_bboxes（预处理、推理、NMS）"""
+
+    def __init__(self, path, samples):
+        self.path = path
+        self.det = ddddocr.DdddOcr(det=True, show_ad=False)
+        self.inputs = [DecodedImage(s['image']).bgr for s in samples]
+
+    def load(self):
+        self.det.detection_engine.session = ort_runtime.create_session(self.path)
+
+    def run(self, i):
+        return detect_bboxes(self.det, self.inputs[i])
+
+    @staticmethod
+    def same(a, b):
+        """检测框数量相同且一一对应（坐标误差不超过 3 像素）"""
+        if len(a) != len(b):
+            return False
+        return all(any(np.abs(np.subtract(box, other)).max() <= 3 for other in b) for box in a)
+
+
+def build_targets(names, samples, seed, workdir):
+    targets = {}
+    for name in names:
+        if name == 'ocr':
+            targets[name] = OcrTarget(os.path.join(MODEL_DIR, 'common_old.onnx'), samples['text'])
+        elif name == 'ocr_beta':
+            targets[name] = OcrTarget(os.path.join(MODEL_DIR, 'common.onnx'), samples['text'])
+        elif name == 'ocr_beta_int8':
+            path = os.path.join(workdir, 'common.int8.onnx')
+            runtime.quantize_dynamic(os.path.join(MODEL_DIR, 'common.onnx'), path)
+            targets[name] = OcrTarget(path, samples['text'])
+        elif name == 'det':
+            targets[name] = DetTarget(os.path.join(MODEL_DIR, 'common_det.onnx'), samples['click'])
+        elif name == 'det_int8':
+            engine = ddddocr.DdddOcr(det=True, show_ad=False).detection_engine
+            calibration = [
+                preprocess_input(engine, DecodedImage(s['image']).bgr)
+                for s in fixtures.generate('click', runtime.CALIBRATION_IMAGES, seed + 1)
+            ]
+            path = os.path.join(workdir, 'common_det.int8.onnx')
+            runtime.quantize_static(os.path.join(MODEL_DIR, 'common_det.onnx'), path, calibration)
+            targets[name] = DetTarget(path, samples['click'])
+        else:
+            raise SystemExit(f"未知模型: {name}，可选 {', '.join(MODELS)}")
+    return targets
+
+
+def measure(target, concurrency, duration):
+    """
+    concurrency 个线程共享同一个会话推理 duration 秒
+
+    Returns:
+        dict: 吞吐量、CPU 占用、延迟和每个样本的输出
+    """
+    target.run(0)  # 预热
+    count = len(target.inputs)
+    outputs = [None] * count
+    latencies = []
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        while True:
+            n = next(counter)
+            if n >= count and time.perf_counter() >= deadline:
+                break
+            started = time.perf_counter()
+            result = target.run(n % count)
+            local.append(time.perf_counter() - started)
+            if n < count:
+                outputs[n] = result
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+
+    images = len(latencies)
+    return {
+        'throughput': images / wall,
+        'cpu': cpu / wall,
+        'per_cpu_second': images / cpu if cpu else 0.0,
+        'p50': float(np.percentile(latencies, 50)) * 1000,
+        'p95': float(np.percentile(latencies, 95)) * 1000,
+        'outputs': outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    cores = runtime.cpu_count()
+    default_threads = sorted({1, max(1, cores // 2), cores})
+    parser.add_argument('--models', default='ocr,det,det_int8', help=f"可选 {', '.join(MODELS)}")
+    parser.add_argument('--threads', default=','.join(map(str, default_threads)), help='intra-op 线程数')
+    parser.add_argument('--concurrency', default=f"1,{cores}", help='同时推理的线程数')
+    parser.add_argument('--graph-opt', default='all', help='disable,basic,extended,all')
+    parser.add_argument('--exec-mode', default='sequential', help='sequential,parallel')
+    parser.add_argument('--spinning', default='on', help='on,off')
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duration', type=float, default=3.0, help='每个组合的压测时间（秒）')
+    args = parser.parse_args()
+
+    # common.onnx 声明的输出形状与实际不符，每次推理都会告警
+    onnxruntime.set_default_logger_severity(3)
+    samples = {kind: fixtures.generate(kind, args.samples, args.seed) for kind in ('text', 'click')}
+    grid = list(itertools.product(
+        _csv(args.threads, int), _csv(args.graph_opt), _csv(args.exec_mode),
+        [value == 'on' for value in _csv(args.spinning)], _csv(args.concurrency, int)
+    ))
+    print(f"cpu cores: {cores}")
+    print(
+        f"{'model':>14} {'intra':>5} {'opt':>8} {'mode':>10} {'spin':>4} {'conc':>4} "
+        f"{'img/s':>8} {'img/s/core':>10} {'cpu':>5} {'img/cpu-s':>9} {'p50':>8} {'p95':>8} {'match':>6}"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        targets = build_targets(_csv(args.models), samples, args.seed, workdir)
+        baselines = {}
+        for name, target in targets.items():
+            for threads, graph_opt, exec_mode, spinning, concurrency in grid:
+                ort_runtime.configure(
+                    intra_op_threads=threads, graph_optimization=graph_opt,
+                    execution_mode=exec_mode, allow_spinning=spinning
+                )
+                target.load()
+                result = measure(target, concurrency, args.duration)
+                baseline = baselines.setdefault(name.replace('_int8', ''), result['outputs'])
+                match = sum(map(target.same, result['outputs'], baseline)) / len(baseline)
+                print(
+                    f"{name:>14} {threads:>5} {graph_opt:>8} {exec_mode:>10} {'on' if spinning else 'off':>4} "
+                    f"{concurrency:>4} {result['throughput']:>8.1f} {result['throughput'] / cores:>10.1f} "
+                    f"{result['cpu']:>5.2f} {result['per_cpu_second']:>9.1f} "
+                    f"{result['p50']:>6.2f}ms {result['p95']:>6.2f}ms {match:>6.0%}"
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""滑块引擎基准
+
+对比 ddddocr 自带的滑块匹配/对比与 app.services.slider（OpenCV 金字塔匹配）在合成样本上的
+耗时和正确率。total 从图片字节流开始计时，与服务中的调用方式一致（DecodedImage 解码后
+ddddocr 使用 RGB 数组，OpenCV 实现使用灰度数组和透明通道）；match 只统计解码之后的部分。
+
+- slide_match: 普通滑块（灰度匹配）
+- slide_match edge: 普通滑块（simple_target=False，边缘匹配）
+- slide_match strip: 带透明通道、与背景同高的异形滑块条
+- slide_comparison: 带缺口的背景与完整背景对比
+
+缺口中心 x 坐标与标准答案相差不超过 --tolerance 像素视为正确。
+
+用法:
+    python -m benchmarks.slider_engines [--samples 50] [--seed 0]
+"""
+import argparse
+import time
+
+import ddddocr
+
+from app.services import slider
+from app.utils.image_processor import DecodedImage
+from benchmarks import fixtures
+
+
+def match_ddddocr(ocr, sliding, back, simple_target):
+    return ocr.slide_match(sliding.rgb, back.rgb, simple_target=simple_target)
+
+
+def match_opencv(ocr, sliding, back, simple_target):
+    return slider.slide_match(sliding.gray, back.gray, sliding.alpha, simple_target=simple_target)
+
+
+def compare_ddddocr(ocr, target, background, simple_target):
+    return ocr.slide_comparison(target.rgb, background.rgb)
+
+
+def compare_opencv(ocr, target, background, simple_target):
+    return slider.slide_comparison(target.bgr, background.bgr)
+
+
+def _decoded(data):
+    """解码并缓存各种格式的数组，之后的调用只包含匹配本身"""
+    image = DecodedImage(data)
+    image.gray
+    image.alpha
+    return image
+
+
+def run(func, ocr, samples, fields, simple_target, tolerance):
+    """返回 (平均总耗时, 平均匹配耗时, 正确率, 正确样本的平均得分, 错误样本的平均得分)"""
+    first, second = fields
+    func(ocr, DecodedImage(samples[0][first]), DecodedImage(samples[0][second]), simple_target)  # 预热
+    total = match = 0.0
+    correct, scores = 0, {True: [], False: []}
+    for sample in samples:
+        started = time.perf_counter()
+        func(ocr, DecodedImage(sample[first]), DecodedImage(sample[second]), simple_target)
+        total += time.perf_counter() - started
+
+        images = _decoded(sample[first]), _decoded(sample[second])
+        started = time.perf_counter()
+        result = func(ocr, *images, simple_target)
+        match += time.perf_counter() - started
+
+        ok = abs(result['target'][0] - sample['target_x']) <= tolerance
+        correct += ok
+        scores[ok].append(result.get('confidence', float('nan')))
+
+    def mean(values):
+        return sum(values) / len(values) if values else float('nan')
+
+    count = len(samples)
+    return total / count, match / count, correct / count, mean(scores[True]), mean(scores[False])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=int, default=3, help='允许的 x 坐标误差（像素）')
+    args = parser.parse_args()
+
+    ocr = ddddocr.DdddOcr(show_ad=False)
+    sliders = fixtures.generate('slider', args.samples, args.seed)
+    strips = fixtures.generate('slider_strip', args.samples, args.seed)
+    pieces, holes = ('sliding', 'back'), ('back', 'full')
+    cases = [
+        ('slide_match', match_ddddocr, match_opencv, sliders, pieces, True),
+        ('slide_match edge', match_ddddocr, match_opencv, sliders, pieces, False),
+        ('slide_match strip', match_ddddocr, match_opencv, strips, pieces, True),
+        ('slide_comparison', compare_ddddocr, compare_opencv, sliders, holes, True),
+    ]
+
+    print(
+        f"{'case':>18} {'engine':>8} {'total':>10} {'match':>10} {'speedup':>8} "
+        f"{'accuracy':>9} {'conf ok':>8} {'conf bad':>9}"
+    )
+    for name, legacy, new, samples, fields, simple_target in cases:
+        base = None
+        for engine, func in (('ddddocr', legacy), ('opencv', new)):
+            total, match, accuracy, conf_ok, conf_bad = run(
+                func, ocr, samples, fields, simple_target, args.tolerance
+            )
+            base = base or match
+            print(
+                f"{name:>18} {engine:>8} {total * 1000:>8.2f}ms {match * 1000:>8.2f}ms {base / match:>7.1f}x "
+                f"{accuracy:>8.0%} {conf_ok:>8.3f} {conf_bad:>9.3f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
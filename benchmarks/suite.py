@@ -0,0 +1,431 @@
+"""识别接口基准套件
+
+用 fixtures 生成的合成样本依次压测 captcha_routes 中的每个接口，按接口输出吞吐量、
+延迟分位数、CPU 时间、RSS 峰值和识别正确率；--json 保存结果，--compare 对比两次结果，
+用于检查 ddddocr 升级或配置调整（WORKERS、MAX_BATCH_SIZE 等）的影响。
+
+- inprocess（默认）：在当前进程中创建应用，用 Flask test client 直接调用，关闭限流和
+  结果缓存；CPU/RSS 为当前进程（包含压测线程本身）
+- http：请求已启动的服务（需以 RATELIMIT_ENABLED=False RESULT_CACHE_ENABLED=False 启动），
+  指定 --server-pid 时统计该进程及其子进程（gunicorn worker）的 CPU/RSS
+
+用法:
+    python -m benchmarks.suite --concurrency 4 --duration 10 --json results/HEAD.json
+    python -m benchmarks.suite --mode http --url http://127.0.0.1:7777 --server-pid $(pgrep -o gunicorn)
+    python -m benchmarks.suite --endpoints classification,select --requests 100
+    python -m benchmarks.suite --compare results/base.json results/HEAD.json
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+from benchmarks import fixtures
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+# 滑块位置允许的误差（像素）
+SLIDE_TOLERANCE = 6
+# 每次批量识别的图片数
+BATCH_IMAGES = 8
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _text_of(body):
+    return (body.get('result') or {}).get('text')
+
+
+class Case:
+    """一个接口的压测用例"""
+
+    def __init__(self, name, path, kind, build, check=None):
+        """
+        Args:
+            name: 结果中的接口名
+            path: 请求路径
+            kind: fixtures 中的样本类型
+            build: 样本 -> JSON 请求体
+            check: (样本, 响应 JSON) -> 是否识别正确，None 表示不统计正确率
+        """
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.build = build
+        self.check = check
+
+
+def _batch_payload(samples, index):
+    batch = [samples[(index + i) % len(samples)] for i in range(BATCH_IMAGES)]
+    return {'images': [_b64(sample['image']) for sample in batch]}
+
+
+def _position(body):
+    return (body.get('result') or {}).get('position', -SLIDE_TOLERANCE * 10)
+
+
+CASES = [
+    Case('classification', '/classification', 'text',
+         lambda s: {'image': _b64(s['image'])},
+         lambda s, body: (_text_of(body) or '').lower() == s['text']),
+    Case('batch_classification', '/batch/classification', 'text', None),
+    Case('calculate', '/calculate', 'arithmetic',
+         lambda s: {'image': _b64(s['image'])},
+         lambda s, body: body.get('result') == s['answer']),
+    Case('capcode', '/capcode', 'slider',
+         lambda s: {'slidingImage': _b64(s['sliding']), 'backImage': _b64(s['back'])},
+         lambda s, body: abs(_position(body) - s['target_x']) <= SLIDE_TOLERANCE),
+    Case('slideComparison', '/slideComparison', 'slider',
+         lambda s: {'slidingImage': _b64(s['back']), 'backImage': _b64(s['full'])},
+         lambda s, body: abs((body.get('result') or 0) - s['target_x']) <= SLIDE_TOLERANCE),
+    Case('crop', '/crop', 'slider',
+         lambda s: {'image': _b64(s['combined']), 'y_coordinate': s['split_y']},
+         lambda s, body: 'slidingImage' in body and 'backImage' in body),
+    Case('detection', '/detection', 'click',
+         lambda s: {'image': _b64(s['image'])},
+         lambda s, body: len(body.get('result') or []) == len(s['chars'])),
+    Case('select', '/select', 'click',
+         lambda s: {'image': _b64(s['image'])},
+         lambda s, body: sorted(item['text'].upper() for item in body.get('result') or []) == sorted(s['chars'])),
+]
+
+
+class InProcessTarget:
+    """在当前进程中调用 Flask 应用"""
+
+    def __init__(self):
+        from app import create_app
+        from app.config import Config
+
+        class BenchConfig(Config):
+            RATELIMIT_ENABLED = False
+            RESULT_CACHE_ENABLED = False
+            MODEL_WARMUP = 'ocr,batch_ocr,det'
+
+        self.app = create_app(BenchConfig)
+        self._local = threading.local()
+
+    def post(self, path, payload, timeout):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, json=payload)
+        return response.status_code, response.get_json(silent=True) or {}
+
+    def pids(self):
+        return [os.getpid()]
+
+
+class HttpTarget:
+    """请求已启动的服务"""
+
+    def __init__(self, url, server_pid=None):
+        import requests
+
+        self.url = url.rstrip('/')
+        self.server_pid = server_pid
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, path, payload, timeout):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()  # 每个压测线程保持 keep-alive
+        try:
+            response = session.post(self.url + path, json=payload, timeout=timeout)
+        except self._requests.RequestException as e:
+            return type(e).__name__, {}
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def pids(self):
+        return [self.server_pid] if self.server_pid else []
+
+
+def _process_tree(pids):
+    """pids 及其所有子孙进程"""
+    result, pending = [], list(pids)
+    while pending:
+        pid = pending.pop()
+        result.append(pid)
+        try:
+            with open(f'/proc/{pid}/task/{pid}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return result
+
+
+def _cpu_seconds(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class ResourceSampler:
+    """统计压测期间进程树的 CPU 时间和 RSS 峰值（Linux /proc）"""
+
+    def __init__(self, pids, interval=0.1):
+        self.pids = pids
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._cpu_start = {}
+
+    def _cpu(self):
+        return {pid: _cpu_seconds(pid) for pid in _process_tree(self.pids)}
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, sum(_rss_bytes(pid) for pid in _process_tree(self.pids)))
+
+    def __enter__(self):
+        if self.pids:
+            self._cpu_start = self._cpu()
+            self.peak_rss = sum(_rss_bytes(pid) for pid in _process_tree(self.pids))
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # 期间新建的进程从 0 开始计算
+        cpu_end = self._cpu() if self.pids else {}
+        self.cpu_seconds = sum(cpu_end[pid] - self._cpu_start.get(pid, 0.0) for pid in cpu_end)
+        return False
+
+    def result(self, elapsed):
+        if not self.pids:
+            return {'cpu_seconds': None, 'cpu_percent': None, 'peak_rss_mb': None}
+        return {
+            'cpu_seconds': round(self.cpu_seconds, 3),
+            'cpu_percent': round(self.cpu_seconds / elapsed * 100, 1) if elapsed else 0,
+            'peak_rss_mb': round(self.peak_rss / 1024 / 1024, 1)
+        }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_case(target, case, samples, args):
+    """按固定并发压测一个接口"""
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, statuses = [], Counter()
+    checked = correct = 0
+
+    def payload_for(index):
+        if case.build is None:
+            return _batch_payload(samples, index)
+        return case.build(samples[index % len(samples)])
+
+    def worker(deadline, limit, record):
+        nonlocal checked, correct
+        while True:
+            index = next(counter)
+            if (limit and index >= limit) or time.perf_counter() >= deadline:
+                return
+            payload = payload_for(index)
+            started = time.perf_counter()
+            status, body = target.post(case.path, payload, args.timeout)
+            elapsed = time.perf_counter() - started
+            if not record:
+                continue
+            ok = case.check(samples[index % len(samples)], body) if case.check and status == 200 else None
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] += 1
+                if ok is not None:
+                    checked += 1
+                    correct += ok
+
+    def run_workers(deadline, limit, record):
+        threads = [threading.Thread(target=worker, args=(deadline, limit, record)) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # 预热：每个线程至少完成一次请求（加载模型、建立连接）
+    run_workers(time.perf_counter() + args.warmup, args.concurrency, False)
+
+    counter = itertools.count()
+    deadline = time.perf_counter() + (args.duration if not args.requests else float('inf'))
+    with ResourceSampler(target.pids()) as sampler:
+        started = time.perf_counter()
+        run_workers(deadline, args.requests, True)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'status': dict(statuses),
+        'duration': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p90': round(percentile(latencies, 0.90) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round((latencies[-1] if latencies else 0) * 1000, 2)
+        },
+        'accuracy': round(correct / checked, 4) if checked else None,
+    }
+    result.update(sampler.result(elapsed))
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _version(module):
+    try:
+        return __import__(module).__version__
+    except Exception:
+        return None
+
+
+def metadata(args):
+    """记录影响结果的环境和配置，便于对比时确认两次运行条件一致"""
+    settings = ('WORKERS', 'MAX_BATCH_SIZE', 'MICRO_BATCH_ENABLED', 'MICRO_BATCH_MAX_SIZE', 'MICRO_BATCH_MAX_WAIT_MS',
+                'INFERENCE_POOL_SIZE', 'INFERENCE_QUEUE_SIZE', 'OMP_NUM_THREADS')
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git': _git_revision(),
+        'python': platform.python_version(),
+        'ddddocr': _version('ddddocr'),
+        'onnxruntime': _version('onnxruntime'),
+        'cpu_count': os.cpu_count(),
+        'mode': args.mode,
+        'url': args.url if args.mode == 'http' else None,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'requests': args.requests,
+        'samples': args.samples,
+        'seed': args.seed,
+        'env': {name: os.environ[name] for name in settings if name in os.environ},
+    }
+
+
+def print_results(results):
+    print(f"{'endpoint':>22} {'req':>6} {'rps':>8} {'p50':>9} {'p99':>9} {'cpu%':>6} {'rss':>8} {'acc':>6} status")
+    for name, r in results.items():
+        cpu = '-' if r['cpu_percent'] is None else f"{r['cpu_percent']:.0f}"
+        rss = '-' if r['peak_rss_mb'] is None else f"{r['peak_rss_mb']:.0f}MB"
+        acc = '-' if r['accuracy'] is None else f"{r['accuracy'] * 100:.0f}%"
+        print(f"{name:>22} {r['requests']:>6} {r['rps']:>8.2f} {r['latency_ms']['p50']:>7.1f}ms "
+              f"{r['latency_ms']['p99']:>7.1f}ms {cpu:>6} {rss:>8} {acc:>6} {r['status']}")
+
+
+def compare(old_path, new_path):
+    """对比两次结果：吞吐量和延迟的相对变化"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('git')} -> {new['meta'].get('git')}")
+
+    def change(before, after):
+        if before in (None, 0) or after is None:
+            return '-'
+        return f"{(after - before) / before * 100:+.1f}%"
+
+    print(f"{'endpoint':>22} {'rps':>18} {'p50':>22} {'p99':>22} {'acc':>14}")
+    for name, after in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            continue
+        print(f"{name:>22} "
+              f"{before['rps']:>7.1f}->{after['rps']:<7.1f}{change(before['rps'], after['rps']):>3} "
+              f"{before['latency_ms']['p50']:>7.1f}->{after['latency_ms']['p50']:<7.1f}"
+              f"{change(before['latency_ms']['p50'], after['latency_ms']['p50']):>6} "
+              f"{before['latency_ms']['p99']:>7.1f}->{after['latency_ms']['p99']:<7.1f}"
+              f"{change(before['latency_ms']['p99'], after['latency_ms']['p99']):>6} "
+              f"{before['accuracy'] if before['accuracy'] is not None else '-'}->"
+              f"{after['accuracy'] if after['accuracy'] is not None else '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--url', default='http://127.0.0.1:7777', help='--mode http 时的服务地址')
+    parser.add_argument('--server-pid', type=int, help='--mode http 时统计 CPU/RSS 的服务进程（包含子进程）')
+    parser.add_argument('--endpoints', default='', help='逗号分隔的接口名，默认全部: '
+                        + ','.join(case.name for case in CASES))
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10, help='每个接口的压测时长（秒）')
+    parser.add_argument('--requests', type=int, default=0, help='每个接口的请求数（设置后忽略 --duration）')
+    parser.add_argument('--warmup', type=float, default=2, help='每个接口的预热时长上限（秒）')
+    parser.add_argument('--timeout', type=float, default=30, help='单个请求超时（秒）')
+    parser.add_argument('--samples', type=int, default=32, help='每种样本的数量（循环使用）')
+    parser.add_argument('--seed', type=int, default=0, help='样本随机种子')
+    parser.add_argument('--json', metavar='PATH', help='结果保存为 JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='对比两个 JSON 结果后退出')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    selected = [name for name in args.endpoints.split(',') if name]
+    unknown = set(selected) - {case.name for case in CASES}
+    if unknown:
+        parser.error(f"未知接口: {', '.join(sorted(unknown))}")
+    cases = [case for case in CASES if not selected or case.name in selected]
+
+    target = InProcessTarget() if args.mode == 'inprocess' else HttpTarget(args.url, args.server_pid)
+    samples = {}
+    results = {}
+    for case in cases:
+        if case.kind not in samples:
+            samples[case.kind] = fixtures.generate(case.kind, args.samples, args.seed)
+        results[case.name] = run_case(target, case, samples[case.kind], args)
+        result = results[case.name]
+        print(f"{case.name}: {result['rps']} req/s, p50 {result['latency_ms']['p50']}ms", file=sys.stderr)
+    print_results(results)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump({'meta': metadata(args), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.json}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""上传格式基准
+
+对比同一张图片分别以 JSON（base64）、multipart/form-data、application/octet-stream
+上传时的请求体大小，以及服务端解析请求体并取得图片字节（get_request_data +
+get_image_bytes）的耗时和吞吐量，不包含模型推理。
+
+用法:
+    python -m benchmarks.upload_formats [--repeat 50]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import time
+
+from flask import Flask
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import EnvironBuilder, encode_multipart
+
+from app.utils.image_processor import get_image_bytes
+from app.utils.request_parser import get_request_data
+
+
+def build_bodies(payload):
+    """构造三种格式的请求体，返回 [(名称, Content-Type, 请求体)]"""
+    boundary, multipart = encode_multipart(MultiDict({
+        'image': FileStorage(io.BytesIO(payload), filename='image.png')
+    }))
+    return [
+        ('json/base64', 'application/json', json.dumps({'image': base64.b64encode(payload).decode()}).encode()),
+        ('multipart', f'multipart/form-data; boundary={boundary}', multipart),
+        ('octet-stream', 'application/octet-stream', payload),
+    ]
+
+
+def bench(app, content_type, body, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        environ = EnvironBuilder(
+            method='POST', content_type=content_type, input_stream=io.BytesIO(body), content_length=len(body)
+        ).get_environ()
+        with app.request_context(environ):
+            started = time.perf_counter()
+            get_image_bytes(get_request_data()['image'])
+            best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    print(f"{'image':>8} {'format':>14} {'body':>10} {'parse':>10} {'throughput':>12}")
+    for size_kb in (8, 256, 2048):
+        payload = os.urandom(size_kb * 1024)
+        for name, content_type, body in build_bodies(payload):
+            elapsed = bench(app, content_type, body, args.repeat)
+            throughput = len(payload) / elapsed / 1024 / 1024
+            print(f"{size_kb:>6}KB {name:>14} {len(body) / 1024:>8.0f}KB {elapsed * 1000:>8.3f}ms "
+                  f"{throughput:>8.0f}MB/s")
+
+
+if __name__ == '__main__':
+    main()
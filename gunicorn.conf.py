@@ -1,10 +1,20 @@
 """Gunicorn 配置文件"""
+import gc
 import os
+import shutil
+
+# 多 worker 指标汇总：各 worker 把指标写入该目录下的文件，/metrics 和 /stats 抓取时合并。
+# 需在预加载应用（导入 prometheus_client）之前设置，启动时清空上次运行留下的文件
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/captcha-api-metrics')
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
 
 # 服务器配置
 bind = f"[::]:{os.getenv('PORT', 7777)}"
-workers = int(os.getenv('WORKERS', 1))  # 默认 1 个 worker，节省内存
-worker_class = 'gevent'
+# 默认 1 个 worker，节省内存；按机器的核数和内存调整见 python -m benchmarks.autotune
+workers = int(os.getenv('WORKERS', 1))
+worker_class = os.getenv('WORKER_CLASS', 'gevent')
+threads = int(os.getenv('WORKER_THREADS', 1))  # 只对 gthread worker 有效
 worker_connections = 1000
 timeout = 120
 keepalive = 5
@@ -28,9 +38,16 @@ def on_starting(server):
 
 def when_ready(server):
     """服务就绪时"""
+    # 冻结 master 中预加载的对象，避免 worker 中的垃圾回收触碰这些对象导致写时复制
+    gc.freeze()
     print(f"✅ CAPTCHA API 服务已就绪 - http://localhost:{os.getenv('PORT', 7777)}")
     print(f"📊 Workers: {workers} | Connections: {worker_connections}")
 
+def child_exit(server, worker):
+    """worker 退出时清理其正在处理请求数等实时指标"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
 def on_exit(server):
     """服务退出时"""
     print("👋 CAPTCHA API 服务已停止")